@@ -0,0 +1,518 @@
+"""
+Declarative tool definitions, and a loader which brings the database in line with them.
+
+Each file under biotools/tools/ describes one StandaloneTool as JSON:
+
+    {
+        "name": "NUCmer",
+        "version": "3.23",
+        "settings_section": "MUMmer 3.23",
+        "primary_site": "http://mummer.sourceforge.net/manual/#nucmer",
+        "description": "Description of the tool's FlowBlueprint",
+        "commands": [
+            {
+                "name": "Run NUCmer",
+                "exec_path_setting": "nucmer_bin",
+                "params": [
+                    { "name": "--mum", "prefix": "--mum ", "has_no_value": true,
+                      "short_desc": "Use anchor matches that are unique in both ..." },
+                    { "name": "<reference_in>", "prefix": null, "is_optional": false,
+                      "short_desc": "Input reference FASTA file" }
+                ]
+            }
+        ],
+        "files": [
+            { "relationship": "needs", "filetype": "FASTA (nucleotide)",
+              "command": "Run NUCmer", "params": ["<reference_in>"] }
+        ]
+    }
+
+Executables are looked up in settings.ini, under 'settings_section' (by default the tool's
+name and version) with the key given as 'exec_path_setting'.  A command can give
+'exec_path' directly instead.  Params take any CommandBlueprintParam field and the model's
+defaults otherwise.  Their position is one more than the param before unless given.  File
+relationships are those of Tool.needs(), can_use(), creates() and can_create(), with
+'params' in the same 'name' or 'name=value' form as via_params.
+
+load_definitions() applies any number of definitions in a single transaction, with a fixed
+number of queries to read what's there and bulk INSERTs for what isn't.  Running it again
+only changes what differs, so a definition can be edited and reloaded.  Params, commands
+and file relationships no longer in a definition are removed.  A command which has been
+run is instead detached from the tool's FlowBlueprint, so it's no longer built but the
+Commands referring to it keep their blueprint.
+"""
+
+import configparser
+import glob
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from emergence.libs.bulk import reserve_ids, bulk_create_inherited
+from biotools.models import Filetype, StandaloneTool, Tool, ToolFiletype, ToolFiletypeParam
+from flow import registry
+from flow.exec_template import invalidate as invalidate_exec_template
+from flow.models import Command, CommandBlueprint, CommandBlueprintParam, FlowBlueprint, StepBlueprint
+
+
+DEFINITIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools')
+SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.ini')
+
+## CommandBlueprintParam fields a definition can set, and their values when it doesn't
+PARAM_DEFAULTS = {
+    'prefix': None,
+    'is_optional': True,
+    'is_primary_option': True,
+    'has_no_value': False,
+    'has_quoted_value': False,
+    'default_value': '',
+    'resource': None,
+    'short_desc': '',
+    'long_desc': '',
+}
+
+## relationship -> (io_type, required), as set by the Tool methods of the same names
+RELATIONSHIPS = {
+    'needs': ('i', True),
+    'can_use': ('i', False),
+    'creates': ('o', True),
+    'can_create': ('o', False),
+}
+
+LoadResult = namedtuple('LoadResult', ['added', 'updated', 'unchanged'])
+
+## How many times a load is tried when another one adds the same tool first
+LOAD_ATTEMPTS = 3
+
+
+def read_definitions(paths=None, settings_path=None):
+    """
+    Reads tool definitions (by default every .json file under biotools/tools) and returns
+    them as a list of dicts with executable paths filled in from settings.ini and param
+    positions assigned.
+    """
+    if paths is None:
+        paths = sorted(glob.glob(os.path.join(DEFINITIONS_DIR, '*.json')))
+
+    settings = configparser.ConfigParser()
+    settings.read(settings_path or SETTINGS_PATH)
+
+    definitions = list()
+
+    for path in paths:
+        with open(path) as fh:
+            definition = json.load(fh)
+
+        for key in ('name', 'version'):
+            if key not in definition:
+                raise Exception("ERROR: tool definition {0} has no '{1}'".format(path, key))
+
+        section = definition.get('settings_section', "{0} {1}".format(definition['name'], definition['version']))
+
+        for command in definition.get('commands', list()):
+            if 'exec_path' not in command:
+                try:
+                    command['exec_path'] = settings[section][command['exec_path_setting']]
+                except KeyError:
+                    raise Exception( "ERROR: tool definition {0} needs '{1}' set under [{2}] in settings.ini".format( \
+                                     path, command.get('exec_path_setting'), section) )
+
+            position = 0
+            for param in command.get('params', list()):
+                position = param.get('position', position + 1)
+                param['position'] = position
+
+        definitions.append(definition)
+
+    return definitions
+
+
+def _param_values(param):
+    values = dict(PARAM_DEFAULTS)
+    values.update( (k, v) for k, v in param.items() if k in PARAM_DEFAULTS )
+    values['position'] = param['position']
+    return values
+
+
+def load_definitions(definitions):
+    """
+    Creates or updates the tools described by 'definitions' (see read_definitions) in one
+    transaction.  Returns a LoadResult of the (name, version) of the tools added, updated
+    and found unchanged.
+    """
+    filetype_ids = dict( Filetype.objects.values_list('name', 'id') )
+
+    for definition in definitions:
+        for link in definition.get('files', list()):
+            if link['filetype'] not in filetype_ids:
+                raise Exception( "ERROR: {0} {1} refers to unknown filetype '{2}'".format( \
+                                 definition['name'], definition['version'], link['filetype']) )
+            if link['relationship'] not in RELATIONSHIPS:
+                raise Exception( "ERROR: {0} {1} has unknown relationship '{2}'".format( \
+                                 definition['name'], definition['version'], link['relationship']) )
+
+    for attempt in range(LOAD_ATTEMPTS):
+        try:
+            new_keys, changed_tools, revised_command_bp_ids = _apply_definitions(definitions, filetype_ids)
+            break
+        except IntegrityError:
+            ## another load added one of the new tools first, which we'll see next time
+            if attempt == LOAD_ATTEMPTS - 1:
+                raise
+
+    for command_bp_id in revised_command_bp_ids:
+        invalidate_exec_template(command_bp_id)
+
+    if len(new_keys) > 0 or len(changed_tools) > 0:
+        registry.bump_version()
+
+    added, updated, unchanged = list(), list(), list()
+
+    for definition in definitions:
+        key = (definition['name'], definition['version'])
+
+        if key in new_keys:
+            added.append(key)
+        elif key in changed_tools:
+            updated.append(key)
+        else:
+            unchanged.append(key)
+
+    return LoadResult(added, updated, unchanged)
+
+
+def _apply_definitions(definitions, filetype_ids):
+    """
+    The transaction of load_definitions().  Returns the keys of the tools added, of those
+    changed and the ids of the CommandBlueprints whose params changed.
+    """
+    with transaction.atomic():
+        ## The tools already there are locked until we commit, so a concurrent load of
+        #  the same ones waits here and then reads what we wrote.  Two loads adding the
+        #  same new tool can't both succeed, as (name, version) is unique.
+        keys = set( (d['name'], d['version']) for d in definitions )
+        tools = dict( ((t.name, t.version), t) for t in StandaloneTool.objects.select_for_update() \
+                                                                             .filter(name__in=[k[0] for k in keys]) \
+                                                                             .select_related('flow_bp') \
+                                                     if (t.name, t.version) in keys )
+        changed_tools = set()
+
+        ## CommandBlueprints, by (flow blueprint id, name)
+        command_bps = dict( ((c.parent_id, c.name), c) for c in \
+                            CommandBlueprint.objects.filter(parent__in=[t.flow_bp_id for t in tools.values()]) )
+
+        ## CommandBlueprintParams, by (command blueprint id, name)
+        params = dict( ((p.command_id, p.name), p) for p in \
+                       CommandBlueprintParam.objects.filter(command__in=[c.id for c in command_bps.values()]) )
+
+        ## ToolFiletypes, compared as (tool, filetype, io type, required, params).  Params
+        #  given to copies of the tool's commands (see biotools.pathfinder) don't count.
+        keys_by_tool_id = dict( (t.id, k) for k, t in tools.items() )
+        existing_links = dict()
+
+        link_params = dict()
+        for toolfiletype_id, command_bp_id, param_id, value in \
+                ToolFiletypeParam.objects.filter(toolfiletype__tool__in=list(keys_by_tool_id), \
+                                                 command_bp__parent__in=[t.flow_bp_id for t in tools.values()]) \
+                                         .values_list('toolfiletype_id', 'command_bp_id', 'commandblueprintparam_id', 'value'):
+            link_params.setdefault(toolfiletype_id, set()).add((command_bp_id, param_id, value))
+
+        for id, tool_id, filetype_id, io_type, required in \
+                ToolFiletype.objects.filter(tool__in=list(keys_by_tool_id)) \
+                                    .values_list('id', 'tool_id', 'filetype_id', 'io_type', 'required'):
+            signature = (tool_id, filetype_id, io_type, required, frozenset(link_params.get(id, set())))
+            existing_links.setdefault(signature, list()).append(id)
+
+        ## Tools and their FlowBlueprints
+        new_definitions = [d for d in definitions if (d['name'], d['version']) not in tools]
+        new_flow_bps = list()
+        new_tools = list()
+
+        flow_bp_ids = iter(reserve_ids(StepBlueprint, len(new_definitions)))
+        tool_ids = iter(reserve_ids(Tool, len(new_definitions)))
+
+        for definition in new_definitions:
+            flow_bp = FlowBlueprint( id=next(flow_bp_ids), type='s', description=definition.get('description', '') )
+            tool = StandaloneTool( id=next(tool_ids), name=definition['name'], version=definition['version'], \
+                                   primary_site=definition.get('primary_site', ''), \
+                                   publication=definition.get('publication', ''), flow_bp=flow_bp )
+            new_flow_bps.append(flow_bp)
+            new_tools.append(tool)
+            tools[(tool.name, tool.version)] = tool
+
+        new_keys = set( (t.name, t.version) for t in new_tools )
+        bulk_create_inherited(new_flow_bps)
+        bulk_create_inherited(new_tools)
+
+        for definition in definitions:
+            key = (definition['name'], definition['version'])
+            tool = tools[key]
+
+            if key in new_keys:
+                continue
+
+            if (tool.primary_site, tool.publication) != ( definition.get('primary_site', ''), \
+                                                          definition.get('publication', '') ):
+                Tool.objects.filter(pk=tool.pk).update( primary_site=definition.get('primary_site', ''), \
+                                                        publication=definition.get('publication', '') )
+                changed_tools.add(key)
+
+            if tool.flow_bp.description != definition.get('description', ''):
+                FlowBlueprint.objects.filter(pk=tool.flow_bp_id).update(description=definition.get('description', ''))
+                changed_tools.add(key)
+
+        ## CommandBlueprints
+        new_command_bps = list()
+        revised_command_bp_ids = set()
+
+        for definition in definitions:
+            key = (definition['name'], definition['version'])
+            tool = tools[key]
+
+            for command in definition.get('commands', list()):
+                command_bp = command_bps.get((tool.flow_bp_id, command['name']))
+                values = { 'exec_path': command['exec_path'], 'cpus': command.get('cpus', 1), \
+                           'memory': command.get('memory', 0) }
+
+                if command_bp is None:
+                    command_bp = CommandBlueprint( parent_id=tool.flow_bp_id, root_id=tool.flow_bp_id, \
+                                                   name=command['name'], **values )
+                    new_command_bps.append(command_bp)
+                    command_bps[(tool.flow_bp_id, command['name'])] = command_bp
+                    changed_tools.add(key)
+
+                elif any(getattr(command_bp, k) != v for k, v in values.items()):
+                    CommandBlueprint.objects.filter(pk=command_bp.pk).update(**values)
+                    revised_command_bp_ids.add(command_bp.id)
+                    changed_tools.add(key)
+
+        for command_bp, id in zip(new_command_bps, reserve_ids(StepBlueprint, len(new_command_bps))):
+            command_bp.id = id
+        bulk_create_inherited(new_command_bps)
+
+        ## CommandBlueprintParams
+        new_params = list()
+
+        for definition in definitions:
+            key = (definition['name'], definition['version'])
+            flow_bp_id = tools[key].flow_bp_id
+
+            for command in definition.get('commands', list()):
+                command_bp = command_bps[(flow_bp_id, command['name'])]
+
+                for param_def in command.get('params', list()):
+                    values = _param_values(param_def)
+                    param = params.get((command_bp.id, param_def['name']))
+
+                    if param is None:
+                        param = CommandBlueprintParam( command_id=command_bp.id, name=param_def['name'], **values )
+                        new_params.append(param)
+                        params[(command_bp.id, param.name)] = param
+                        revised_command_bp_ids.add(command_bp.id)
+                        changed_tools.add(key)
+
+                    elif any(getattr(param, k) != v for k, v in values.items()):
+                        CommandBlueprintParam.objects.filter(pk=param.pk).update(**values)
+                        revised_command_bp_ids.add(command_bp.id)
+                        changed_tools.add(key)
+
+        for param, id in zip(new_params, reserve_ids(CommandBlueprintParam, len(new_params))):
+            param.id = id
+        bulk_create_inherited(new_params)
+
+        ## ToolFiletypes and their params
+        new_links = list()
+        new_link_params = list()
+
+        for definition in definitions:
+            key = (definition['name'], definition['version'])
+            tool = tools[key]
+
+            for link in definition.get('files', list()):
+                io_type, required = RELATIONSHIPS[link['relationship']]
+                command_bp = command_bps[(tool.flow_bp_id, link['command'])]
+
+                via = list()
+                for param_string in link.get('params', list()):
+                    if "=" in param_string:
+                        name, value = param_string.split("=", 1)
+                    else:
+                        name, value = param_string, None
+
+                    if (command_bp.id, name) not in params:
+                        raise Exception( "ERROR: {0} {1} refers to unknown param '{2}' of '{3}'".format( \
+                                         definition['name'], definition['version'], name, command_bp.name) )
+
+                    via.append((command_bp.id, params[(command_bp.id, name)].id, value))
+
+                signature = (tool.id, filetype_ids[link['filetype']], io_type, required, frozenset(via))
+
+                if len(existing_links.get(signature, list())) > 0:
+                    existing_links[signature].pop()
+                    continue
+
+                toolfiletype = ToolFiletype( tool_id=tool.id, filetype_id=filetype_ids[link['filetype']], \
+                                             io_type=io_type, required=required )
+                new_links.append(toolfiletype)
+                new_link_params.append(via)
+                changed_tools.add(key)
+
+        for toolfiletype, id in zip(new_links, reserve_ids(ToolFiletype, len(new_links))):
+            toolfiletype.id = id
+        bulk_create_inherited(new_links)
+
+        ToolFiletypeParam.objects.bulk_create( [ ToolFiletypeParam( toolfiletype_id=toolfiletype.id, command_bp_id=command_bp_id, \
+                                                                    commandblueprintparam_id=param_id, value=value ) \
+                                                 for toolfiletype, via in zip(new_links, new_link_params) \
+                                                 for command_bp_id, param_id, value in via ] )
+
+        ## whatever's left over is no longer in the definitions
+        stale_link_ids = list()
+        for signature, ids in existing_links.items():
+            if len(ids) > 0:
+                stale_link_ids.extend(ids)
+                changed_tools.add(keys_by_tool_id[signature[0]])
+
+        if len(stale_link_ids) > 0:
+            ToolFiletype.objects.filter(id__in=stale_link_ids).delete()
+
+        ## Commands and params no longer in the definitions.  Deleting a param takes the
+        #  values old Commands had for it too, but their exec strings are kept.
+        keys_by_flow_bp_id = dict( (t.flow_bp_id, k) for k, t in tools.items() )
+        defined_command_bp_ids = dict()
+        defined_params = set()
+
+        for definition in definitions:
+            key = (definition['name'], definition['version'])
+
+            for command in definition.get('commands', list()):
+                command_bp_id = command_bps[(tools[key].flow_bp_id, command['name'])].id
+                defined_command_bp_ids[command_bp_id] = key
+                defined_params.update( (command_bp_id, p['name']) for p in command.get('params', list()) )
+
+        stale_params = [ p for k, p in params.items() if k[0] in defined_command_bp_ids and k not in defined_params ]
+        stale_command_bps = [ c for c in command_bps.values() if c.id not in defined_command_bp_ids ]
+
+        if len(stale_params) > 0:
+            CommandBlueprintParam.objects.filter(id__in=[p.id for p in stale_params]).delete()
+
+            for param in stale_params:
+                revised_command_bp_ids.add(param.command_id)
+                changed_tools.add(defined_command_bp_ids[param.command_id])
+
+        if len(stale_command_bps) > 0:
+            stale_ids = [c.id for c in stale_command_bps]
+            run_ids = set( Command.objects.filter(blueprint__in=stale_ids).values_list('blueprint', flat=True).distinct() )
+
+            CommandBlueprint.objects.filter(id__in=[i for i in stale_ids if i not in run_ids]).delete()
+            StepBlueprint.objects.filter(id__in=run_ids).update(parent=None, root=None)
+
+            revised_command_bp_ids.update(run_ids)
+            changed_tools.update( keys_by_flow_bp_id[c.parent_id] for c in stale_command_bps )
+
+        ## bulk_create() and update() skip the signal handlers which normally do this
+        if len(revised_command_bp_ids) > 0:
+            CommandBlueprint.objects.filter(id__in=revised_command_bp_ids).update(revision=F('revision') + 1)
+
+    return (new_keys, changed_tools, revised_command_bp_ids)
+
+
+def plan_definitions(definitions):
+    """
+    Orders definitions for loading by the Filetypes they use.  Returns a list of stages,
+    each a list of definitions: the first stage has the tools whose inputs no other tool
+    here creates, and each later stage the tools taking the outputs of earlier ones.  Tools
+    within a stage don't depend on each other and can be loaded at the same time.
+    """
+    def filetypes(definition, io_type):
+        return set( link['filetype'] for link in definition.get('files', list()) \
+                    if RELATIONSHIPS.get(link['relationship'], (None,))[0] == io_type )
+
+    created_by = dict()
+    for definition in definitions:
+        for filetype in filetypes(definition, 'o'):
+            created_by.setdefault(filetype, set()).add(id(definition))
+
+    ## definition -> the other definitions creating something it uses
+    waiting_on = dict()
+    for definition in definitions:
+        waiting_on[id(definition)] = set( creator for filetype in filetypes(definition, 'i') \
+                                          for creator in created_by.get(filetype, set()) \
+                                          if creator != id(definition) )
+
+    stages = list()
+    remaining = list(definitions)
+
+    while len(remaining) > 0:
+        loaded = set( id(d) for stage in stages for d in stage )
+        stage = [ d for d in remaining if waiting_on[id(d)] <= loaded ]
+
+        ## tools creating each other's inputs (like format converters) go together
+        if len(stage) == 0:
+            stage = remaining
+
+        stages.append(stage)
+        remaining = [ d for d in remaining if d not in stage ]
+
+    return stages
+
+
+## How one tool's load went, for load_planned()
+PlannedLoad = namedtuple('PlannedLoad', ['stage', 'name', 'version', 'status', 'seconds', 'error'])
+
+
+def _load_one(stage_number, definition):
+    started = time.time()
+
+    try:
+        result = load_definitions([definition])
+        status = 'added' if result.added else 'updated' if result.updated else 'unchanged'
+        error = None
+    except Exception as e:
+        status = 'failed'
+        error = e
+    finally:
+        ## each worker thread has its own connection
+        connection.close()
+
+    return PlannedLoad( stage_number, definition['name'], definition['version'], status, \
+                        time.time() - started, error )
+
+
+def load_planned(stages, workers=4, callback=None):
+    """
+    Loads each stage of definitions from plan_definitions() in turn, with the tools in a
+    stage loaded by a pool of 'workers' threads.  Each tool is loaded in its own transaction,
+    so one failing leaves nothing of it behind and doesn't stop the others.  Different
+    tools don't lock each other out, except on databases (like SQLite) which only allow one
+    writer at a time.
+
+    'callback', if given, is called with a PlannedLoad as each tool finishes.  Returns the
+    list of PlannedLoads.
+    """
+    loads = list()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for stage_number, stage in enumerate(stages):
+            futures = [ pool.submit(_load_one, stage_number + 1, definition) for definition in stage ]
+
+            for future in as_completed(futures):
+                load = future.result()
+                loads.append(load)
+
+                if callback is not None:
+                    callback(load)
+
+    return loads
+
+
+def load_tool_files(paths=None):
+    """
+    Reads and loads tool definition files (by default all of them) in one go.
+    """
+    return load_definitions(read_definitions(paths))
@@ -0,0 +1,147 @@
+"""
+Tool discovery: which tools can be run with the data at hand.
+
+Each Tool declares its inputs as ToolFiletypes, some required (Tool.needs) and some
+optional (Tool.can_use.)  Rather than walk those for every tool whenever the question is
+asked, they're kept in a ToolIndex, an inverted index from each Filetype to the tools
+which take it.  Given the file types of a workspace's data, the runnable tools are then a
+few set operations away.
+
+The index is built once per process and caught up with any ToolFiletypes added since
+(by this process or a loader running elsewhere) whenever it's used, which costs a single
+aggregate query.  Anything else changing, such as a ToolFiletype being deleted, causes a
+full rebuild.
+"""
+
+import threading
+
+from django.db.models import Count, Max
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from biotools.models import ToolFiletype
+
+
+class ToolIndex(object):
+    """
+    Inverted index of tool inputs.  All the ids here are database ids.
+
+        required       tool id -> frozenset of the filetype ids it needs
+        optional       tool id -> frozenset of the filetype ids it can use
+        by_filetype    filetype id -> set of tool ids taking it as any kind of input
+    """
+
+    def __init__(self):
+        self.required = dict()
+        self.optional = dict()
+        self.by_filetype = dict()
+
+        ## for noticing ToolFiletypes added elsewhere, see refresh()
+        self.last_id = 0
+        self.count = 0
+
+    def add(self, tool_id, filetype_id, required):
+        if required:
+            self.required[tool_id] = self.required.get(tool_id, frozenset()) | frozenset([filetype_id])
+        else:
+            self.optional[tool_id] = self.optional.get(tool_id, frozenset()) | frozenset([filetype_id])
+
+        self.by_filetype.setdefault(filetype_id, set()).add(tool_id)
+
+    def load(self, toolfiletypes):
+        """
+        Adds (id, tool id, filetype id, required, io type) tuples to the index, such as from
+        a values_list() query.  Outputs are counted but not indexed.
+        """
+        for tft_id, tool_id, filetype_id, required, io_type in toolfiletypes:
+            if io_type == 'i':
+                self.add(tool_id, filetype_id, required)
+
+            self.last_id = max(self.last_id, tft_id)
+            self.count += 1
+
+    def runnable_tools(self, filetype_ids):
+        """
+        Returns the set of tool ids with every required input among the passed filetype ids.
+        Tools without required inputs are only included if they can use one of them.
+        """
+        available = frozenset(filetype_ids)
+        candidates = set()
+
+        for filetype_id in available:
+            candidates.update(self.by_filetype.get(filetype_id, ()))
+
+        return set( tool_id for tool_id in candidates if self.required.get(tool_id, frozenset()) <= available )
+
+    def tools_using(self, filetype_id):
+        """
+        Returns the set of tool ids taking the filetype as a required or optional input.
+        """
+        return set(self.by_filetype.get(filetype_id, ()))
+
+
+_FIELDS = ('id', 'tool_id', 'filetype_id', 'required', 'io_type')
+
+_index = None
+_lock = threading.Lock()
+
+
+def _build_index():
+    index = ToolIndex()
+    index.load( ToolFiletype.objects.order_by('id').values_list(*_FIELDS) )
+    return index
+
+
+def get_index():
+    """
+    Returns this process's ToolIndex, building it or catching it up with the database first.
+    """
+    global _index
+
+    with _lock:
+        if _index is None:
+            _index = _build_index()
+            return _index
+
+        state = ToolFiletype.objects.aggregate(Max('id'), Count('id'))
+        last_id = state['id__max'] or 0
+        count = state['id__count']
+
+        if last_id == _index.last_id and count == _index.count:
+            return _index
+
+        ## only additions can be applied incrementally
+        new_rows = list( ToolFiletype.objects.filter(id__gt=_index.last_id).order_by('id').values_list(*_FIELDS) )
+
+        if _index.count + len(new_rows) == count:
+            _index.load(new_rows)
+        else:
+            _index = _build_index()
+
+        return _index
+
+
+def get_runnable_tool_ids(filetype_ids):
+    return get_index().runnable_tools(filetype_ids)
+
+
+@receiver(post_save, sender=ToolFiletype)
+def _toolfiletype_saved(sender, instance, created, **kwargs):
+    global _index
+
+    with _lock:
+        if _index is None:
+            return
+
+        if created and instance.id > _index.last_id:
+            _index.load([ (instance.id, instance.tool_id, instance.filetype_id, instance.required, instance.io_type) ])
+        else:
+            _index = None
+
+
+@receiver(post_delete, sender=ToolFiletype)
+def _toolfiletype_deleted(sender, instance, **kwargs):
+    global _index
+
+    with _lock:
+        _index = None
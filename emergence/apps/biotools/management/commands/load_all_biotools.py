@@ -3,27 +3,53 @@
 #   python3 manage.py biotools load_all_biotools
 #
 ## https://docs.djangoproject.com/en/dev/howto/custom-management-commands/
-from django.core.management import find_management_module, find_commands, load_command_class
-from django.core.management.base import BaseCommand, CommandError, NoArgsCommand
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from emergence.apps.biotools.definitions import load_planned, plan_definitions, read_definitions
 
 
 class Command(BaseCommand):
     ## write messages via self.stdout.write and self.stderr.write
     args = 'None'
-    help = 'Looks through all local tools and runs their installers'
+    help = 'Loads every tool definition, independent ones at the same time'
 
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', dest='workers', type='int', default=None,
+                    help='Number of tools loaded at once (default 4, or 1 with SQLite)'),
+    )
 
     def handle(self, *args, **options):
-        app_names = [a for a in settings.INSTALLED_APPS if a.endswith(".biotools")]
-
-        for app_name in app_names:
-            command_names = find_commands(find_management_module(app_name))
-            for command_name in command_names:
-                if command_name == 'load_all_biotools':
-                    continue
-
-                command = load_command_class(app_name, command_name)
-
-                self.stdout.write("INFO: {0} - {1}\n".format(command_name, command.help))
-                command.handle()
+        started = time.time()
+
+        ## settings.ini and the definitions are read once, here, rather than by each tool
+        definitions = read_definitions()
+        stages = plan_definitions(definitions)
+
+        workers = options.get('workers')
+        if workers is None:
+            ## SQLite only allows one writer, so there's nothing to gain there
+            workers = 1 if settings.DATABASES['default']['ENGINE'].endswith('sqlite3') else 4
+
+        for stage_number, stage in enumerate(stages):
+            self.stdout.write( "INFO: stage {0}: {1}\n".format( stage_number + 1, \
+                               ", ".join("{0} {1}".format(d['name'], d['version']) for d in stage)) )
+
+        loads = load_planned(stages, workers=workers, callback=self.report)
+        failed = [l for l in loads if l.status == 'failed']
+
+        self.stdout.write( "INFO: loaded {0} tools ({1} failed) in {2:.2f}s\n".format( \
+                           len(loads) - len(failed), len(failed), time.time() - started) )
+
+        if len(failed) > 0:
+            raise CommandError( "Failed to load: {0}".format( \
+                                ", ".join("{0} {1}".format(l.name, l.version) for l in failed)) )
+
+    def report(self, load):
+        if load.error is not None:
+            self.stderr.write( "ERROR: tool {0} {1} failed after {2:.2f}s: {3}\n".format( \
+                               load.name, load.version, load.seconds, load.error) )
+        else:
+            self.stdout.write( "INFO: tool {0} {1} {2} in {3:.2f}s\n".format( \
+                               load.name, load.version, load.status, load.seconds) )
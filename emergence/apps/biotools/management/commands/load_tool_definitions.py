@@ -0,0 +1,24 @@
+## This should not be run directly.  Instead, run as a command through manage.py like:
+#   python3 manage.py load_tool_definitions [definition.json ...]
+#
+## https://docs.djangoproject.com/en/dev/howto/custom-management-commands/
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from emergence.apps.biotools.definitions import load_tool_files
+
+class Command(BaseCommand):
+    ## write messages via self.stdout.write and self.stderr.write
+    args = '[definition.json ...]'
+    help = 'Loads tool definitions (all of those in biotools/tools by default), adding or updating what differs'
+
+    def handle(self, *args, **options):
+        started = time.time()
+        result = load_tool_files(list(args) or None)
+
+        for status, keys in (('added', result.added), ('updated', result.updated), ('unchanged', result.unchanged)):
+            for name, version in keys:
+                self.stdout.write("INFO: tool {0} {1} {2}\n".format(name, version, status))
+
+        self.stdout.write("INFO: loaded {0} tool definitions in {1:.2f}s\n".format( \
+                          len(result.added) + len(result.updated) + len(result.unchanged), time.time() - started))
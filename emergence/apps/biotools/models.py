@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from flow import registry
 from flow.models import FlowBlueprint, CommandBlueprint, CommandBlueprintParam
 
 """
@@ -158,6 +161,13 @@ class StandaloneTool( Tool ):
 
     def new_flow(self):
         return self.flow_bp.build()
+
+    def new_flows(self, count):
+        """
+        Builds 'count' independent flows for this tool at once, such as one per sample
+        in a batch, and returns them in a list.  See FlowBlueprint.build_many()
+        """
+        return self.flow_bp.build_many(count)
         
 
 class ErgatisTool( Tool ):
@@ -213,4 +223,14 @@ class ToolFiletypeParam( models.Model ):
     # There are warnings in the model docs about setting null=true on CharFields, but I couldn't get it to
     #  work otherwise.
     value = models.CharField( max_length=200, null=True )
+
+
+@receiver(post_save, sender=ToolFiletypeParam)
+@receiver(post_delete, sender=ToolFiletypeParam)
+def _toolfiletypeparam_changed(sender, instance, **kwargs):
+    registry.bump_version()
     
+
+
+## registers the tool discovery index's signal handlers
+import biotools.discovery
@@ -0,0 +1,351 @@
+"""
+Finds chains of tools leading from one file type to another, like FASTQ reads to a GFF3
+of gene models.
+
+The Tool.needs(), can_use(), creates() and can_create() definitions form a bipartite
+graph between Filetypes and Tools.  ToolGraph compiles that into adjacency lists between
+file types, each edge being a tool which reads one type and writes another:
+
+    FASTQ --[Trinity]--> FASTA (nucleotide) --[Prodigal]--> GFF3
+
+Tools with more than one required input can only be used if the others are among the
+file types the search starts from (the reference genome for an aligner, for example.)
+
+Paths can be found by number of steps (breadth-first) or by cost.  A tool's cost is how
+long it has taken historically: the sum over its commands of their average wall time
+when completed (see Step.wall_time.)  Tools which have never run are costed at the
+average of those which have.
+
+A chosen path can be turned straight into a serial FlowBlueprint, with each tool's
+output wired to the next one's input, by to_flow_blueprint().
+"""
+
+import heapq
+import re
+import threading
+from collections import deque, namedtuple
+
+from django.db import transaction
+from django.db.models import Avg, Count, Max
+
+from emergence.libs.bulk import reserve_ids, bulk_create_inherited
+from biotools.models import Filetype, Tool, StandaloneTool, ToolFiletype, ToolFiletypeParam
+from flow import registry
+from flow.models import Command, CommandBlueprint, CommandBlueprintParam, FlowBlueprint
+
+
+## cost of every tool when nothing has any history
+DEFAULT_TOOL_COST = 1.0
+
+## One edge of a path: running 'tool_id' on a file of type 'source' to make one of 'target'
+PathStep = namedtuple('PathStep', ['tool_id', 'source', 'target'])
+
+## A complete chain of tools, cheapest (or shortest) first when returned in a list
+Path = namedtuple('Path', ['cost', 'steps'])
+
+
+class ToolGraph(object):
+    """
+    Adjacency structure over file types.  All the ids here are database ids.
+
+        edges       filetype id -> list of (tool id, filetype id produced)
+        required    tool id -> frozenset of the filetype ids it needs
+        costs       tool id -> cost, see the module docstring
+    """
+
+    def __init__(self, toolfiletypes, costs=None):
+        """
+        'toolfiletypes' is an iterable of (tool id, filetype id, required, io type) tuples.
+        """
+        inputs = dict()
+        outputs = dict()
+        self.required = dict()
+
+        for tool_id, filetype_id, required, io_type in toolfiletypes:
+            if io_type == 'i':
+                inputs.setdefault(tool_id, set()).add(filetype_id)
+                if required:
+                    self.required[tool_id] = self.required.get(tool_id, frozenset()) | frozenset([filetype_id])
+            else:
+                outputs.setdefault(tool_id, set()).add(filetype_id)
+
+        self.edges = dict()
+        for tool_id in inputs:
+            for source in inputs[tool_id]:
+                for target in outputs.get(tool_id, ()):
+                    if source != target:
+                        self.edges.setdefault(source, list()).append( (tool_id, target) )
+
+        if costs is None:
+            costs = dict()
+
+        if len(costs) > 0:
+            default_cost = sum(costs.values()) / len(costs)
+        else:
+            default_cost = DEFAULT_TOOL_COST
+
+        self.costs = dict( (tool_id, costs.get(tool_id, default_cost)) for tool_id in inputs )
+
+    def _usable(self, tool_id, source, available):
+        return self.required.get(tool_id, frozenset()) <= available | frozenset([source])
+
+    def shortest_path(self, sources, target):
+        """
+        Returns the Path with the fewest tools from any of the 'sources' filetype ids to the
+        'target' one, or None if there isn't one.
+        """
+        available = frozenset(sources)
+        came_from = dict( (ft, None) for ft in available )
+        queue = deque(available)
+
+        while len(queue) > 0:
+            current = queue.popleft()
+
+            if current == target:
+                steps = list()
+                while came_from[current] is not None:
+                    steps.append(came_from[current])
+                    current = came_from[current].source
+                steps.reverse()
+
+                return Path(sum(self.costs[s.tool_id] for s in steps), steps)
+
+            for tool_id, next_ft in self.edges.get(current, ()):
+                if next_ft not in came_from and self._usable(tool_id, current, available):
+                    came_from[next_ft] = PathStep(tool_id, current, next_ft)
+                    queue.append(next_ft)
+
+        return None
+
+    def cheapest_paths(self, sources, target, count=None):
+        """
+        Returns up to 'count' (default 5) Paths from any of the 'sources' filetype ids to the
+        'target' one, cheapest first.  Paths never pass through the same file type twice.
+
+        This is Dijkstra's algorithm extended to keep going after the first arrival, with
+        each file type settled at most 'count' times.
+        """
+        if count is None:
+            count = 5
+
+        available = frozenset(sources)
+        heap = [ (0.0, ft, ()) for ft in available ]
+        heapq.heapify(heap)
+
+        settled = dict()
+        paths = list()
+
+        while len(heap) > 0 and len(paths) < count:
+            cost, current, steps = heapq.heappop(heap)
+
+            settled[current] = settled.get(current, 0) + 1
+            if settled[current] > count:
+                continue
+
+            if current == target:
+                paths.append( Path(cost, list(steps)) )
+                continue
+
+            visited = set( [s.source for s in steps] )
+
+            for tool_id, next_ft in self.edges.get(current, ()):
+                if next_ft in visited or next_ft in available or not self._usable(tool_id, current, available):
+                    continue
+
+                heapq.heappush(heap, (cost + self.costs[tool_id], next_ft, steps + (PathStep(tool_id, current, next_ft),)))
+
+        return paths
+
+
+def get_tool_costs():
+    """
+    Returns a dict of tool id -> historical runtime in seconds, for the standalone tools
+    whose commands have completed before.  This is two queries.
+    """
+    costs = dict()
+
+    ## average wall time per command blueprint, summed per tool's flow
+    by_flow_bp = dict()
+
+    for row in Command.objects.filter(state='c', wall_time__isnull=False) \
+                              .values('blueprint_id', 'blueprint__root_id').annotate(Avg('wall_time')):
+        flow_bp_id = row['blueprint__root_id']
+        by_flow_bp[flow_bp_id] = by_flow_bp.get(flow_bp_id, 0.0) + row['wall_time__avg']
+
+    for tool_id, flow_bp_id in StandaloneTool.objects.filter(flow_bp__in=list(by_flow_bp.keys())) \
+                                                     .values_list('id', 'flow_bp_id'):
+        costs[tool_id] = by_flow_bp[flow_bp_id]
+
+    return costs
+
+
+_graph = None
+_graph_state = None
+_lock = threading.Lock()
+
+
+def get_graph():
+    """
+    Returns this process's compiled ToolGraph, recompiling it if tools have been loaded or
+    removed since.  Historical costs are read when the graph is compiled.
+    """
+    global _graph, _graph_state
+
+    state = ToolFiletype.objects.aggregate(Max('id'), Count('id'))
+    state = (state['id__max'], state['id__count'])
+
+    with _lock:
+        if _graph is None or state != _graph_state:
+            toolfiletypes = ToolFiletype.objects.values_list('tool_id', 'filetype_id', 'required', 'io_type')
+            _graph = ToolGraph(toolfiletypes, costs=get_tool_costs())
+            _graph_state = state
+
+        return _graph
+
+
+def find_paths(source_names, target_name, count=None):
+    """
+    Convenience wrapper taking Filetype names.  Returns the cheapest Paths, as for
+    ToolGraph.cheapest_paths()
+    """
+    ids = dict( Filetype.objects.filter(name__in=list(source_names) + [target_name]).values_list('name', 'id') )
+    for name in list(source_names) + [target_name]:
+        if name not in ids:
+            raise Exception("ERROR: unknown filetype '{0}'".format(name))
+
+    return get_graph().cheapest_paths([ids[n] for n in source_names], ids[target_name], count=count)
+
+
+def _slug(text):
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+def _copy_blueprint_tree(tree, bp, parent, command_copies, name=None):
+    """
+    Copies a tool's FlowBlueprint and everything beneath it, in order, under 'parent'.
+    Fills 'command_copies' with original CommandBlueprint id -> copy.
+    """
+    if isinstance(bp, CommandBlueprint):
+        copy = CommandBlueprint( parent=parent, name=bp.name, exec_path=bp.exec_path, cpus=bp.cpus, memory=bp.memory )
+        copy.save()
+        command_copies[bp.id] = copy
+    else:
+        copy = FlowBlueprint( parent=parent, name=name or bp.name, type=bp.type, description=bp.description )
+        copy.save()
+
+        for child in tree.children_of(bp.id):
+            _copy_blueprint_tree(tree, child, copy, command_copies)
+
+
+def _choose_link(link_params, tool_id, filetype_id, io_type):
+    """
+    Of a tool's ToolFiletypes for a file type, picks the one to connect through: required
+    ones first, and only those with a param naming the path.  Returns its list of
+    ToolFiletypeParams, or None.
+    """
+    candidates = [ tfps for tfps in link_params.values() \
+                   if tfps[0].toolfiletype.tool_id == tool_id and tfps[0].toolfiletype.filetype_id == filetype_id \
+                   and tfps[0].toolfiletype.io_type == io_type and any(t.value is None for t in tfps) ]
+
+    if len(candidates) == 0:
+        return None
+
+    return sorted(candidates, key=lambda tfps: (not tfps[0].toolfiletype.required, tfps[0].toolfiletype_id))[0]
+
+
+def to_flow_blueprint(path, name, description=None):
+    """
+    Creates a serial FlowBlueprint running the tools of a Path in order.  Each tool's own
+    FlowBlueprint is copied beneath it, nested flows and all, along with the params and
+    the ToolFiletypeParams saying which of them read and write files, so it can be built,
+    validated and run like any other.  Only StandaloneTools can be chained this way.
+
+    Each tool is connected to the next through the file type the path passes between
+    them: the path the first writes it to (its param's default, or a placeholder named
+    for the step) becomes the default of the param the second reads it from, and params
+    selecting that type (like prodigal's -f gff) default to doing so.
+
+    The copies share the tools' ToolFiletypes, so if a tool is reloaded without one of
+    its file relationships (see biotools.definitions) the copies lose it too.
+    """
+    tool_ids = [step.tool_id for step in path.steps]
+    tools = StandaloneTool.objects.in_bulk(tool_ids)
+
+    for tool_id in tool_ids:
+        if tool_id not in tools:
+            raise Exception("ERROR: tool {0} isn't a standalone tool and can't be added to a flow".format( \
+                            Tool.objects.get(pk=tool_id)))
+
+    ## each tool's blueprint tree is a query, then every param and ToolFiletypeParam is one more
+    flow_bp_ids = [tools[t].flow_bp_id for t in tool_ids]
+    flow_bps = FlowBlueprint.objects.in_bulk(flow_bp_ids)
+
+    params = dict()
+    for param in CommandBlueprintParam.objects.filter(command__root__in=flow_bp_ids).order_by('position', 'id'):
+        params.setdefault(param.command_id, list()).append(param)
+
+    ## ToolFiletype id -> its ToolFiletypeParams
+    link_params = dict()
+    for tfp in ToolFiletypeParam.objects.filter(command_bp__root__in=flow_bp_ids, toolfiletype__tool__in=tool_ids) \
+                                        .select_related('toolfiletype', 'toolfiletype__filetype').order_by('id'):
+        link_params.setdefault(tfp.toolfiletype_id, list()).append(tfp)
+
+    with transaction.atomic():
+        flow_bp = FlowBlueprint( name=name, type='s', description=description or '' )
+        flow_bp.save()
+
+        ## per step, since a tool can appear more than once: original param id -> copy
+        param_copies = list()
+
+        for tool_id in tool_ids:
+            tool_flow_bp = flow_bps[tools[tool_id].flow_bp_id]
+            command_copies = dict()
+            _copy_blueprint_tree( tool_flow_bp.get_tree(), tool_flow_bp, flow_bp, command_copies, \
+                                  name=tools[tool_id].name )
+
+            copies = dict()
+            for command_bp_id, copy in command_copies.items():
+                for param in params.get(command_bp_id, []):
+                    copies[param.id] = CommandBlueprintParam( command=copy, **dict( (f.attname, getattr(param, f.attname)) \
+                                       for f in param._meta.fields if f.attname not in ('id', 'command_id') ) )
+
+            param_copies.append(copies)
+
+        ## connect each step's output to the next one's input
+        for number, (upstream, downstream) in enumerate(zip(path.steps, path.steps[1:])):
+            output_tfps = _choose_link(link_params, upstream.tool_id, upstream.target, 'o')
+            input_tfps = _choose_link(link_params, downstream.tool_id, upstream.target, 'i')
+
+            if output_tfps is None or input_tfps is None:
+                continue
+
+            for copies, tfps in ((param_copies[number], output_tfps), (param_copies[number + 1], input_tfps)):
+                for tfp in tfps:
+                    if tfp.value is not None:
+                        copies[tfp.commandblueprintparam_id].default_value = tfp.value
+
+            output_param = param_copies[number][ [t for t in output_tfps if t.value is None][0].commandblueprintparam_id ]
+            if not output_param.default_value:
+                output_param.default_value = "step{0}_{1}".format(number + 1, _slug(output_tfps[0].toolfiletype.filetype.name))
+
+            for tfp in input_tfps:
+                if tfp.value is None:
+                    param_copies[number + 1][tfp.commandblueprintparam_id].default_value = output_param.default_value
+
+        new_params = [ copy for copies in param_copies for copy in copies.values() ]
+        for param, id in zip(new_params, reserve_ids(CommandBlueprintParam, len(new_params))):
+            param.id = id
+        bulk_create_inherited(new_params)
+
+        ToolFiletypeParam.objects.bulk_create( [ ToolFiletypeParam( toolfiletype_id=tfp.toolfiletype_id, \
+                                                                    command_bp_id=copies[tfp.commandblueprintparam_id].command_id, \
+                                                                    commandblueprintparam_id=copies[tfp.commandblueprintparam_id].id, \
+                                                                    value=tfp.value ) \
+                                                 for tool_id, copies in zip(tool_ids, param_copies) \
+                                                 for tfps in link_params.values() if tfps[0].toolfiletype.tool_id == tool_id \
+                                                 for tfp in tfps ] )
+
+        ## bulk_create() skips the signals which would do this
+        registry.bump_version()
+
+    return flow_bp
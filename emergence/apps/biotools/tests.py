@@ -5,8 +5,19 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import json
+import os
+import shutil
+import tempfile
+
 from django.test import TestCase
 
+from biotools.definitions import load_definitions, plan_definitions, read_definitions
+from biotools.discovery import ToolIndex
+from biotools.models import StandaloneTool, ToolFiletype
+from flow.models import CommandBlueprint
+from biotools.pathfinder import ToolGraph
+
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -14,3 +25,168 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class ToolIndexTest(TestCase):
+    def setUp(self):
+        ## filetypes: 1 = FASTQ, 2 = FASTA, 3 = GFF3
+        self.index = ToolIndex()
+        self.index.load([ (1, 10, 1, True, 'i'),     # normalization needs reads
+                          (2, 11, 1, True, 'i'),     # an aligner needs reads and a reference
+                          (3, 11, 2, True, 'i'),
+                          (4, 11, 3, False, 'i'),    # ... and can use annotation
+                          (5, 12, 2, False, 'i'),    # a gene caller can use a genome
+                          (6, 12, 3, True, 'o') ])
+
+    def test_runnable_tools(self):
+        self.assertEqual(self.index.runnable_tools([1]), set([10]))
+        self.assertEqual(self.index.runnable_tools([1, 2]), set([10, 11, 12]))
+        self.assertEqual(self.index.runnable_tools([3]), set())
+        self.assertEqual(self.index.count, 6)
+
+
+class ToolGraphTest(TestCase):
+    def setUp(self):
+        ## filetypes: 1 = FASTQ, 2 = FASTA, 3 = GFF3, 4 = SAM
+        self.graph = ToolGraph([ (10, 1, True, 'i'), (10, 2, True, 'o'),                     # assembler
+                                 (11, 2, True, 'i'), (11, 3, False, 'o'),                    # gene caller
+                                 (12, 1, True, 'i'), (12, 2, True, 'i'), (12, 4, True, 'o'), # aligner
+                                 (13, 4, True, 'i'), (13, 3, True, 'o'),
+                                 (14, 1, True, 'i'), (14, 3, True, 'o') ],                   # slow, one step
+                               costs={10: 100, 11: 5, 14: 500})
+
+    def test_shortest_path_counts_steps(self):
+        path = self.graph.shortest_path([1], 3)
+        self.assertEqual([s.tool_id for s in path.steps], [14])
+
+    def test_cheapest_paths(self):
+        paths = self.graph.cheapest_paths([1], 3)
+        self.assertEqual([s.tool_id for s in paths[0].steps], [10, 11])
+        self.assertEqual(paths[0].cost, 105)
+
+        ## the aligner needs the reference too, so it's only used when that's at hand
+        self.assertNotIn(12, [s.tool_id for p in paths for s in p.steps])
+        self.assertIn([12, 13], [[s.tool_id for s in p.steps] for p in self.graph.cheapest_paths([1, 2], 3)])
+
+
+class PipelineBlueprintTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.contigs = os.path.join(self.dir, 'contigs.fna')
+
+        load_definitions([
+            { 'name': 'assembler', 'version': '1',
+              'commands': [ { 'name': 'Assemble', 'exec_path': '/bin/cp', 'params': [
+                                { 'name': '<reads>', 'position': 1, 'is_optional': False },
+                                { 'name': '<contigs>', 'position': 2, 'is_optional': False, 'default_value': self.contigs } ] } ],
+              'files': [ { 'relationship': 'needs', 'filetype': 'FASTQ', 'command': 'Assemble', 'params': ['<reads>'] },
+                         { 'relationship': 'creates', 'filetype': 'FASTA (nucleotide)', 'command': 'Assemble',
+                           'params': ['<contigs>'] } ] },
+            { 'name': 'gene caller', 'version': '1',
+              'commands': [ { 'name': 'Call genes', 'exec_path': '/bin/cp', 'params': [
+                                { 'name': '<genome>', 'position': 1, 'is_optional': False },
+                                { 'name': '-f', 'prefix': '-f ', 'position': 2 },
+                                { 'name': '<genes>', 'position': 3, 'is_optional': False } ] } ],
+              'files': [ { 'relationship': 'needs', 'filetype': 'FASTA (nucleotide)', 'command': 'Call genes',
+                           'params': ['<genome>'] },
+                         { 'relationship': 'creates', 'filetype': 'GFF3', 'command': 'Call genes',
+                           'params': ['<genes>', '-f=gff'] } ] },
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_two_tool_chain_builds_and_validates(self):
+        path = find_paths(['FASTQ'], 'GFF3')[0]
+        flow_bp = to_flow_blueprint(path, 'reads to genes')
+
+        self.assertEqual([c.name for c in flow_bp.get_children()], ['assembler', 'gene caller'])
+
+        ## the gene caller reads what the assembler writes, in the format asked for
+        call_genes = registry.get_blueprint(CommandBlueprint.objects.get(root=flow_bp, name='Call genes').id)
+        self.assertEqual(call_genes.params_by_name['<genome>'].default_value, self.contigs)
+        self.assertEqual(call_genes.params_by_name['-f'].default_value, 'gff')
+
+        reads = os.path.join(self.dir, 'reads.fq')
+        with open(reads, 'w') as fh:
+            fh.write("@r1\nACGT\n+\nIIII\n")
+
+        flow = flow_bp.build()
+        flow.set_params({ 'Assemble': {'<reads>': reads}, 'Call genes': {'<genes>': os.path.join(self.dir, 'genes.gff')} })
+
+        ## the contigs don't exist yet, but the assembler is known to write them
+        self.assertEqual(validate_flow(flow, mark=False), {})
+
+
+class DefinitionLoaderTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'grep__2_14.json')
+        self.definition = {
+            'name': 'grep', 'version': '2.14', 'primary_site': 'http://www.gnu.org/software/grep/',
+            'commands': [ { 'name': 'Run grep', 'exec_path': '/bin/grep', 'params': [
+                              { 'name': '-c', 'prefix': '-c ', 'has_no_value': True, 'short_desc': 'Count' },
+                              { 'name': '<pattern>', 'is_optional': False, 'short_desc': 'Pattern' },
+                              { 'name': '<input>', 'is_optional': False, 'short_desc': 'Input file' } ] } ],
+            'files': [ { 'relationship': 'needs', 'filetype': 'FASTA (nucleotide)', 'command': 'Run grep',
+                         'params': ['<input>'] } ]
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def load(self):
+        with open(self.path, 'w') as fh:
+            json.dump(self.definition, fh)
+
+        return load_definitions(read_definitions([self.path]))
+
+    def test_reload_only_applies_changes(self):
+        self.assertEqual(self.load().added, [('grep', '2.14')])
+
+        tool = StandaloneTool.objects.get(name='grep', version='2.14')
+        command_bp = tool.flow_bp.get_command('Run grep')
+        self.assertEqual( [p.position for p in command_bp.commandblueprintparam_set.order_by('position')], [1, 2, 3] )
+        self.assertEqual(ToolFiletype.objects.filter(tool=tool).count(), 1)
+
+        self.assertEqual(self.load().unchanged, [('grep', '2.14')])
+
+        self.definition['commands'][0]['params'][0]['short_desc'] = 'Count matching lines'
+        self.definition['files'][0]['relationship'] = 'can_use'
+        self.assertEqual(self.load().updated, [('grep', '2.14')])
+
+        self.assertGreater(tool.flow_bp.get_command('Run grep').revision, command_bp.revision)
+        self.assertEqual(list(ToolFiletype.objects.filter(tool=tool).values_list('required', flat=True)), [False])
+
+    def test_removed_commands_and_params_go(self):
+        self.definition['commands'].append({ 'name': 'Run wc', 'exec_path': '/usr/bin/wc' })
+        self.load()
+
+        tool = StandaloneTool.objects.get(name='grep', version='2.14')
+        tool.new_flow()
+        revision = tool.flow_bp.get_command('Run grep').revision
+
+        self.definition['commands'].append({ 'name': 'Run sort', 'exec_path': '/usr/bin/sort' })
+        self.load()
+
+        ## 'Run wc' has been built, 'Run sort' hasn't
+        del self.definition['commands'][1:]
+        del self.definition['commands'][0]['params'][0]
+        self.assertEqual(self.load().updated, [('grep', '2.14')])
+
+        command_bp = tool.flow_bp.get_command('Run grep')
+        self.assertEqual([c.name for c in tool.flow_bp.refresh_tree().children_of(tool.flow_bp.id)], ['Run grep'])
+        self.assertEqual( [p.name for p in command_bp.commandblueprintparam_set.order_by('position')], ['<pattern>', '<input>'] )
+        self.assertGreater(command_bp.revision, revision)
+
+        self.assertEqual(CommandBlueprint.objects.filter(name='Run sort').count(), 0)
+        self.assertIsNone(CommandBlueprint.objects.get(name='Run wc').parent_id)
+
+    def test_plan_orders_by_filetype(self):
+        assembler = { 'name': 'assembler', 'files': [ { 'relationship': 'needs', 'filetype': 'FASTQ' },
+                                                      { 'relationship': 'creates', 'filetype': 'FASTA (nucleotide)' } ] }
+        gene_caller = { 'name': 'gene caller', 'files': [ { 'relationship': 'needs', 'filetype': 'FASTA (nucleotide)' } ] }
+        aligner = { 'name': 'aligner', 'files': [ { 'relationship': 'needs', 'filetype': 'FASTQ' } ] }
+
+        stages = plan_definitions([gene_caller, assembler, aligner])
+        self.assertEqual( [[d['name'] for d in stage] for stage in stages], [['assembler', 'aligner'], ['gene caller']] )
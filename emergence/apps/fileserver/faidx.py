@@ -0,0 +1,450 @@
+"""
+Random access to records of FASTA and FASTQ files through samtools-compatible indexes.
+
+A .fai index has one tab-separated line per record:
+
+    name  length  offset  line bases  line width  [quality offset]
+
+where 'offset' is where the record's sequence starts in the (uncompressed) file and the
+line figures describe how it's wrapped.  FASTQ indexes have the sixth column.  Any
+record, or any region of one, can then be found with a little arithmetic instead of
+reading the file from the start.
+
+Plain files are read through mmap, so fetch_raw() returns a memoryview straight onto the
+file's pages without copying anything, and so does fetch() for regions within a single
+line.  Longer regions need their line endings removed, which is the only copy made.
+
+Compressed files need to be BGZF (as written by bgzip) to be seekable.  Those also get a
+.gzi index mapping compressed block offsets to uncompressed ones, the same as samtools
+writes.  Ordinary gzip files can't be indexed and are skipped.
+
+Indexes are written next to the file where possible, otherwise under FILESERVER_INDEX_ROOT.
+"""
+
+import bisect
+import gzip
+import hashlib
+import mmap
+import os
+import re
+import struct
+from collections import namedtuple
+
+from django.conf import settings
+
+from fileserver.sniffer import GZIP_MAGIC
+
+
+## how much is read at once while indexing
+CHUNK_SIZE = 1048576
+
+FaiEntry = namedtuple('FaiEntry', ['name', 'length', 'offset', 'linebases', 'linewidth', 'qualoffset'])
+
+HEADER_RE = re.compile(br'^>[^\n]*\n', re.MULTILINE)
+
+REGION_RE = re.compile(r'^(.+?)(?::([\d,]+)(?:-([\d,]+))?)?$')
+
+
+def is_bgzf(path):
+    """
+    True if the file starts with a BGZF block header: gzip with the FEXTRA flag and a 'BC'
+    extra subfield.
+    """
+    with open(path, 'rb') as fh:
+        header = fh.read(16)
+
+    return len(header) == 16 and header[:2] == GZIP_MAGIC and header[3] & 4 != 0 and header[12:14] == b'BC'
+
+
+def index_path(path, suffix):
+    """
+    Returns where an index with the given suffix ('.fai' or '.gzi') for the file lives:
+    alongside it if that directory is writable, else under FILESERVER_INDEX_ROOT.
+    """
+    if os.access(os.path.dirname(os.path.abspath(path)), os.W_OK):
+        return path + suffix
+
+    index_root = getattr(settings, 'FILESERVER_INDEX_ROOT', os.path.join(settings.MEDIA_ROOT, 'indexes'))
+    if not os.path.isdir(index_root):
+        os.makedirs(index_root)
+
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(index_root, digest + os.path.basename(path) + suffix)
+
+
+def _read_blocks(fh):
+    """
+    Yields (offset, chunk) pairs where chunks end on a line boundary, except possibly the
+    last one, and offset is where the chunk starts in the file.
+    """
+    offset = 0
+    carry = b''
+
+    while True:
+        data = fh.read(CHUNK_SIZE)
+
+        if len(data) == 0:
+            if len(carry) > 0:
+                yield (offset, carry)
+            return
+
+        data = carry + data
+        last_newline = data.rfind(b'\n')
+
+        if last_newline == -1:
+            carry = data
+            continue
+
+        yield (offset, data[:last_newline + 1])
+
+        offset += last_newline + 1
+        carry = data[last_newline + 1:]
+
+
+class _FastaRecord(object):
+    __slots__ = ('name', 'offset', 'length', 'linebases', 'linewidth')
+
+    def __init__(self, name, offset):
+        self.name = name
+        self.offset = offset
+        self.length = 0
+        self.linebases = None
+        self.linewidth = None
+
+    def add(self, seq):
+        if len(seq) == 0:
+            return
+
+        if self.linewidth is None:
+            first_newline = seq.find(b'\n')
+            if first_newline == -1:
+                first_newline = len(seq)
+
+            self.linewidth = first_newline + 1
+            self.linebases = first_newline - (1 if seq[first_newline - 1:first_newline] == b'\r' else 0)
+
+        self.length += len(seq) - seq.count(b'\n') - seq.count(b'\r')
+
+    def entry(self):
+        return FaiEntry(self.name, self.length, self.offset, self.linebases or 0, self.linewidth or 0, None)
+
+
+def _index_fasta(fh):
+    entries = list()
+    current = None
+
+    for offset, block in _read_blocks(fh):
+        position = 0
+
+        for match in HEADER_RE.finditer(block):
+            if current is not None:
+                current.add(block[position:match.start()])
+                entries.append(current.entry())
+
+            name = match.group()[1:].split()[0].decode('utf-8')
+            current = _FastaRecord(name, offset + match.end())
+            position = match.end()
+
+        if current is not None:
+            current.add(block[position:])
+
+    if current is not None:
+        entries.append(current.entry())
+
+    return entries
+
+
+def _index_fastq(fh):
+    entries = list()
+    carry = list()
+    carry_offset = 0
+
+    for offset, block in _read_blocks(fh):
+        lines = block.split(b'\n')
+        if lines[-1] == b'':
+            lines.pop()
+
+        lines = carry + lines
+        position = carry_offset if len(carry) > 0 else offset
+
+        usable = len(lines) - len(lines) % 4
+
+        for i in range(0, usable, 4):
+            name_line, seq, plus, qual = lines[i:i + 4]
+
+            if not name_line.startswith(b'@') or not plus.startswith(b'+'):
+                raise Exception("ERROR: malformed FASTQ record at byte {0}".format(position))
+
+            seq_offset = position + len(name_line) + 1
+            length = len(seq.rstrip(b'\r'))
+            qual_offset = seq_offset + len(seq) + 1 + len(plus) + 1
+
+            entries.append( FaiEntry(name_line[1:].split()[0].decode('utf-8'), length, seq_offset, \
+                                     length, len(seq) + 1, qual_offset) )
+            position = qual_offset + len(qual) + 1
+
+        carry = lines[usable:]
+        carry_offset = position
+
+    return entries
+
+
+def write_fai(entries, fai_path):
+    with open(fai_path, 'w') as fh:
+        for e in entries:
+            columns = [e.name, e.length, e.offset, e.linebases, e.linewidth]
+            if e.qualoffset is not None:
+                columns.append(e.qualoffset)
+
+            fh.write("\t".join([str(c) for c in columns]) + "\n")
+
+
+def read_fai(fai_path):
+    """
+    Returns a dict of record name -> FaiEntry
+    """
+    entries = dict()
+
+    with open(fai_path) as fh:
+        for line in fh:
+            cols = line.rstrip('\n').split('\t')
+            if len(cols) < 5:
+                continue
+
+            qualoffset = int(cols[5]) if len(cols) > 5 else None
+            entries[cols[0]] = FaiEntry(cols[0], int(cols[1]), int(cols[2]), int(cols[3]), int(cols[4]), qualoffset)
+
+    return entries
+
+
+def build_gzi(path, gzi_path):
+    """
+    Writes the .gzi index of a BGZF file: a little-endian uint64 count, then a
+    (compressed offset, uncompressed offset) uint64 pair for each block after the first.
+    Only the block headers and trailers are read.  Returns the list of pairs.
+    """
+    pairs = list()
+    compressed = 0
+    uncompressed = 0
+
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+
+        while compressed < size:
+            fh.seek(compressed)
+            header = fh.read(18)
+            if len(header) < 18 or header[12:14] != b'BC':
+                raise Exception("ERROR: {0} isn't BGZF at byte {1}".format(path, compressed))
+
+            block_size = struct.unpack('<H', header[16:18])[0] + 1
+
+            fh.seek(compressed + block_size - 4)
+            block_uncompressed = struct.unpack('<I', fh.read(4))[0]
+
+            compressed += block_size
+            uncompressed += block_uncompressed
+
+            if compressed < size and block_uncompressed > 0:
+                pairs.append( (compressed, uncompressed) )
+
+    with open(gzi_path, 'wb') as fh:
+        fh.write(struct.pack('<Q', len(pairs)))
+        for pair in pairs:
+            fh.write(struct.pack('<QQ', *pair))
+
+    return pairs
+
+
+def read_gzi(gzi_path):
+    with open(gzi_path, 'rb') as fh:
+        count = struct.unpack('<Q', fh.read(8))[0]
+        data = fh.read(16 * count)
+
+    return [ struct.unpack_from('<QQ', data, 16 * i) for i in range(count) ]
+
+
+def build_index(path, format):
+    """
+    Writes the .fai (and for BGZF, .gzi) index of a 'FASTA' or 'FASTQ' file and returns
+    the path of the .fai, or None for compressed files which aren't BGZF.
+    """
+    with open(path, 'rb') as fh:
+        compressed = fh.read(2) == GZIP_MAGIC
+
+    if compressed:
+        if not is_bgzf(path):
+            return None
+
+        build_gzi(path, index_path(path, '.gzi'))
+        opener = gzip.open
+    else:
+        opener = open
+
+    with opener(path, 'rb') as fh:
+        if format == 'FASTQ':
+            entries = _index_fastq(fh)
+        else:
+            entries = _index_fasta(fh)
+
+    fai_path = index_path(path, '.fai')
+    write_fai(entries, fai_path)
+
+    return fai_path
+
+
+class IndexedFile(object):
+    """
+    Fetches records and regions of an indexed FASTA or FASTQ file by name.  Positions are
+    0-based and end-exclusive, like Python slices.
+
+        seqs = IndexedFile('/data/S288C.fna')
+        seqs.fetch('chrIV', 1000, 2000)
+        seqs.fetch_region('chrIV:1001-2000')     # 1-based and inclusive, as samtools
+    """
+
+    def __init__(self, path, fai_path=None):
+        self.path = path
+
+        if fai_path is None:
+            fai_path = index_path(path, '.fai')
+
+        self.entries = read_fai(fai_path)
+        self._mmap = None
+        self._view = None
+        self._gzi = None
+
+        with open(path, 'rb') as fh:
+            self.compressed = fh.read(2) == GZIP_MAGIC
+
+        if self.compressed:
+            ## the first block always starts at 0, 0
+            self._gzi = [(0, 0)] + read_gzi(index_path(path, '.gzi'))
+            self._gzi_uncompressed = [pair[1] for pair in self._gzi]
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _read(self, start, end):
+        """
+        Returns the uncompressed bytes [start, end) of the file: a memoryview onto the
+        mapped file for plain files, else decompressed from the nearest BGZF block.
+        """
+        if not self.compressed:
+            if self._mmap is None:
+                with open(self.path, 'rb') as fh:
+                    self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mmap)
+
+            return self._view[start:end]
+
+        block = bisect.bisect_right(self._gzi_uncompressed, start) - 1
+        compressed_offset, uncompressed_offset = self._gzi[block]
+
+        with open(self.path, 'rb') as fh:
+            fh.seek(compressed_offset)
+            with gzip.GzipFile(fileobj=fh) as gz:
+                gz.read(start - uncompressed_offset)
+                return memoryview(gz.read(end - start))
+
+    def _span(self, entry, start, end, offset=None):
+        ## byte range of sequence positions [start, end) given the record's line geometry
+        if offset is None:
+            offset = entry.offset
+
+        if entry.linebases == 0:
+            return (offset, offset)
+
+        first = offset + (start // entry.linebases) * entry.linewidth + start % entry.linebases
+        last = offset + ((end - 1) // entry.linebases) * entry.linewidth + (end - 1) % entry.linebases + 1
+        return (first, last)
+
+    def fetch_raw(self, name):
+        """
+        Returns the record's sequence as stored, line endings included, as a memoryview.
+        For plain files this is a view onto the mapped file and nothing is copied.
+        """
+        entry = self.entries[name]
+        return self._read(*self._span(entry, 0, entry.length))
+
+    def fetch(self, name, start=None, end=None):
+        """
+        Returns positions [start, end) of a record's sequence.  Within a single line this is
+        a zero-copy memoryview, otherwise bytes with the line endings removed.
+        """
+        entry = self.entries[name]
+        start, end = self._clamp(entry, start, end)
+
+        if start >= end:
+            return memoryview(b'')
+
+        raw = self._read(*self._span(entry, start, end))
+
+        if (end - 1) // entry.linebases == start // entry.linebases:
+            return raw
+
+        return raw.tobytes().replace(b'\r', b'').replace(b'\n', b'')
+
+    def fetch_qualities(self, name, start=None, end=None):
+        """
+        Returns the quality string of a FASTQ record, or the positions [start, end) of it.
+        """
+        entry = self.entries[name]
+        if entry.qualoffset is None:
+            raise Exception("ERROR: {0} has no qualities, it isn't FASTQ".format(self.path))
+
+        start, end = self._clamp(entry, start, end)
+        return self._read(*self._span(entry, start, end, offset=entry.qualoffset))
+
+    def fetch_region(self, region):
+        """
+        Fetches a samtools-style region: 'name', 'name:start' or 'name:start-end' with
+        1-based, inclusive positions.
+        """
+        m = REGION_RE.match(region)
+
+        if m is None or m.group(1) not in self.entries:
+            ## names can contain colons themselves
+            if region in self.entries:
+                return self.fetch(region)
+
+            raise KeyError(region)
+
+        name, start, end = m.groups()
+        start = int(start.replace(',', '')) - 1 if start else None
+        end = int(end.replace(',', '')) if end else None
+
+        return self.fetch(name, start, end)
+
+    def _clamp(self, entry, start, end):
+        if start is None or start < 0:
+            start = 0
+
+        if end is None or end > entry.length:
+            end = entry.length
+
+        return (start, end)
+
+
+def index_local_file(local_file):
+    """
+    Indexes a FASTA or FASTQ LocalFile, returning the .fai path or None if it isn't one
+    (or can't be indexed.)
+    """
+    filetype = local_file.filetype
+
+    if filetype is None or filetype.format not in ('FASTA', 'FASTQ'):
+        return None
+
+    return build_index(local_file.get_filesystem_path(), filetype.format)
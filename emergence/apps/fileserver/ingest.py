@@ -0,0 +1,193 @@
+"""
+Ingests a directory tree into a DataCollection: every file under it is registered in place
+as a LocalFile (see LocalFile.register_local) and added to the collection.
+
+Sequencing-core drops arrive as directories with thousands of files, so this is built to
+go through them quickly and to be run again safely:
+
+  - The tree is walked with os.scandir(), which gets file types from the directory
+    listing itself rather than a stat() per entry.
+  - Files are sniffed (fileserver.sniffer), hashed and symlinked by a pool of threads.
+    All of that is I/O, during which the GIL is released.
+  - Rows are written in batches, one INSERT per table per batch (see libs.bulk), each
+    batch in its own transaction.
+  - Files already registered with the same size and modification time are skipped, so
+    a re-scan (or a run picking up after an interrupted one) only does the work for new
+    and changed files.
+
+New files aren't indexed as they're registered.  That happens the first time they're
+used instead (see LocalFile.get_indexed.)
+"""
+
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+from django.db.models import get_model
+
+from emergence.libs.bulk import reserve_ids, bulk_create_inherited
+from fileserver.sniffer import sniff
+
+
+## how many files are written per transaction
+BATCH_SIZE = 500
+
+## files we write next to sequence files ourselves (see fileserver.faidx)
+SKIPPED_SUFFIXES = ('.fai', '.gzi')
+
+## what a worker learned about one file
+Examined = namedtuple('Examined', ['path', 'stat', 'filetype_name', 'sha256', 'link_name', 'error'])
+
+IngestResult = namedtuple('IngestResult', ['added', 'updated', 'unchanged', 'failed'])
+
+
+def walk_files(root):
+    """
+    Yields (path, stat) for each regular file under 'root', skipping hidden files and
+    directories.  Symlinked directories aren't followed, so a link back up the tree can't
+    loop.
+    """
+    pending = [root]
+
+    while len(pending) > 0:
+        directory = pending.pop()
+
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.name.startswith('.'):
+                continue
+
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+            elif entry.is_file() and not entry.name.endswith(SKIPPED_SUFFIXES):
+                try:
+                    yield entry.path, entry.stat()
+                except OSError:
+                    continue
+
+
+def _examine(path, st, link=True):
+    ## imported here as flow.cache checks LocalFiles for recorded digests
+    from flow.cache import file_digest
+
+    LocalFile = get_model('fileserver', 'LocalFile')
+
+    try:
+        detection = sniff(path)
+        sha256 = file_digest(path, use_recorded=False)
+        link_name = LocalFile()._make_link(path) if link else None
+    except Exception as e:
+        return Examined(path, st, None, None, None, e)
+
+    return Examined( path, st, detection.name if detection is not None else None, sha256, link_name, None )
+
+
+def _write_batch(collection, examined, existing, filetype_ids):
+    LocalFile = get_model('fileserver', 'LocalFile')
+    CollectionContents = get_model('fileserver', 'CollectionContents')
+
+    new_files = list()
+
+    with transaction.atomic():
+        for item in examined:
+            fields = { 'size': item.stat.st_size, 'mtime': item.stat.st_mtime, 'inode': item.stat.st_ino, \
+                       'sha256': item.sha256, 'filetype_id': filetype_ids.get(item.filetype_name) }
+
+            if item.path in existing:
+                ## changed since it was registered, so what was known about it no longer applies
+                LocalFile.objects.filter(pk=existing[item.path][0]).update(metadata='', **fields)
+            else:
+                new_files.append( LocalFile(label=os.path.basename(item.path)[:100], source_path=item.path, \
+                                            path=item.link_name, metadata='', **fields) )
+
+        ids = reserve_ids(LocalFile, len(new_files))
+        for local_file, id in zip(new_files, ids):
+            local_file.id = id
+
+        bulk_create_inherited(new_files)
+
+        ## changed files are in the collection already, unless they were put in another one
+        in_collection = set( CollectionContents.objects.filter(collection=collection) \
+                                                       .values_list('source_id', flat=True) )
+        source_ids = [f.id for f in new_files] + [existing[i.path][0] for i in examined if i.path in existing]
+
+        CollectionContents.objects.bulk_create( [ CollectionContents(collection=collection, source_id=id) \
+                                                  for id in source_ids if id not in in_collection ] )
+
+
+def ingest_directory(collection, root=None, workers=8, batch_size=None, log=None):
+    """
+    Registers every file under 'root' (by default the collection's path) and adds it to
+    'collection', a DataCollection.  Files registered before which haven't changed size
+    or modification time are left alone, apart from being added to the collection if
+    they aren't in it yet.
+
+    'log', if given, is called with a message for each file which couldn't be read.
+    Returns an IngestResult of counts.
+    """
+    LocalFile = get_model('fileserver', 'LocalFile')
+    CollectionContents = get_model('fileserver', 'CollectionContents')
+    Filetype = get_model('biotools', 'Filetype')
+
+    if root is None:
+        root = collection.path
+    if batch_size is None:
+        batch_size = BATCH_SIZE
+
+    root = os.path.abspath(root)
+    filetype_ids = dict(Filetype.objects.values_list('name', 'id'))
+
+    ## source path -> (id, size, mtime) of everything registered under the root already
+    existing = dict()
+    for id, source_path, size, mtime in LocalFile.objects.filter(source_path__startswith=root + os.sep) \
+                                                         .values_list('id', 'source_path', 'size', 'mtime'):
+        existing[source_path] = (id, size, mtime)
+
+    in_collection = set( CollectionContents.objects.filter(collection=collection).values_list('source_id', flat=True) )
+
+    added = updated = unchanged = failed = 0
+    unchanged_ids = list()
+    to_examine = list()
+
+    for path, st in walk_files(root):
+        known = existing.get(path)
+
+        if known is not None and known[1:] == (st.st_size, st.st_mtime):
+            unchanged += 1
+            if known[0] not in in_collection:
+                unchanged_ids.append(known[0])
+        else:
+            to_examine.append((path, st))
+
+    if len(unchanged_ids) > 0:
+        CollectionContents.objects.bulk_create( [ CollectionContents(collection=collection, source_id=id) \
+                                                  for id in unchanged_ids ] )
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(to_examine), batch_size):
+            batch = to_examine[start:start + batch_size]
+
+            ## changed files keep the symlink they have
+            examined = list( pool.map(lambda item: _examine(item[0], item[1], link=item[0] not in existing), batch) )
+
+            for item in examined:
+                if item.error is not None:
+                    failed += 1
+                    if log is not None:
+                        log("WARNING: skipped {0}: {1}".format(item.path, item.error))
+
+            examined = [item for item in examined if item.error is None]
+            _write_batch(collection, examined, existing, filetype_ids)
+
+            for item in examined:
+                if item.path in existing:
+                    updated += 1
+                else:
+                    added += 1
+
+    return IngestResult(added, updated, unchanged, failed)
@@ -0,0 +1,44 @@
+## This should not be run directly.  Instead, run as a command through manage.py like:
+#   python3 manage.py ingest /data/seqcore/run_0412 --collection "Run 412" --workers 16
+#
+## https://docs.djangoproject.com/en/dev/howto/custom-management-commands/
+
+import os
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from emergence.apps.fileserver.ingest import ingest_directory
+from emergence.apps.fileserver.models import DataCollection
+
+class Command(BaseCommand):
+    ## write messages via self.stdout.write and self.stderr.write
+    args = '<directory>'
+    help = 'Registers every file under a directory in place and adds them to a DataCollection'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--collection', dest='collection', default=None,
+                    help='Name of the DataCollection to add to, created if needed (default: the directory name)'),
+        make_option('--workers', dest='workers', type='int', default=8,
+                    help='Number of files sniffed and hashed at once'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: ingest <directory>")
+
+        root = os.path.abspath(args[0])
+        if not os.path.isdir(root):
+            raise CommandError("{0} isn't a directory".format(root))
+
+        ## re-running against the same directory resumes into the same collection
+        collection = DataCollection.objects.filter(path=root).order_by('id').first()
+        if collection is None:
+            collection = DataCollection( name=options['collection'] or os.path.basename(root), path=root )
+            collection.save()
+
+        started = time.time()
+        result = ingest_directory( collection, root=root, workers=options['workers'], \
+                                   log=lambda message: self.stderr.write(message + "\n") )
+
+        self.stdout.write( "INFO: {0} added, {1} updated, {2} unchanged, {3} failed in {4:.1f}s\n".format( \
+                           result.added, result.updated, result.unchanged, result.failed, time.time() - started) )
@@ -1,14 +1,325 @@
+import errno
+import json
+import os
+import time
 from django.db import models
+from django.db.models import get_model
 from django.contrib.auth.models import User, Group
+from fileserver.faidx import IndexedFile, index_local_file
+from fileserver.seqstats import sequence_stats
+from fileserver.sniffer import sniff
+from fileserver.storage import content_storage
 
 class DataSource( models.Model ):
     label       = models.CharField( max_length=100 )
     added_by    = User()
 
+    ## What kind of data this is, as tools describe their inputs (see biotools.discovery)
+    filetype    = models.ForeignKey( 'biotools.Filetype', null=True, blank=True )
+
+    ## JSON object of anything learned about the data, such as its sequence statistics
+    metadata    = models.TextField( blank=True )
+
+    def get_metadata(self, key=None):
+        """
+        Returns the whole metadata dict, or just the value under 'key' (None if unset)
+        """
+        metadata = json.loads(self.metadata) if self.metadata else dict()
+
+        if key is None:
+            return metadata
+        else:
+            return metadata.get(key)
+
+    def set_metadata(self, key, value):
+        """
+        Sets one metadata value, leaving the rest alone.  This doesn't save.
+        """
+        metadata = self.get_metadata()
+        metadata[key] = value
+        self.metadata = json.dumps(metadata, sort_keys=True)
+
 class LocalFile( DataSource ):
     ## https://docs.djangoproject.com/en/1.5/topics/files/
     ## might look into using django-filer here
-    path = models.FileField( upload_to='%Y/%m/%d' )
+    #  Uploads are stored once per distinct content and hard linked (see fileserver.storage)
+    path = models.FileField( upload_to='%Y/%m/%d', storage=content_storage )
+
+    ## The file as it was when its filetype was last detected.  If these still match what's
+    #  on disk there's no need to look at it again.
+    size  = models.BigIntegerField( null=True, blank=True )
+    mtime = models.FloatField( null=True, blank=True )
+    inode = models.BigIntegerField( null=True, blank=True )
+
+    ## Hex SHA-256 of the content.  Set from the upload as it's received, or computed on
+    #  demand by get_sha256() for files registered in place.
+    sha256 = models.CharField( max_length=64, null=True, blank=True, db_index=True )
+
+    ## Absolute path of a file registered in place on shared storage with register_local().
+    #  'path' is then a symlink to it under MEDIA_ROOT rather than a copy.
+    source_path = models.CharField( max_length=1000, null=True, blank=True, db_index=True )
+
+    def save(self, *args, **kwargs):
+        ## An upload is stored first (which hashes it) so that it can be looked at before
+        #  the row is written.  Django would otherwise do this during the save.
+        if self.path and not self.path._committed:
+            self.path.save(self.path.name, self.path, save=False)
+            self.sha256 = content_storage.pop_digest(self.path.name)
+
+            st = os.stat(self.get_filesystem_path())
+            self.size, self.mtime, self.inode = st.st_size, st.st_mtime, st.st_ino
+
+        if self.filetype_id is None:
+            self.detect_filetype()
+
+        super(LocalFile, self).save(*args, **kwargs)
+
+    @classmethod
+    def register_local(cls, source_path, label=None):
+        """
+        Registers a file already on shared storage without copying it.  A symlink to it is
+        made under MEDIA_ROOT/YYYY/MM/DD and its absolute path, size and modification time
+        are recorded so later changes can be noticed (see is_stale().)  Registering the same
+        path again returns the existing LocalFile, refreshed if the file has changed.
+        """
+        source_path = os.path.abspath(source_path)
+        st = os.stat(source_path)
+
+        if not os.path.isfile(source_path):
+            raise Exception("ERROR: {0} isn't a regular file".format(source_path))
+
+        local_file = cls.objects.filter(source_path=source_path).order_by('id').first()
+
+        if local_file is not None:
+            local_file.check_link()
+            if local_file.is_stale():
+                local_file.refresh()
+            return local_file
+
+        local_file = cls( label=label or os.path.basename(source_path), source_path=source_path, \
+                          size=st.st_size, mtime=st.st_mtime, inode=st.st_ino )
+        local_file.path.name = local_file._make_link(source_path)
+        local_file.save()
+
+        return local_file
+
+    def _make_link(self, source_path, name=None):
+        """
+        Creates a symlink to 'source_path' in the media directory for today (or at 'name')
+        and returns its name relative to MEDIA_ROOT.
+        """
+        if name is None:
+            name = os.path.join(time.strftime('%Y/%m/%d'), os.path.basename(source_path))
+
+        storage = self.path.storage
+
+        while True:
+            name = storage.get_available_name(name)
+            link_path = storage.path(name)
+
+            if not os.path.isdir(os.path.dirname(link_path)):
+                os.makedirs(os.path.dirname(link_path))
+
+            try:
+                os.symlink(source_path, link_path)
+                return name
+            except OSError as e:
+                ## somebody else took the name in the meantime
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def check_link(self, repair=True):
+        """
+        For a file registered with register_local(), checks that its symlink under
+        MEDIA_ROOT still points at the original and that the original is still there.  A
+        missing or wrong link is recreated if 'repair' is True.  Returns True if the file
+        can be reached through the link.  Uploads always return True.
+        """
+        if self.source_path is None:
+            return True
+
+        link_path = self.path.path
+
+        try:
+            target = os.readlink(link_path)
+        except OSError:
+            target = None
+
+        if target != self.source_path:
+            if not repair or not os.path.exists(self.source_path):
+                return False
+
+            if os.path.lexists(link_path):
+                os.remove(link_path)
+
+            name = self._make_link(self.source_path, name=self.path.name)
+            if name != self.path.name:
+                self.path.name = name
+                LocalFile.objects.filter(pk=self.pk).update(path=name)
+
+        return os.path.exists(link_path)
+
+    def is_stale(self):
+        """
+        True if the file has changed or gone since its size, modification time and inode
+        were recorded.  This is a single stat() call, so it's cheap enough to check every
+        time the file is used.
+        """
+        return not self.is_unchanged()
+
+    def refresh(self):
+        """
+        Updates what's recorded about a file which has changed: its stats and filetype are
+        taken again, and the old digest and index, which no longer apply, are dropped.
+        """
+        self.sha256 = None
+        self.detect_filetype(force=True)
+
+        metadata = self.get_metadata()
+        metadata.pop('fai', None)
+        metadata.pop('sequence_stats', None)
+        self.metadata = json.dumps(metadata, sort_keys=True) if metadata else ''
+
+        LocalFile.objects.filter(pk=self.pk).update( sha256=None, size=self.size, mtime=self.mtime, \
+                                                     inode=self.inode, filetype=self.filetype, \
+                                                     metadata=self.metadata )
+
+    @classmethod
+    def with_content(cls, sha256):
+        """
+        Returns a LocalFile already holding content with this SHA-256, or None, so the
+        same data can be shared between DataCollections rather than added again.
+        """
+        return cls.objects.filter(sha256=sha256).order_by('id').first()
+
+    def get_sha256(self):
+        """
+        Returns the SHA-256 of the file's content, hashing it (in chunks) and saving the
+        result if it isn't known or the file has changed since.
+        """
+        if self.sha256 is not None and self.is_unchanged():
+            return self.sha256
+
+        ## imported here as flow.cache checks LocalFiles for recorded digests
+        from flow.cache import file_digest
+
+        path = self.get_filesystem_path()
+        st = os.stat(path)
+
+        if (self.size, self.mtime, self.inode) != (st.st_size, st.st_mtime, st.st_ino):
+            self.size, self.mtime, self.inode = st.st_size, st.st_mtime, st.st_ino
+            self.filetype = None
+            self.detect_filetype()
+
+        self.sha256 = file_digest(path, use_recorded=False)
+        LocalFile.objects.filter(pk=self.pk).update( sha256=self.sha256, size=self.size, mtime=self.mtime, \
+                                                     inode=self.inode, filetype=self.filetype )
+        return self.sha256
+
+    def get_filesystem_path(self):
+        """
+        Returns where the file is on disk.  Files registered in place (like the examples)
+        are stored with their absolute path, uploads relative to MEDIA_ROOT.  Files
+        registered with register_local() are used from where they are rather than through
+        their symlink.
+        """
+        if self.source_path is not None:
+            return self.source_path
+        elif os.path.isabs(self.path.name):
+            return self.path.name
+        else:
+            return self.path.path
+
+    def is_unchanged(self):
+        """
+        True if the file's size, modification time and inode are as last recorded.
+        """
+        try:
+            st = os.stat(self.get_filesystem_path())
+        except OSError:
+            return False
+
+        return (self.size, self.mtime, self.inode) == (st.st_size, st.st_mtime, st.st_ino)
+
+    def detect_filetype(self, force=False):
+        """
+        Sets the filetype from the first few KB of the file (see fileserver.sniffer) unless
+        it's already known and the file hasn't changed.  Returns the Filetype, or None if it
+        couldn't be recognized.  This doesn't save.
+        """
+        Filetype = get_model('biotools', 'Filetype')
+
+        if not force and self.filetype_id is not None and self.is_unchanged():
+            return self.filetype
+
+        path = self.get_filesystem_path()
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        self.size, self.mtime, self.inode = st.st_size, st.st_mtime, st.st_ino
+
+        detection = sniff(path)
+        if detection is None or detection.name is None:
+            self.filetype = None
+        else:
+            self.filetype = Filetype.objects.filter(name=detection.name).first()
+
+        return self.filetype
+
+    def compute_sequence_stats(self, save=True):
+        """
+        Reads through a FASTA or FASTQ file once to get its record and base counts, GC
+        content, N50 and length histogram (see fileserver.seqstats) and stores them in the
+        metadata under 'sequence_stats'.  Returns the stats.
+        """
+        format = None
+        if self.filetype_id is not None and self.filetype.format in ('FASTA', 'FASTQ'):
+            format = self.filetype.format
+
+        stats = sequence_stats(self.get_filesystem_path(), format=format)
+        self.set_metadata('sequence_stats', stats)
+
+        if save is True:
+            LocalFile.objects.filter(pk=self.pk).update(metadata=self.metadata)
+
+        return stats
+
+    def build_index(self, save=True):
+        """
+        Writes a samtools-compatible .fai index (and .gzi for BGZF) for a FASTA or FASTQ
+        file and records its path in the metadata under 'fai'.  Returns the path, or None
+        if the file isn't one or is compressed with plain gzip.  See fileserver.faidx
+        """
+        fai_path = index_local_file(self)
+
+        if fai_path is not None:
+            self.set_metadata('fai', fai_path)
+
+            if save is True:
+                LocalFile.objects.filter(pk=self.pk).update(metadata=self.metadata)
+
+        return fai_path
+
+    def get_indexed(self):
+        """
+        Returns an IndexedFile for fetching records and regions by name, building the index
+        first if there isn't one.
+        """
+        if self.source_path is not None and self.is_stale():
+            self.refresh()
+
+        fai_path = self.get_metadata('fai')
+
+        if fai_path is None or not os.path.exists(fai_path):
+            fai_path = self.build_index()
+
+        if fai_path is None:
+            raise Exception("ERROR: {0} can't be indexed".format(self.get_filesystem_path()))
+
+        return IndexedFile(self.get_filesystem_path(), fai_path=fai_path)
 
 class DataCollection( models.Model ):
     name        = models.CharField( max_length=100 )
@@ -23,4 +334,3 @@ class CollectionContents( models.Model ):
     """
     source = models.ForeignKey(DataSource)
     collection = models.ForeignKey(DataCollection)
-    
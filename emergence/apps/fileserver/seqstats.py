@@ -0,0 +1,217 @@
+"""
+Sequence statistics for FASTA and FASTQ files: record counts, base counts, GC content,
+N50 and length histograms.
+
+Files are read once in fixed-size chunks (decompressing gzip along the way) and each
+chunk is handled with whole-buffer operations - bytes.count(), translate(), split() and
+regex splitting, all of which run in C - rather than by looping over lines in Python.
+Only the partial record at the end of each chunk is carried over to the next, and record
+lengths are kept as a Counter of length -> records, so memory stays flat however big the
+file is.  Read sets have a few hundred distinct lengths at most.
+"""
+
+import gzip
+import re
+from collections import Counter
+
+from fileserver.sniffer import GZIP_MAGIC, detect
+
+
+## how much is read at once
+CHUNK_SIZE = 1048576
+
+## number of bins in the length histogram
+HISTOGRAM_BINS = 20
+
+## header lines within a chunk of FASTA, including their line endings
+FASTA_HEADER_RE = re.compile(br'^>[^\n]*\n?', re.MULTILINE)
+
+UPPERCASE = bytes.maketrans(b'acgtun', b'ACGTUN')
+
+
+def _open(path):
+    with open(path, 'rb') as fh:
+        magic = fh.read(2)
+
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, 'rb')
+    else:
+        return open(path, 'rb')
+
+
+def _read_blocks(fh):
+    """
+    Yields the file in chunks which end on a line boundary.
+    """
+    carry = b''
+
+    while True:
+        chunk = fh.read(CHUNK_SIZE)
+
+        if len(chunk) == 0:
+            if len(carry) > 0:
+                yield carry + b'\n'
+            return
+
+        chunk = carry + chunk
+        last_newline = chunk.rfind(b'\n')
+
+        if last_newline == -1:
+            carry = chunk
+            continue
+
+        carry = chunk[last_newline + 1:]
+
+        block = chunk[:last_newline + 1]
+        if b'\r' in block:
+            block = block.replace(b'\r', b'')
+
+        yield block
+
+
+class SequenceCounts(object):
+    """
+    Running totals, fed sequence data a buffer at a time.
+    """
+
+    def __init__(self):
+        self.lengths = Counter()
+        self.bases = Counter()
+
+    def add_sequence_bytes(self, seq):
+        """
+        Counts the bases in a buffer of sequence with no headers or line endings.
+        """
+        seq = seq.translate(UPPERCASE)
+
+        for base in (b'A', b'C', b'G', b'T', b'U', b'N'):
+            self.bases[base.decode('ascii')] += seq.count(base)
+
+    def summarize(self):
+        records = sum(self.lengths.values())
+        total = sum(length * count for length, count in self.lengths.items())
+
+        stats = { 'records': records, 'bases': total, 'n_count': self.bases['N'] }
+
+        if records == 0:
+            return stats
+
+        acgt = self.bases['A'] + self.bases['C'] + self.bases['G'] + self.bases['T'] + self.bases['U']
+        stats['gc_percent'] = round(100.0 * (self.bases['G'] + self.bases['C']) / acgt, 2) if acgt > 0 else None
+
+        distinct = sorted(self.lengths.keys(), reverse=True)
+        stats['max_length'] = distinct[0]
+        stats['min_length'] = distinct[-1]
+        stats['mean_length'] = round(float(total) / records, 2)
+
+        ## N50: the length at which the longest records add up to half the bases
+        running = 0
+        for length in distinct:
+            running += length * self.lengths[length]
+            if running * 2 >= total:
+                stats['n50'] = length
+                break
+
+        stats['length_histogram'] = self.histogram(stats['min_length'], stats['max_length'])
+        return stats
+
+    def histogram(self, low, high, bins=None):
+        """
+        Returns a list of [bin start, bin end, record count] with equal-width bins.
+        """
+        if bins is None:
+            bins = HISTOGRAM_BINS
+
+        width = max(1, -(-(high - low + 1) // bins))
+        counts = Counter()
+
+        for length, count in self.lengths.items():
+            counts[(length - low) // width] += count
+
+        return [ [low + i * width, low + (i + 1) * width - 1, counts[i]] for i in range((high - low) // width + 1) ]
+
+
+def _fasta_stats(fh):
+    counts = SequenceCounts()
+    current = None
+
+    for block in _read_blocks(fh):
+        ## Splitting on headers leaves the sequence between them.  The first piece belongs
+        #  to whatever record was open at the end of the last block.
+        pieces = FASTA_HEADER_RE.split(block)
+        header_count = len(pieces) - 1
+
+        lengths = [ len(p) - p.count(b'\n') for p in pieces ]
+
+        ## anything before the first header isn't sequence
+        if current is None:
+            pieces[0] = b''
+        else:
+            current += lengths[0]
+
+        if header_count > 0:
+            if current is not None:
+                counts.lengths[current] += 1
+
+            counts.lengths.update(lengths[1:-1])
+            current = lengths[-1]
+
+        counts.add_sequence_bytes(b''.join(pieces).replace(b'\n', b''))
+
+    if current is not None:
+        counts.lengths[current] += 1
+
+    return counts.summarize()
+
+
+def _fastq_stats(fh):
+    counts = SequenceCounts()
+    carry = list()
+
+    for block in _read_blocks(fh):
+        lines = block.split(b'\n')
+        lines.pop()
+
+        if len(carry) > 0:
+            lines = carry + lines
+
+        ## only whole four-line records, the rest waits for the next block
+        usable = len(lines) - len(lines) % 4
+        carry = lines[usable:]
+
+        sequences = lines[1:usable:4]
+        counts.lengths.update(map(len, sequences))
+        counts.add_sequence_bytes(b''.join(sequences))
+
+    return counts.summarize()
+
+
+def sequence_stats(path, format=None):
+    """
+    Returns a dict of statistics for a FASTA or FASTQ file:
+
+        records            number of sequences
+        bases              total sequence length
+        n_count            number of Ns
+        gc_percent         G+C as a percentage of A, C, G and T (or U)
+        min_length, max_length, mean_length, n50
+        length_histogram   list of [bin start, bin end, records]
+
+    The format is detected if not given (see fileserver.sniffer.)  Protein FASTA works too,
+    though the GC and N figures don't mean much for it.
+    """
+    if format is None:
+        detection = detect(path)
+        if detection is None or detection.format not in ('FASTA', 'FASTQ'):
+            raise Exception("ERROR: {0} doesn't look like FASTA or FASTQ".format(path))
+
+        format = detection.format
+
+    with _open(path) as fh:
+        if format == 'FASTQ':
+            stats = _fastq_stats(fh)
+        else:
+            stats = _fasta_stats(fh)
+
+    stats['format'] = format
+    return stats
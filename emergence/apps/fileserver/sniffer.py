@@ -0,0 +1,222 @@
+"""
+Detects what kind of bioinformatics file something is by looking at the start of it.
+
+Only the first SNIFF_SIZE bytes are read (after decompression, for gzipped files) so
+this costs the same for a 40GB FASTQ as for a tiny one.  Results are given as the name
+of one of the biotools Filetype fixtures where there is one, which is how tools describe
+their inputs (see biotools.discovery.)
+
+FASTQ quality encodings are told apart by the range of quality characters seen.  Paired
+read files are recognized by the usual naming conventions (left/right, _1/_2, _R1/_R2)
+or by read names ending in /1 or /2.
+
+Results are cached per process by device, inode, modification time and size, so
+re-scanning a directory of unchanged files doesn't read anything.
+"""
+
+import gzip
+import os
+import re
+from collections import namedtuple
+
+
+## how much of each file is looked at
+SNIFF_SIZE = 8192
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+## 'name' is the matching Filetype name, or None if there's no fixture for it
+Detection = namedtuple('Detection', ['format', 'variant', 'name'])
+
+NUCLEOTIDE_CHARS = frozenset('ACGTUNRYKMSWBDHVacgtunrykmswbdhv-.*')
+
+LEFT_NAME_RE = re.compile(r'(left|[._-]R?1)([._-]|$)', re.IGNORECASE)
+RIGHT_NAME_RE = re.compile(r'(right|[._-]R?2)([._-]|$)', re.IGNORECASE)
+
+GLIMMER_PREDICT_RE = re.compile(r'^\S+\s+\d+\s+\d+\s+[+-]\d\s+[\d.]+$')
+
+## (st_dev, st_ino, st_mtime, st_size) -> Detection, for this process
+_cache = dict()
+
+
+def read_header(path, size=None):
+    """
+    Returns up to 'size' bytes from the start of a file, decompressing it first if it's
+    gzipped, as a (text, complete) tuple.  'complete' is False if there was more to read.
+    """
+    if size is None:
+        size = SNIFF_SIZE
+
+    with open(path, 'rb') as fh:
+        magic = fh.read(2)
+
+    if magic == GZIP_MAGIC:
+        opener = gzip.open
+    else:
+        opener = open
+
+    with opener(path, 'rb') as fh:
+        data = fh.read(size + 1)
+
+    complete = len(data) <= size
+    return (data[:size].decode('latin-1'), complete)
+
+
+def _header_lines(text, complete):
+    lines = text.splitlines()
+
+    ## the last line is probably cut off
+    if not complete and len(lines) > 1:
+        lines.pop()
+
+    return lines
+
+
+def _pairing(path, read_names):
+    """
+    Returns 'left', 'right' or None for a file of reads, first from its name and then from
+    the read names seen.
+    """
+    filename = os.path.basename(path)
+
+    if LEFT_NAME_RE.search(filename):
+        return 'left'
+    if RIGHT_NAME_RE.search(filename):
+        return 'right'
+
+    suffixes = set( [n.split()[0][-2:] for n in read_names if len(n) > 0] )
+    if suffixes == set(['/1']):
+        return 'left'
+    if suffixes == set(['/2']):
+        return 'right'
+
+    return None
+
+
+def _detect_fasta(path, lines):
+    names = [l for l in lines if l.startswith('>')]
+    residues = "".join( [l.strip() for l in lines if not l.startswith('>') and not l.startswith(';')] )
+
+    if len(residues) == 0:
+        return Detection('FASTA', 'nucleotide', 'FASTA (nucleotide)')
+
+    nucleotides = sum( 1 for c in residues if c in NUCLEOTIDE_CHARS )
+    if float(nucleotides) / len(residues) < 0.9:
+        return Detection('FASTA', 'protein', 'FASTA (protein)')
+
+    ## many short records look like reads rather than an assembly or genome
+    if len(names) > 1 and len(residues) / len(names) < 1000:
+        pairing = _pairing(path, [n[1:] for n in names])
+        if pairing is not None:
+            return Detection('FASTA', 'nucleotide', "FASTA (paired reads, {0})".format(pairing))
+
+    return Detection('FASTA', 'nucleotide', 'FASTA (nucleotide)')
+
+
+def _detect_fastq(path, lines):
+    names = list()
+    qualities = list()
+
+    for i in range(0, len(lines) - 3, 4):
+        if not lines[i].startswith('@') or not lines[i + 2].startswith('+'):
+            return None
+
+        names.append(lines[i][1:])
+        qualities.append(lines[i + 3])
+
+    quality_chars = "".join(qualities)
+    if len(names) == 0 or len(quality_chars) == 0:
+        return None
+
+    lowest = min(quality_chars)
+    highest = max(quality_chars)
+
+    ## Phred+64 (Illumina 1.3 to 1.7) never goes below '@', while Sanger/Illumina 1.8+
+    #  qualities rarely go above 'J'.  Anything ambiguous is taken as the modern encoding.
+    if lowest >= '@' and highest > 'J':
+        return Detection('FASTQ', 'Illumina 1.3+', None)
+
+    pairing = _pairing(path, names)
+    if pairing is not None:
+        return Detection('FASTQ', 'Sanger', "FASTQ (Sanger, paired reads, {0})".format(pairing))
+
+    return Detection('FASTQ', 'Sanger', 'FASTQ')
+
+
+def _looks_like_sam(lines):
+    records = [l for l in lines if not l.startswith('@')]
+
+    if len(records) == 0:
+        return len(lines) > 0 and lines[0][:4] in ('@HD\t', '@SQ\t')
+
+    for line in records[:10]:
+        fields = line.split('\t')
+        if len(fields) < 11 or not fields[1].isdigit() or not fields[3].isdigit():
+            return False
+
+    return True
+
+
+def detect(path):
+    """
+    Returns a Detection for the file at 'path', or None if it isn't recognized.
+    """
+    text, complete = read_header(path)
+    lines = [l for l in _header_lines(text, complete) if l.strip() != '']
+
+    if len(lines) == 0:
+        return None
+
+    first = lines[0]
+
+    if first.startswith('##gff-version 3'):
+        return Detection('GFF3', 'canonical', 'GFF3')
+
+    if first.startswith('LOCUS '):
+        return Detection('GBK', 'canonical', 'GenBank Flat File Format')
+
+    if len(lines) > 1 and lines[1].strip() in ('NUCMER', 'PROMER') and len(first.split()) == 2:
+        return Detection('Mummer delta', 'canonical', 'MUMmer delta file')
+
+    if first.startswith('>'):
+        if len(lines) > 1 and GLIMMER_PREDICT_RE.match(lines[1].strip()):
+            return Detection('predict', 'canonical', 'Glimmer3 predict')
+
+        return _detect_fasta(path, lines)
+
+    if first.startswith('@'):
+        if _looks_like_sam(lines):
+            return Detection('SAM', 'canonical', 'SAM')
+
+        return _detect_fastq(path, lines)
+
+    if _looks_like_sam(lines):
+        return Detection('SAM', 'canonical', 'SAM')
+
+    ## some FASTA files (like NCBI's .faa downloads) start with a line of free text
+    for i in range(1, min(len(lines), 3)):
+        if lines[i].startswith('>'):
+            return _detect_fasta(path, lines[i:])
+
+    return None
+
+
+def sniff(path):
+    """
+    As detect(), but cached by the file's device, inode, modification time and size.
+    Returns None for anything unrecognized or unreadable.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    key = (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+
+    if key not in _cache:
+        try:
+            _cache[key] = detect(path)
+        except (IOError, OSError, EOFError):
+            return None
+
+    return _cache[key]
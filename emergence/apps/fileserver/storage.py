@@ -0,0 +1,167 @@
+"""
+Content-addressed storage for uploaded files.
+
+Every distinct file content is stored once, as a blob named for its SHA-256 under
+'objects/' in MEDIA_ROOT:
+
+    objects/3f/a9/3fa9c0...e1
+
+The name a file is saved under (like 2013/09/16/reads.fq) is a hard link to that blob,
+so it looks and behaves like an ordinary file to tools, but uploading the same genome
+again costs a directory entry rather than another copy.
+
+The hash is computed as the data streams in.  The upload handlers here hash each chunk
+as Django receives it, so by the time the file is saved its digest is already known and
+an existing blob means nothing has to be written at all.  Content arriving any other
+way is hashed while it's written to a temporary file, which then becomes the blob.
+Either way the data is only read once.
+"""
+
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def __init__(self, *args, **kwargs):
+        super(ContentAddressedStorage, self).__init__(*args, **kwargs)
+
+        ## name saved -> digest, until the model saving it collects it with pop_digest()
+        self._digests = dict()
+        self._lock = threading.Lock()
+
+    def blob_path(self, digest):
+        return os.path.join(self.location, 'objects', digest[:2], digest[2:4], digest)
+
+    def pop_digest(self, name):
+        """
+        Returns the SHA-256 of a file this storage instance just saved, or None.
+        """
+        with self._lock:
+            return self._digests.pop(name, None)
+
+    def _write_blob(self, content):
+        tmp_dir = os.path.join(self.location, 'objects', 'tmp')
+        if not os.path.isdir(tmp_dir):
+            os.makedirs(tmp_dir)
+
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode('utf-8')
+                    sha.update(chunk)
+                    fh.write(chunk)
+
+            digest = sha.hexdigest()
+            blob = self.blob_path(digest)
+
+            if os.path.exists(blob):
+                os.remove(tmp_path)
+            else:
+                if not os.path.isdir(os.path.dirname(blob)):
+                    os.makedirs(os.path.dirname(blob))
+
+                if getattr(settings, 'FILE_UPLOAD_PERMISSIONS', None) is not None:
+                    os.chmod(tmp_path, settings.FILE_UPLOAD_PERMISSIONS)
+
+                os.rename(tmp_path, blob)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return digest
+
+    def _save(self, name, content):
+        ## known already if it came through one of the upload handlers below
+        digest = getattr(content, 'sha256', None) or getattr(getattr(content, 'file', None), 'sha256', None)
+
+        if digest is None or not os.path.exists(self.blob_path(digest)):
+            digest = self._write_blob(content)
+
+        while True:
+            full_path = self.path(name)
+            directory = os.path.dirname(full_path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            try:
+                os.link(self.blob_path(digest), full_path)
+                break
+            except OSError as e:
+                ## somebody else took the name in the meantime
+                if e.errno == errno.EEXIST:
+                    name = self.get_available_name(name)
+                else:
+                    raise
+
+        with self._lock:
+            self._digests[name] = digest
+
+        return name
+
+    def collect_garbage(self):
+        """
+        Removes blobs which nothing links to any more and returns how many there were.
+        """
+        removed = 0
+
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self.location, 'objects')):
+            if os.path.basename(dirpath) == 'tmp':
+                continue
+
+            for filename in filenames:
+                blob = os.path.join(dirpath, filename)
+                if os.stat(blob).st_nlink == 1:
+                    os.remove(blob)
+                    removed += 1
+
+        return removed
+
+
+class HashingUploadMixin(object):
+    """
+    Hashes uploaded data chunk by chunk as it's received and sets the digest as 'sha256'
+    on the resulting file object.
+    """
+
+    def new_file(self, *args, **kwargs):
+        ## Set up first: MemoryFileUploadHandler raises StopFutureHandlers from new_file()
+        #  when it takes a file, so nothing after the call would run
+        self._sha = hashlib.sha256()
+        super(HashingUploadMixin, self).new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self._sha.update(raw_data)
+        return super(HashingUploadMixin, self).receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super(HashingUploadMixin, self).file_complete(file_size)
+
+        if uploaded is not None:
+            uploaded.sha256 = self._sha.hexdigest()
+
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+## shared by the models storing files this way
+content_storage = ContentAddressedStorage()
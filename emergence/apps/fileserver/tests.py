@@ -5,7 +5,24 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf.urls import patterns, url
+from django.http import HttpResponse
 from django.test import TestCase
+from django.test.utils import override_settings
+
+from fileserver.faidx import IndexedFile, build_index
+from fileserver.ingest import ingest_directory, walk_files
+from fileserver.models import CollectionContents, DataCollection, LocalFile
+from fileserver.seqstats import sequence_stats
+from fileserver.sniffer import sniff
+from fileserver.storage import ContentAddressedStorage
+from django.core.files.base import ContentFile
 
 
 class SimpleTest(TestCase):
@@ -14,3 +31,198 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class SnifferTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wb') as fh:
+            fh.write(text.encode('ascii'))
+        return path
+
+    def test_gzipped_paired_fastq(self):
+        path = self.write('sample.left.fq.gz', "@r1/1\nACGTN\n+\nII#II\n" * 3)
+        self.assertEqual(sniff(path).name, 'FASTQ (Sanger, paired reads, left)')
+
+    def test_phred64_fastq(self):
+        path = self.write('old.fq', "@r1\nACGT\n+\nhhBh\n")
+        self.assertEqual(sniff(path).variant, 'Illumina 1.3+')
+
+    def test_fasta_and_gff3(self):
+        self.assertEqual(sniff(self.write('g.fna', ">chr1\nACGTACGTNN\n")).name, 'FASTA (nucleotide)')
+        self.assertEqual(sniff(self.write('p.faa', ">p1\nMKRISTTITTTITITTGNGAG\n")).name, 'FASTA (protein)')
+        self.assertEqual(sniff(self.write('a.gff3', "##gff-version 3\n")).name, 'GFF3')
+        self.assertIsNone(sniff(self.write('notes.txt', "nothing to see\n")))
+
+    def test_sequence_stats(self):
+        path = self.write('contigs.fna.gz', ">c1\nACGTAC\nGGNN\n>c2\nAT\n>c3\nGGGC\n")
+        stats = sequence_stats(path)
+
+        self.assertEqual(stats['records'], 3)
+        self.assertEqual(stats['bases'], 16)
+        self.assertEqual(stats['n_count'], 2)
+        self.assertEqual(stats['n50'], 10)
+        self.assertEqual(stats['gc_percent'], round(100.0 * 9 / 14, 2))
+
+        path = self.write('reads.fq', "@r1\nACGT\n+\nIIII\n@r2\nAC\n+\nII\n")
+        stats = sequence_stats(path)
+        self.assertEqual((stats['records'], stats['bases'], stats['format']), (2, 6, 'FASTQ'))
+
+    def test_indexed_fetch(self):
+        path = self.write('genome.fna', ">chr1 first\nACGTA\nCCGTT\nGG\n>chr2\nTTTT\n")
+        build_index(path, 'FASTA')
+        seqs = IndexedFile(path)
+
+        self.assertEqual(bytes(seqs.fetch('chr1')), b'ACGTACCGTTGG')
+        self.assertEqual(bytes(seqs.fetch('chr1', 3, 8)), b'TACCG')
+        self.assertEqual(bytes(seqs.fetch_region('chr2:2-3')), b'TT')
+        self.assertEqual(bytes(seqs.fetch_raw('chr2')), b'TTTT')
+        seqs.close()
+
+        with open(path + '.fai') as fh:
+            self.assertEqual(fh.readline(), "chr1\t12\t12\t5\t6\n")
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(location=self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_identical_content_is_stored_once(self):
+        first = self.storage.save('2013/09/16/genome.fna', ContentFile(b">chr1\nACGT\n"))
+        second = self.storage.save('2013/09/17/genome.fna', ContentFile(b">chr1\nACGT\n"))
+
+        digest = self.storage.pop_digest(first)
+        self.assertEqual(digest, self.storage.pop_digest(second))
+        self.assertTrue(os.path.samefile(self.storage.path(first), self.storage.path(second)))
+        self.assertTrue(os.path.samefile(self.storage.path(first), self.storage.blob_path(digest)))
+
+        self.storage.delete(first)
+        self.storage.delete(second)
+        self.assertEqual(self.storage.collect_garbage(), 1)
+
+
+def _upload(request):
+    local_file = LocalFile(label='upload', path=request.FILES['file'])
+    local_file.save()
+    return HttpResponse(str(local_file.id))
+
+## for UploadTest
+urlpatterns = patterns('', url(r'^upload/$', _upload))
+
+
+class UploadTest(TestCase):
+    urls = 'fileserver.tests'
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+        self.storage = LocalFile._meta.get_field('path').storage
+        self.saved_location = self.storage.location
+        self.storage.location = os.path.join(self.dir, 'media')
+
+    def tearDown(self):
+        self.storage.location = self.saved_location
+        shutil.rmtree(self.dir)
+
+    def upload(self, content):
+        path = os.path.join(self.dir, 'reads.fq')
+        with open(path, 'wb') as fh:
+            fh.write(content)
+
+        with open(path, 'rb') as fh:
+            response = self.client.post('/upload/', {'file': fh})
+
+        return LocalFile.objects.get(id=int(response.content))
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_uploads_are_hashed_as_received(self):
+        ## one kept in memory and one spooled to a temporary file
+        for content in (b"@read1\nACGT\n+\nIIII\n", b"@read1\nACGT\n+\nIIII\n" * 1000):
+            local_file = self.upload(content)
+            self.assertEqual(local_file.sha256, hashlib.sha256(content).hexdigest())
+
+
+class RegisterLocalTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.dir, 'reads.fq')
+        with open(self.source, 'w') as fh:
+            fh.write("@read1\nACGT\n+\nIIII\n")
+
+        ## links go in a scratch media root rather than the real one
+        self.storage = LocalFile._meta.get_field('path').storage
+        self.saved_location = self.storage.location
+        self.storage.location = os.path.join(self.dir, 'media')
+
+    def tearDown(self):
+        self.storage.location = self.saved_location
+        shutil.rmtree(self.dir)
+
+    def test_register_links_without_copying(self):
+        local_file = LocalFile.register_local(self.source)
+        link_path = self.storage.path(local_file.path.name)
+
+        self.assertEqual(os.readlink(link_path), self.source)
+        self.assertEqual(local_file.get_filesystem_path(), self.source)
+        self.assertFalse(local_file.is_stale())
+        self.assertEqual(LocalFile.register_local(self.source).id, local_file.id)
+
+        os.remove(link_path)
+        self.assertTrue(local_file.check_link())
+        self.assertEqual(os.readlink(link_path), self.source)
+
+        with open(self.source, 'a') as fh:
+            fh.write("@read2\nACGT\n+\nIIII\n")
+        self.assertTrue(local_file.is_stale())
+
+
+class IngestTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'run_0412')
+
+        os.makedirs(os.path.join(self.root, 'lane1'))
+        for name in ('lane1/sample_R1.fastq', 'lane1/sample_R2.fastq', 'lane1/sample_R1.fastq.fai', '.listing'):
+            with open(os.path.join(self.root, name), 'w') as fh:
+                fh.write("@read1\nACGT\n+\nIIII\n")
+
+        self.storage = LocalFile._meta.get_field('path').storage
+        self.saved_location = self.storage.location
+        self.storage.location = os.path.join(self.dir, 'media')
+
+    def tearDown(self):
+        self.storage.location = self.saved_location
+        shutil.rmtree(self.dir)
+
+    def test_walk_skips_hidden_and_index_files(self):
+        names = [os.path.relpath(path, self.root) for path, st in walk_files(self.root)]
+        self.assertEqual(sorted(names), ['lane1/sample_R1.fastq', 'lane1/sample_R2.fastq'])
+
+    def test_rescan_only_processes_changes(self):
+        collection = DataCollection(name='run_0412', path=self.root)
+        collection.save()
+
+        result = ingest_directory(collection, workers=2)
+        self.assertEqual((result.added, result.updated, result.unchanged), (2, 0, 0))
+        self.assertEqual(CollectionContents.objects.filter(collection=collection).count(), 2)
+
+        with open(os.path.join(self.root, 'lane1', 'sample_R2.fastq'), 'a') as fh:
+            fh.write("@read2\nACGT\n+\nIIII\n")
+
+        result = ingest_directory(collection, workers=2)
+        self.assertEqual((result.added, result.updated, result.unchanged), (0, 1, 1))
+        self.assertEqual(CollectionContents.objects.filter(collection=collection).count(), 2)
+
+        local_file = LocalFile.objects.get(source_path=os.path.join(self.root, 'lane1', 'sample_R1.fastq'))
+        self.assertEqual(os.readlink(self.storage.path(local_file.path.name)), local_file.source_path)
@@ -0,0 +1,295 @@
+"""
+A content-addressed cache of Command results.
+
+Two Commands do the same work when they run the same tool version with the same
+parameters over input files with the same content.  That's captured in a cache key: a
+SHA-256 over the rendered exec string (with output paths replaced by placeholders, since
+each run writes somewhere new), the tool's name and version, and the content hash of
+every input file named through the tool's ToolFiletypeParams.
+
+When a Command completes successfully its key is recorded along with where its outputs
+were written (see flow.models.CachedResult.)  A later Command with the same key links
+those outputs to its own output paths and is marked complete without running at all.
+Each output is stamped as it's recorded (see output_stamp) and anything overwritten or
+replaced since makes the result a miss, rather than linking in the wrong data.
+
+Hashing a large input file isn't free, so digests are memoized per process against the
+file's device, inode, modification time and size.  Files registered as fileserver
+LocalFiles usually have their digest recorded already (taken as they were uploaded), in
+which case that's used while the file is unchanged.  Only a changed file is read again.
+"""
+
+import hashlib
+import os
+
+from django.db.models import Q, get_model
+
+from flow import registry
+from flow.exec_template import get_exec_template
+from flow.scheduler import get_io_paths
+
+
+## how much of a file is hashed at once
+HASH_CHUNK_SIZE = 1048576
+
+## path -> (st_dev, st_ino, st_mtime, st_size, digest), for this process
+_digests = dict()
+
+
+def _recorded_digest(path, st):
+    """
+    Returns the SHA-256 recorded for a LocalFile at this path, if the file hasn't changed
+    since it was recorded.
+    """
+    LocalFile = get_model('fileserver', 'LocalFile')
+    if LocalFile is None:
+        return None
+
+    ## uploads are stored relative to MEDIA_ROOT, files registered in place by full path
+    names = [path]
+    try:
+        names.append( os.path.relpath(path, LocalFile._meta.get_field('path').storage.location) )
+    except ValueError:
+        pass
+
+    ## files registered with LocalFile.register_local() are found by their original path too
+    recorded = LocalFile.objects.filter( Q(path__in=names) | Q(source_path=path), sha256__isnull=False, \
+                                         size=st.st_size, mtime=st.st_mtime, inode=st.st_ino ) \
+                                .values_list('sha256', flat=True)[:1]
+    return recorded[0] if len(recorded) > 0 else None
+
+
+def file_digest(path, use_recorded=None):
+    """
+    Returns the SHA-256 hex digest of a file's contents, or None if it can't be read.
+    Directories (such as a Bowtie index or Trinity output directory) hash their files'
+    relative paths and digests in sorted order.
+
+    Unless 'use_recorded' is False, a digest recorded for the file as a LocalFile is
+    trusted rather than reading the file.
+    """
+    if use_recorded is None:
+        use_recorded = True
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    if os.path.isdir(path):
+        sha = hashlib.sha256()
+
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                full_path = os.path.join(dirpath, filename)
+                digest = file_digest(full_path, use_recorded=False)
+                if digest is None:
+                    return None
+
+                sha.update(os.path.relpath(full_path, path).encode('utf-8'))
+                sha.update(digest.encode('ascii'))
+
+        return sha.hexdigest()
+
+    stamp = (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+    cached = _digests.get(path)
+
+    if cached is not None and cached[:4] == stamp:
+        return cached[4]
+
+    if use_recorded:
+        recorded = _recorded_digest(path, st)
+        if recorded is not None:
+            _digests[path] = stamp + (recorded,)
+            return recorded
+
+    sha = hashlib.sha256()
+
+    try:
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+    except (IOError, OSError):
+        return None
+
+    _digests[path] = stamp + (sha.hexdigest(),)
+    return sha.hexdigest()
+
+
+def get_cache_key(command):
+    """
+    Returns a (key, outputs) tuple for a Command, where 'outputs' maps the ids of its
+    output CommandBlueprintParams to the paths set for them.  The key is None when the
+    command can't be cached: its tool declares no outputs, or an input can't be read.
+    """
+    CommandParam = get_model('flow', 'CommandParam')
+
+    ## what the tool reads and writes comes from the registry rather than the database
+    blueprint = registry.get_blueprint(command.blueprint_id)
+    output_param_ids = set()
+    tools = set()
+
+    for tftp in blueprint.filetype_params:
+        tools.add( "{0} {1}".format(tftp.tool_name, tftp.tool_version) )
+
+        if tftp.io_type == 'o' and tftp.value is None:
+            output_param_ids.add(tftp.param_id)
+
+    template = get_exec_template(blueprint, blueprint.params)
+    set_values = dict( CommandParam.objects.filter(command=command).order_by('id').values_list('blueprint_id', 'value') )
+    values = dict(set_values)
+    outputs = dict()
+
+    for param_id, prefix, has_no_value, has_quoted_value, is_optional, default_value in template.params:
+        if param_id not in output_param_ids:
+            continue
+
+        path = values.get(param_id, None if is_optional else default_value)
+        if path:
+            outputs[param_id] = path
+            values[param_id] = "{{output:{0}}}".format(param_id)
+
+    if len(outputs) == 0:
+        return (None, outputs)
+
+    sha = hashlib.sha256()
+    sha.update(template.render(values).encode('utf-8'))
+
+    for tool in sorted(tools):
+        sha.update(b'\0')
+        sha.update(tool.encode('utf-8'))
+
+    for path in sorted(get_io_paths([command], values={command.id: set_values})[command.id][0]):
+        digest = file_digest(path)
+        if digest is None:
+            return (None, outputs)
+
+        sha.update(b'\0')
+        sha.update(digest.encode('ascii'))
+
+    return (sha.hexdigest(), outputs)
+
+
+def output_stamp(path):
+    """
+    Returns a string identifying a file's current content without reading it: its device,
+    inode, size and modification time.  Writing to the file in place or replacing it
+    changes the stamp.  A directory's stamp covers every file under it.  Returns None if
+    the path doesn't exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    if not os.path.isdir(path):
+        return "{0}:{1}:{2}:{3}".format(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    sha = hashlib.sha256()
+
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            full_path = os.path.join(dirpath, filename)
+            stamp = output_stamp(full_path)
+            if stamp is None:
+                return None
+
+            sha.update(os.path.relpath(full_path, path).encode('utf-8'))
+            sha.update(stamp.encode('ascii'))
+
+    return "dir:" + sha.hexdigest()
+
+
+def link_output(source, dest):
+    """
+    Makes a previous output available at a new path: a hard link where possible, falling
+    back to a symlink across filesystems and for directories.  Returns False if the
+    source is gone or something else is already at the destination.
+    """
+    if not os.path.exists(source):
+        return False
+
+    if os.path.lexists(dest):
+        return os.path.exists(dest) and os.path.samefile(source, dest)
+
+    dest_dir = os.path.dirname(dest)
+    if dest_dir and not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir)
+
+    if not os.path.isdir(source):
+        try:
+            os.link(source, dest)
+            return True
+        except OSError:
+            pass
+
+    os.symlink(os.path.abspath(source), dest)
+    return True
+
+
+def restore(command):
+    """
+    Looks up the Command's cache key and if a previous result matches, links its outputs
+    into place and returns the CachedResult.  Returns None on a miss.
+    """
+    CachedResult = get_model('flow', 'CachedResult')
+
+    if command.cache_key is None:
+        return None
+
+    try:
+        cached = CachedResult.objects.select_related('command').get(key=command.cache_key)
+    except CachedResult.DoesNotExist:
+        return None
+
+    previous = cached.get_outputs()
+    current = dict( (str(k), v) for k, v in command.cache_outputs.items() )
+
+    ## everything has to be there, just as it was written, before anything is linked
+    if set(previous.keys()) != set(current.keys()):
+        return None
+
+    for param_id, (path, stamp) in previous.items():
+        if stamp is None or output_stamp(path) != stamp:
+            return None
+
+    ## anything linked here is taken away again if a later output can't be
+    linked = list()
+
+    for param_id, (path, stamp) in previous.items():
+        dest = current[param_id]
+        existed = os.path.lexists(dest)
+
+        if not link_output(path, dest):
+            for created in linked:
+                os.remove(created)
+
+            return None
+
+        if not existed:
+            linked.append(dest)
+
+    return cached
+
+
+def store(command):
+    """
+    Records a successfully completed Command's outputs under its cache key.
+    """
+    CachedResult = get_model('flow', 'CachedResult')
+
+    if command.cache_key is None:
+        return
+
+    ## set by Command.run(), but a command handed over by Celery may not have it
+    outputs = getattr(command, 'cache_outputs', None)
+    if outputs is None:
+        outputs = get_cache_key(command)[1]
+
+    ## the most recent result wins, as its outputs are the most likely to still exist
+    CachedResult.objects.filter(key=command.cache_key).delete()
+    cached = CachedResult(key=command.cache_key, command_id=command.id)
+    cached.set_outputs( outputs, dict((param_id, output_stamp(path)) for param_id, path in outputs.items()) )
+    cached.save()
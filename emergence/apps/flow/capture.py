@@ -0,0 +1,151 @@
+"""
+Output capture for executed commands.
+
+Each command's stdout and stderr are streamed straight to its own log files as they're
+produced, with only a fixed-size tail of each kept in memory.  Tools like Bowtie and
+Trinity can write gigabytes to stderr, so nothing here ever holds more than that tail.
+Both pipes are read as data arrives (via select) so neither can fill up and stall the
+command while we're blocked on the other.
+"""
+
+import os
+import select
+import subprocess
+import time
+
+
+## how much is read from a pipe at once
+READ_SIZE = 65536
+
+
+class TailBuffer(object):
+    """
+    Keeps only the last 'size' bytes written to it.
+    """
+    __slots__ = ('size', 'data')
+
+    def __init__(self, size):
+        self.size = size
+        self.data = bytearray()
+
+    def write(self, chunk):
+        if len(chunk) >= self.size:
+            self.data = bytearray(chunk[-self.size:])
+        else:
+            self.data.extend(chunk)
+            overflow = len(self.data) - self.size
+            if overflow > 0:
+                del self.data[:overflow]
+
+    def getvalue(self):
+        return self.data.decode('utf-8', 'replace')
+
+
+def read_file_tail(path, size):
+    """
+    Returns the last 'size' bytes of a file as text without reading the rest of it.
+    """
+    with open(path, 'rb') as fh:
+        fh.seek(0, os.SEEK_END)
+        fh.seek(max(fh.tell() - size, 0))
+        return fh.read().decode('utf-8', 'replace')
+
+
+def read_io_counters(pid):
+    """
+    Returns a (bytes read, bytes written) tuple of storage I/O for a process from
+    /proc/<pid>/io, or None where that isn't available.  The counts include any children
+    the process has already reaped, which for a shell covers the commands it ran.
+    """
+    counters = dict()
+
+    try:
+        with open("/proc/{0}/io".format(pid)) as fh:
+            for line in fh:
+                name, value = line.split(':', 1)
+                counters[name] = int(value)
+    except (IOError, OSError, ValueError):
+        return None
+
+    return (counters.get('read_bytes', 0), counters.get('write_bytes', 0))
+
+
+def _open_log(path):
+    if path is None:
+        return open(os.devnull, 'wb')
+
+    log_dir = os.path.dirname(path)
+    if log_dir and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    return open(path, 'wb')
+
+
+def run_and_capture(exec_string, stdout_path=None, stderr_path=None, tail_size=None, \
+                    progress=None, progress_interval=None):
+    """
+    Runs a command string in a shell, streaming its stdout and stderr to the given paths
+    (discarded if None), and returns a (process, stdout tail, stderr tail, I/O counters)
+    tuple once the output has closed.  The process still needs to be waited on.
+
+    If a 'progress' callable is passed it's called with the current stdout and stderr
+    tails at most every 'progress_interval' seconds while the command runs.
+
+    The process's I/O counters (see read_io_counters) are sampled about once a second as
+    it runs, since they can't be read once it's been reaped.  The last sample is returned,
+    or None if they're unavailable.
+    """
+    if tail_size is None:
+        tail_size = 16384
+
+    if progress_interval is None:
+        progress_interval = 5
+
+    proc = subprocess.Popen(exec_string, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    tails = { 'stdout': TailBuffer(tail_size), 'stderr': TailBuffer(tail_size) }
+    logs = { 'stdout': _open_log(stdout_path), 'stderr': _open_log(stderr_path) }
+
+    ## fd -> stream name
+    open_fds = { proc.stdout.fileno(): 'stdout', proc.stderr.fileno(): 'stderr' }
+    last_progress = time.time()
+    last_io_sample = 0
+    io_counters = None
+
+    try:
+        while len(open_fds) > 0:
+            readable, _, _ = select.select(list(open_fds.keys()), [], [], progress_interval)
+
+            for fd in readable:
+                chunk = os.read(fd, READ_SIZE)
+                stream = open_fds[fd]
+
+                if len(chunk) == 0:
+                    del open_fds[fd]
+                    continue
+
+                logs[stream].write(chunk)
+                tails[stream].write(chunk)
+
+            if time.time() - last_io_sample >= 1:
+                io_counters = read_io_counters(proc.pid) or io_counters
+                last_io_sample = time.time()
+
+            if progress is not None and time.time() - last_progress >= progress_interval:
+                for log in logs.values():
+                    log.flush()
+
+                progress(tails['stdout'].getvalue(), tails['stderr'].getvalue())
+                last_progress = time.time()
+    finally:
+        for log in logs.values():
+            log.close()
+
+        proc.stdout.close()
+        proc.stderr.close()
+
+    ## once the output closes the process has usually exited, but it's still a zombie until
+    #  reaped and its counters are at their final values
+    io_counters = read_io_counters(proc.pid) or io_counters
+
+    return (proc, tails['stdout'].getvalue(), tails['stderr'].getvalue(), io_counters)
@@ -1,13 +1,20 @@
 from __future__ import absolute_import
 
+import os
+
 from celery import Celery
 
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "emergence.settings.dev")
+
 celery = Celery('flow.celery',
-                broker='amqp://',
-                backend='amqp://',
                 ## list of modules to start when the worker starts
                 include=['flow.executor'])
 
+## The broker and result backend come from BROKER_URL and CELERY_RESULT_BACKEND in the
+#  Django settings.  Installs without a broker can use the 'local' execution environment
+#  instead (see flow.environments)
+celery.config_from_object('django.conf:settings')
+
 # Optional configuration, see the application user guide.
 celery.conf.update(
     CELERY_TASK_RESULT_EXPIRES=3600,
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""
+Splits sequence files into chunks and merges per-chunk outputs back together, for
+scatter/gather flows (see flow.scatter.)  This runs as a Command like any other tool, so
+it's kept free of Django and can be run directly:
+
+    chunks.py split --format fasta --chunks 3 input.fna /scratch/chunk_{0}.fna
+    chunks.py gather --mode gff3 --chunks 3 merged.gff3 /scratch/chunk_{0}.gff3
+
+Chunk paths are given as a template with '{0}' where the chunk number (from 0) goes,
+which keeps the command line short however many chunks there are.
+
+Splitting is by byte offset.  The file is cut into equal byte ranges and each cut is
+moved forward to the start of the next record, which balances chunks by size without
+reading the file first.  Records are never split.
+
+Gather modes:
+
+  concat    Files joined as they are (FASTA, protein translations, etc.)
+  gff3      The '##gff-version' header is written once, and IDs (and Parent and
+            Derives_from references to them) are prefixed with the chunk number, since
+            tools like Prodigal number their features from 1 in every chunk.
+  coords    show-coords output: the header block is kept from the first chunk only.
+  delta     MUMmer delta files: the two header lines are kept from the first chunk only.
+"""
+
+import argparse
+import os
+import re
+import shutil
+
+
+## how much is copied at once
+COPY_SIZE = 1048576
+
+## how far past a cut to look for the next record
+SCAN_SIZE = 65536
+
+GFF3_ID_RE = re.compile(r'(^|;)(ID|Parent|Derives_from)=([^;]*)')
+
+
+def _is_fastq_record(fh, position):
+    """
+    True if a FASTQ record starts at 'position': a line starting with '@' and a third line
+    starting with '+'.  Quality lines can start with '@' too, so one isn't enough.
+    """
+    fh.seek(position)
+    lines = [fh.readline() for i in range(3)]
+    return lines[0].startswith(b'@') and lines[2].startswith(b'+')
+
+
+def _next_record_start(fh, position, format, size):
+    """
+    Returns the offset of the first record starting at or after 'position', or 'size' if
+    there isn't one.
+    """
+    marker = b'@' if format == 'fastq' else b'>'
+
+    ## back up one byte so a record starting exactly at the cut is found
+    position = max(position - 1, 0)
+
+    while position < size:
+        fh.seek(position)
+        data = fh.read(SCAN_SIZE)
+        if len(data) == 0:
+            break
+
+        start = 0
+        while True:
+            newline = data.find(b'\n' + marker, start)
+            if newline == -1:
+                break
+
+            candidate = position + newline + 1
+            if format != 'fastq' or _is_fastq_record(fh, candidate):
+                return candidate
+
+            start = newline + 1
+
+        ## keep the last byte, in case the newline and marker straddle the read
+        position += max(len(data) - 1, 1)
+
+    return size
+
+
+def guess_format(path):
+    """
+    Returns 'fasta' or 'fastq' from the first character of a file.  Compressed files can't
+    be split by offset and raise an exception, as does anything else.
+    """
+    with open(path, 'rb') as fh:
+        start = fh.read(2)
+
+    if start == b'\x1f\x8b':
+        raise Exception("ERROR: {0} is compressed and can't be split, decompress it first".format(path))
+    elif start.startswith(b'>'):
+        return 'fasta'
+    elif start.startswith(b'@'):
+        return 'fastq'
+    else:
+        raise Exception("ERROR: {0} doesn't look like FASTA or FASTQ".format(path))
+
+
+def split_offsets(path, chunks, format):
+    """
+    Returns up to 'chunks' (start, end) byte ranges of the file which each hold whole
+    records of the given 'fasta' or 'fastq' format.  Fewer come back if the file has
+    fewer records than that.
+    """
+    size = os.path.getsize(path)
+    cuts = [0]
+
+    with open(path, 'rb') as fh:
+        for i in range(1, chunks):
+            cut = _next_record_start(fh, max(size * i // chunks, cuts[-1] + 1), format, size)
+            if cut >= size:
+                break
+            if cut > cuts[-1]:
+                cuts.append(cut)
+
+    cuts.append(size)
+    return [ (cuts[i], cuts[i + 1]) for i in range(len(cuts) - 1) ]
+
+
+def split(path, output_paths, format):
+    """
+    Splits a file into one chunk per output path.  If there are fewer records than
+    chunks, the extra outputs are left empty.
+    """
+    ranges = split_offsets(path, len(output_paths), format)
+
+    output_dir = os.path.dirname(output_paths[0])
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    with open(path, 'rb') as source:
+        for i, output_path in enumerate(output_paths):
+            with open(output_path, 'wb') as out:
+                if i >= len(ranges):
+                    continue
+
+                start, end = ranges[i]
+                source.seek(start)
+                remaining = end - start
+
+                while remaining > 0:
+                    data = source.read(min(COPY_SIZE, remaining))
+                    if len(data) == 0:
+                        break
+                    out.write(data)
+                    remaining -= len(data)
+
+
+def _prefix_ids(line, prefix):
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) != 9:
+        return line
+
+    def prefixed(m):
+        values = [prefix + v for v in m.group(3).split(',')]
+        return "{0}{1}={2}".format(m.group(1), m.group(2), ",".join(values))
+
+    fields[8] = GFF3_ID_RE.sub(prefixed, fields[8])
+    return "\t".join(fields) + "\n"
+
+
+def _header_length(lines, mode):
+    if mode == 'delta':
+        return min(2, len(lines))
+
+    ## show-coords headers end with a line of '=' unless it was run with -H
+    for i, line in enumerate(lines[:6]):
+        if line.startswith('='):
+            return i + 1
+
+    return 0
+
+
+def gather(output_path, chunk_paths, mode):
+    with open(output_path, 'w' if mode != 'concat' else 'wb') as out:
+        for i, chunk_path in enumerate(chunk_paths):
+            if not os.path.exists(chunk_path):
+                continue
+
+            if mode == 'concat':
+                with open(chunk_path, 'rb') as fh:
+                    shutil.copyfileobj(fh, out, COPY_SIZE)
+
+            elif mode == 'gff3':
+                prefix = "chunk{0}_".format(i + 1)
+                with open(chunk_path) as fh:
+                    for line in fh:
+                        if line.startswith('##gff-version'):
+                            if i == 0:
+                                out.write(line)
+                        elif line.startswith('#') or line.strip() == '':
+                            out.write(line)
+                        else:
+                            out.write(_prefix_ids(line, prefix))
+
+            elif mode in ('coords', 'delta'):
+                with open(chunk_path) as fh:
+                    head = [fh.readline() for n in range(6)]
+                    head = [l for l in head if l != '']
+                    skip = 0 if i == 0 else _header_length(head, mode)
+
+                    out.writelines(head[skip:])
+                    shutil.copyfileobj(fh, out, COPY_SIZE)
+
+            else:
+                raise Exception("ERROR: unknown gather mode '{0}'".format(mode))
+
+
+def main():
+    parser = argparse.ArgumentParser( description='Split sequence files into chunks or merge chunk outputs')
+    subparsers = parser.add_subparsers(dest='action')
+
+    split_parser = subparsers.add_parser('split')
+    split_parser.add_argument('--format', choices=('fasta', 'fastq'), required=True)
+    split_parser.add_argument('--chunks', type=int, required=True)
+    split_parser.add_argument('input')
+    split_parser.add_argument('output_template')
+
+    gather_parser = subparsers.add_parser('gather')
+    gather_parser.add_argument('--mode', choices=('concat', 'gff3', 'coords', 'delta'), default='concat')
+    gather_parser.add_argument('--chunks', type=int, required=True)
+    gather_parser.add_argument('output')
+    gather_parser.add_argument('chunk_template')
+
+    args = parser.parse_args()
+
+    if args.action == 'split':
+        split(args.input, [args.output_template.format(i) for i in range(args.chunks)], args.format)
+    elif args.action == 'gather':
+        gather(args.output, [args.chunk_template.format(i) for i in range(args.chunks)], args.mode)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Execution environments decide where and how a Command's exec string actually gets run.
+
+Following the design sketched in the flow.models docstring, a Command doesn't change
+class depending on where it runs.  Instead the Flow it belongs to names an environment
+(or inherits one from its parent flow, or finally FLOW_DEFAULT_ENVIRONMENT in settings)
+and the Command hands itself to that environment's submit() method.  That returns a
+handle with an 'id' and a 'wait()' method, the same as the Celery AsyncResult objects
+it's modeled on.
+
+  celery    Distributed over a Celery broker (see flow.celery)
+  local     A pool of worker processes on this machine.  No broker is needed, but the
+            process dispatching the flow has to stay alive until it finishes.
+"""
+
+import logging
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from flow.executor import run, execute, finish
+from flow.resources import SlotScheduler, choose_queue, get_requirements
+
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionEnvironment(object):
+    """
+    Base class for execution environments.  Subclasses need to implement submit()
+    """
+
+    def submit(self, command):
+        raise NotImplementedError()
+
+
+class CeleryExecutionEnvironment(ExecutionEnvironment):
+    """
+    If FLOW_CELERY_QUEUES is set each command is sent to the queue for the smallest class
+    of slot its CPUs and memory fit in (see flow.resources.choose_queue), otherwise to
+    Celery's default queue.
+    """
+
+    def submit(self, command):
+        queues = getattr(settings, 'FLOW_CELERY_QUEUES', None)
+
+        # http://docs.celeryproject.org/en/latest/userguide/calling.html#guide-calling
+        if not queues:
+            return run.delay( command )
+
+        cpus, memory = get_requirements(command)
+        return run.apply_async( args=[command], queue=choose_queue(queues, cpus, memory) )
+
+
+class LocalTask(object):
+    """
+    Handle for a command submitted to a LocalExecutionEnvironment
+    """
+
+    def __init__(self, command, cpus, memory):
+        self.id = str(uuid.uuid4())
+        self.command = command
+        self.cpus = cpus
+        self.memory = memory
+        self.returncode = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.returncode
+
+
+class LocalExecutionEnvironment(ExecutionEnvironment):
+    """
+    Runs commands in a pool of worker processes on this machine.
+
+    Besides the number of worker processes, the environment tracks CPU and memory (MB)
+    slots.  Each command occupies what it declares it needs while it runs (see
+    flow.resources) and commands which don't fit in what's currently free wait in line,
+    with smaller ones backfilled around them, until enough is released.
+
+    The worker processes only ever shell out to the exec string and report back its exit
+    code and output tails.  Live output can be read from the command's log files.
+    Recording the result and phoning home to the parent flow happen back in this process,
+    which keeps database connections out of the pool entirely.
+    """
+
+    def __init__(self, workers=None, cpus=None, memory=None):
+        if cpus is None:
+            cpus = multiprocessing.cpu_count()
+
+        if workers is None:
+            workers = cpus
+
+        self.workers = workers
+
+        ## memory of None means it isn't accounted for
+        self.slots = SlotScheduler(cpus=cpus, memory=memory, max_running=workers)
+
+        self._lock = threading.RLock()
+        self._pool = None
+
+    def submit(self, command):
+        cpus, memory = get_requirements(command)
+        task = LocalTask(command, cpus, memory)
+
+        with self._lock:
+            self.slots.add(task, cpus=cpus, memory=memory)
+            self._start_queued()
+
+        return task
+
+    def _start_queued(self):
+        for task in self.slots.schedule():
+            self._start(task)
+
+    def _start(self, task):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+        command = task.command
+        future = self._pool.submit( execute, command.exec_string, stdout_path=command.stdout_path, \
+                                    stderr_path=command.stderr_path, tail_size=settings.FLOW_LOG_TAIL_SIZE )
+        future.add_done_callback(lambda f: self._finished(task, f))
+
+    def _finished(self, task, future):
+        with self._lock:
+            self.slots.release(task)
+
+        try:
+            result = future.result()
+        except Exception as e:
+            result = { 'returncode': -1, 'stderr_tail': "{0}".format(e) }
+
+        task.returncode = result['returncode']
+
+        ## This can dispatch more commands through submit(), so the lock can't be held here.
+        #  Whatever happens, anyone waiting on the task has to be let go, and an error here
+        #  would otherwise vanish into the executor's callback thread.
+        try:
+            finish(task.command, result)
+        except Exception:
+            logger.exception("Recording the result of command {0} failed".format(task.command.id))
+        finally:
+            task._done.set()
+
+        with self._lock:
+            self._start_queued()
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+
+ENVIRONMENT_CLASSES = {
+    'celery': CeleryExecutionEnvironment,
+    'local': LocalExecutionEnvironment,
+}
+
+## name -> environment instance, one of each per process
+_environments = dict()
+
+
+def get_environment(name=None):
+    """
+    Returns the (shared) execution environment of the given name, or the default one
+    named in the FLOW_DEFAULT_ENVIRONMENT setting.
+    """
+    if name is None:
+        name = getattr(settings, 'FLOW_DEFAULT_ENVIRONMENT', 'celery')
+
+    if name not in _environments:
+        if name == 'local':
+            env = LocalExecutionEnvironment( workers=getattr(settings, 'FLOW_LOCAL_WORKERS', None), \
+                                             cpus=getattr(settings, 'FLOW_LOCAL_CPUS', None), \
+                                             memory=getattr(settings, 'FLOW_LOCAL_MEMORY', None) )
+        elif name in ENVIRONMENT_CLASSES:
+            env = ENVIRONMENT_CLASSES[name]()
+        else:
+            raise Exception("ERROR: unknown execution environment '{0}'".format(name))
+
+        _environments[name] = env
+
+    return _environments[name]
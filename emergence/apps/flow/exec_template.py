@@ -0,0 +1,98 @@
+"""
+Compiled command-line templates for CommandBlueprints.
+
+Rendering a Command's exec string means walking every parameter of its blueprint in
+position order and deciding whether (and how) to include each one.  The parameter
+definitions hardly ever change once a tool is loaded, so each blueprint's are compiled
+once into an ExecTemplate and cached per process.  Commands then render from a single
+dict of the values set on them.
+
+Cached templates are tagged with the blueprint's revision, which is bumped whenever one
+of its CommandBlueprintParams is saved or deleted (see flow.models), so a worker holding
+an out-of-date copy notices as soon as it loads the blueprint.
+"""
+
+
+def format_param_value(value, has_no_value=False, has_quoted_value=False):
+    """
+    Applies a parameter's quoting rules to a value, returning None for flags which take
+    no value.  By default double quotes are used unless the value contains any.
+    """
+    if has_no_value:
+        return None
+
+    if has_quoted_value:
+        if '"' in value:
+            return "'{0}'".format(value)
+        else:
+            return "\"{0}\"".format(value)
+
+    return "{0}".format(value)
+
+
+class ExecTemplate(object):
+    """
+    The exec_path of a CommandBlueprint and its parameters in position order, reduced to
+    plain tuples of just what's needed to render:
+
+        (param id, prefix, has_no_value, has_quoted_value, is_optional, default_value)
+    """
+    __slots__ = ('exec_path', 'params', 'revision')
+
+    def __init__(self, exec_path, params, revision=None):
+        self.exec_path = exec_path
+        self.revision = revision
+        self.params = tuple( (p.id, p.prefix or '', p.has_no_value, p.has_quoted_value, p.is_optional, \
+                              p.default_value) for p in params )
+
+    def render(self, values=None):
+        """
+        Builds the command string.  'values' maps CommandBlueprintParam ids to the values
+        set for them.  Parameters without a set value are included with their default
+        only if they're required.
+        """
+        if values is None:
+            values = dict()
+
+        parts = [self.exec_path]
+
+        for param_id, prefix, has_no_value, has_quoted_value, is_optional, default_value in self.params:
+            if param_id in values:
+                value = values[param_id]
+            elif not is_optional:
+                value = default_value
+            else:
+                continue
+
+            if has_no_value:
+                parts.append(prefix.rstrip())
+            else:
+                parts.append("{0}{1}".format(prefix, format_param_value(value, has_quoted_value=has_quoted_value)))
+
+        return " ".join(parts)
+
+
+## blueprint id -> ExecTemplate, for this process
+_cache = dict()
+
+
+def get_exec_template(blueprint, params=None):
+    """
+    Returns the compiled template for a CommandBlueprint, compiling it if the cached one
+    is missing or out of date.  If they've already been fetched, its CommandBlueprintParams
+    can be passed ordered by position to save the query.
+    """
+    template = _cache.get(blueprint.id)
+
+    if template is None or template.revision != blueprint.revision or template.exec_path != blueprint.exec_path:
+        if params is None:
+            params = blueprint.commandblueprintparam_set.all().order_by('position')
+
+        template = ExecTemplate(blueprint.exec_path, params, revision=blueprint.revision)
+        _cache[blueprint.id] = template
+
+    return template
+
+
+def invalidate(blueprint_id):
+    _cache.pop(blueprint_id, None)
@@ -7,38 +7,116 @@ change this in any way, you have to restart your Celery worker  - Jorvis
 
 import os
 import sys
-import subprocess
+import time
+from datetime import datetime
 
 ## having this means the user doesn't have to modify their ENV
 self_dir = os.path.abspath(os.path.dirname(__file__))
 sys.path.append( os.path.join(self_dir, '../../../') )
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "emergence.settings.dev")
 
+from django.conf import settings
+from django.utils import timezone
+from celery.signals import worker_process_init
 from flow.celery import celery
+from flow import cache, registry
+from flow.capture import run_and_capture
 
 
-@celery.task
-def run( cmd, wait=None ):
-    print("Running: {0}".format(cmd.exec_string) )
+@worker_process_init.connect
+def _load_registry(**kwargs):
+    ## blueprints are read once as each worker process starts (see flow.registry)
+    registry.get_registry()
+
+
+def execute( exec_string, stdout_path=None, stderr_path=None, tail_size=None, progress=None ):
+    """
+    Runs a command string in a shell, streaming its output to the given log paths, and
+    returns a dict describing the result:
+
+        returncode     the command's exit code
+        stdout_tail    the last tail_size bytes of each stream, as text
+        stderr_tail
+        start_time     epoch seconds
+        end_time
+        wall_time      seconds
+        user_time      CPU seconds, from getrusage() of the command and everything it waited on
+        sys_time
+        max_rss        peak resident set size, in KB
+        bytes_read     storage I/O from /proc/<pid>/io, where available
+        bytes_written
+
+    This needs nothing from the database, so it's also what the local execution
+    environment's worker processes run.  See flow.capture for the 'progress' callback.
+    """
+    print("Running: {0}".format(exec_string) )
 
     ## LOTS more to do here.  Let's just get things running first
     #   http://sharats.me/the-ever-useful-and-neat-subprocess-module.html
     #   http://docs.python.org/3.3/library/subprocess.html
 
-    # subprocess waits for the call to end
     # TODO: need to set the cwd argument here
-    returncode = subprocess.call(cmd.exec_string, shell=True)
+    start_time = time.time()
+    proc, stdout_tail, stderr_tail, io_counters = run_and_capture( exec_string, stdout_path=stdout_path, \
+                                                                   stderr_path=stderr_path, tail_size=tail_size, \
+                                                                   progress=progress )
 
-    if returncode == 0:
-        cmd.state = 'c'
+    ## wait4() rather than proc.wait() gets the resource usage of this command alone,
+    #  which RUSAGE_CHILDREN would mix with anything else this worker has run
+    pid, status, usage = os.wait4(proc.pid, 0)
+    end_time = time.time()
+
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
     else:
-        cmd.state = 'f'
+        proc.returncode = os.WEXITSTATUS(status)
+
+    result = { 'returncode': proc.returncode, 'stdout_tail': stdout_tail, 'stderr_tail': stderr_tail, \
+               'start_time': start_time, 'end_time': end_time, 'wall_time': end_time - start_time, \
+               'user_time': usage.ru_utime, 'sys_time': usage.ru_stime, 'max_rss': usage.ru_maxrss }
+
+    if io_counters is not None:
+        result['bytes_read'], result['bytes_written'] = io_counters
+
+    return result
+
+
+def finish( cmd, result ):
+    """
+    Records the outcome of a command which has been executed, as returned by execute()
+    """
+    ## Only the columns we know about are written back (the command we were handed may
+    #  predate things like its task_id.)
+    values = { 'stdout_tail': result.get('stdout_tail', ''), 'stderr_tail': result.get('stderr_tail', '') }
+
+    for field in ('wall_time', 'user_time', 'sys_time', 'max_rss', 'bytes_read', 'bytes_written'):
+        if field in result:
+            values[field] = result[field]
+
+    for field in ('start_time', 'end_time'):
+        if field in result:
+            values[field] = datetime.fromtimestamp(result[field], timezone.utc)
+
+    type(cmd).objects.filter(id=cmd.id).update(**values)
+
+    ## This also phones home to the parent flow that the task is finished.  Successful
+    #  results are recorded first so the next identical command can reuse them.
+    if result['returncode'] == 0:
+        cache.store(cmd)
+        cmd.set_state('c')
+    else:
+        cmd.set_state('f')
+
+
+@celery.task
+def run( cmd, wait=None ):
+    ## keep the tails on the command current while it runs, for anyone watching
+    def progress( stdout_tail, stderr_tail ):
+        type(cmd).objects.filter(id=cmd.id).update(stdout_tail=stdout_tail, stderr_tail=stderr_tail)
 
-    cmd.save()
-        
-    ## phone home to the parent flow that the task is finished
-    if cmd.parent is not None:
-        cmd.parent.flow.check_child_states()
+    result = execute( cmd.exec_string, stdout_path=cmd.stdout_path, stderr_path=cmd.stderr_path, \
+                      tail_size=settings.FLOW_LOG_TAIL_SIZE, progress=progress )
+    finish(cmd, result)
 
 
 
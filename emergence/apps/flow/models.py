@@ -1,6 +1,21 @@
-from django.db import models
+import json
+import os
+from time import sleep
+from django.db import models, transaction
+from django.db.models import F, Max, Min, Sum
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.conf import settings
 from django.contrib.auth.models import User, Group
-from flow.executor import run
+from emergence.libs.bulk import reserve_ids, bulk_create_inherited
+from flow.environments import get_environment, ENVIRONMENT_CLASSES
+from flow.resources import get_requirements
+from flow import cache, registry
+from flow.capture import read_file_tail
+from flow.exec_template import format_param_value, get_exec_template, invalidate as invalidate_exec_template
+from flow.scheduler import DependencyGraph
+from flow.tree import TreeNodeMixin
+from flow.validation import check_dependencies, validate_flow
 #from celery.result import AsyncResult
 
 """
@@ -68,11 +83,25 @@ Major happy thoughts to FunkyBob on IRC:Freenode:django for the modeling help
 
 """
 
-class Step(models.Model):
+class Step(TreeNodeMixin, models.Model):
     parent      = models.ForeignKey('self', null=True, related_name='children')
+
+    ## The top-most Step of the tree this one belongs to (null for that Step itself.)  This
+    #  lets a whole tree be loaded at once - see flow.tree
+    root        = models.ForeignKey('self', null=True, related_name='descendants')
+
     name        = models.CharField( max_length=100 )
     start_time  = models.DateTimeField(null=True)
     end_time    = models.DateTimeField(null=True)
+
+    ## Resource usage, recorded by the executor for Commands and rolled up for Flows (see
+    #  Flow.record_usage.)  Times are in seconds, max_rss in KB and I/O in bytes.
+    wall_time     = models.FloatField(null=True)
+    user_time     = models.FloatField(null=True)
+    sys_time      = models.FloatField(null=True)
+    max_rss       = models.BigIntegerField(null=True)
+    bytes_read    = models.BigIntegerField(null=True)
+    bytes_written = models.BigIntegerField(null=True)
     #owner       = User()
 
 
@@ -88,9 +117,52 @@ class Step(models.Model):
 
     state = models.CharField( max_length=1, choices=STATES, default='u' )
 
+    ## Which of the parent Flow's child counters each state is tallied under
+    STATE_COUNTERS = {
+        'u': 'children_unrun',
+        'p': 'children_executing',
+        'r': 'children_executing',
+        'c': 'children_complete',
+        'e': 'children_failed',
+        'f': 'children_failed',
+        'k': 'children_killed',
+    }
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.set_root()
+        is_new = self.pk is None
+
+        super(Step, self).save(*args, **kwargs)
+
+        ## new children are tallied on their parent's counters straight away
+        if is_new and self.parent_id is not None:
+            counter = self.STATE_COUNTERS[self.state]
+            Flow.objects.filter(pk=self.parent_id).update(**{counter: F(counter) + 1})
+
+    def delete(self, *args, **kwargs):
+        if self.parent_id is not None:
+            counter = self.STATE_COUNTERS[self.state]
+            Flow.objects.filter(pk=self.parent_id).update(**{counter: F(counter) - 1})
+
+        super(Step, self).delete(*args, **kwargs)
+
+    def __reduce__(self):
+        ## The loaded tree (see flow.tree) is a snapshot belonging to this process.  Left in,
+        #  it would travel with every Command handed to Celery and the worker would roll up
+        #  states from it rather than the database.
+        reduced = super(Step, self).__reduce__()
+        state = dict(reduced[2])
+        state.pop('_tree', None)
+
+        return reduced[:2] + (state,) + reduced[3:]
+
+    @property
+    def tree_base_model(self):
+        return Step
+
     def has_executed(self):
         """
         This doesn't imply success or failure.  Rather, it returns True if an execution has been attempted
@@ -106,19 +178,99 @@ class Step(models.Model):
             return True
         else:
             return False
+
+    def set_state(self, new_state, from_state=None, report=None):
+        """
+        Moves the step to new_state, keeping the counters on its parent flow in step, and
+        returns True if a change was made.
+
+        The change is an UPDATE conditional on the state we believe the step to be in, so
+        nothing done concurrently by another worker gets lost.  If the row has moved on we
+        re-read it and go again.  If from_state is passed, though, the change is only made
+        from that state and False is returned if the step is in any other.
+
+        If the change moves the step to a different parent counter the parent is then asked
+        to re-evaluate its own state (unless report is False), which carries the change up
+        the tree with one UPDATE per level.
+        """
+        if report is None:
+            report = True
+
+        if from_state is None:
+            old_state = self.state
+        else:
+            old_state = from_state
+
+        while True:
+            if old_state == new_state:
+                self.state = new_state
+                return False
+
+            if Step.objects.filter(id=self.id, state=old_state).update(state=new_state):
+                break
+
+            if from_state is not None:
+                return False
+
+            old_state = Step.objects.filter(id=self.id).values_list('state', flat=True)[0]
+
+        self.state = new_state
+
+        old_counter = self.STATE_COUNTERS[old_state]
+        new_counter = self.STATE_COUNTERS[new_state]
+
+        if self.parent_id is not None and old_counter != new_counter:
+            Flow.objects.filter(pk=self.parent_id).update(**{old_counter: F(old_counter) - 1, \
+                                                             new_counter: F(new_counter) + 1})
+            if report is True:
+                self.get_parent_flow().check_child_states()
+
+        return True
+
+    def get_parent_flow(self):
+        """
+        Returns the parent Flow, from the loaded tree if there is one so that in-memory
+        changes are shared, else with a single query.
+        """
+        if self.parent_id is None:
+            return None
+
+        tree = getattr(self, '_tree', None)
+
+        if tree is not None:
+            return tree.parent_of(self.id)
+        else:
+            return Flow.objects.get(pk=self.parent_id)
+
+    def claim(self):
+        """
+        Atomically moves an unrun step into the pending state.  Returns False if some other
+        process (usually another worker phoning home to the same parent flow) got to it first,
+        which keeps parallel dispatch from starting the same child twice.
+        """
+        return self.set_state('p', from_state='u', report=False)
     
 
-class StepBlueprint(models.Model):
+class StepBlueprint(TreeNodeMixin, models.Model):
     """
     The Steps of a flow are first defined as StepBlueprints, then instantiated as actual Steps,
     which have many more attributes to track.
     """
     parent = models.ForeignKey('self', null=True, related_name='children')
+    root   = models.ForeignKey('self', null=True, related_name='descendants')
     name   = models.CharField( max_length=100 )
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.set_root()
+        super(StepBlueprint, self).save(*args, **kwargs)
+
+    @property
+    def tree_base_model(self):
+        return StepBlueprint
+
 
 class FlowBlueprint(StepBlueprint):
     """
@@ -134,49 +286,99 @@ class FlowBlueprint(StepBlueprint):
     TYPES = (
         ('s', 'serial'),
         ('p', 'parallel'),
+        ('d', 'dependency'),    # parallel, but each child waits on the siblings creating its inputs
     )
 
     type  = models.CharField( max_length=1, choices=TYPES, default='s' )
 
+    ## For parallel and dependency flows, the maximum number of children allowed to execute at
+    #  once.  Leave this empty to dispatch every child immediately.  Ignored for serial flows.
+    max_concurrency = models.PositiveIntegerField( null=True, blank=True )
 
-    def build(self):
-        flow = Flow( blueprint=self, name=self.name, parent=self.parent, type=self.type )
-        flow.save()
 
-        ## process all children
-        for child in self.get_children():
-            if isinstance(child, FlowBlueprint):
-                subflow = child.build()
-            elif isinstance(child, CommandBlueprint):
-                command = child.build(parent=flow)
-            else:
+    def build(self, parent=None):
+        """
+        Instantiates this blueprint and everything beneath it as a new Flow, nested under
+        the passed parent Flow if there is one.
+        """
+        return self.build_many(1, parent=parent)[0]
+
+    def build_many(self, count, parent=None):
+        """
+        Instantiates 'count' independent copies of this blueprint and everything beneath it,
+        returning the new top-level Flows in a list.  They're nested under the passed parent
+        Flow if there is one.
+
+        This takes a fixed number of queries however many copies or steps are involved.  The
+        blueprint tree is read once, the parameters of its commands come from the registry
+        (see flow.registry) and each table is written with bulk INSERTs (see
+        emergence.libs.bulk)
+        """
+        blueprints = [self] + list(self.get_tree().descendants_of(self.id))
+        child_counts = dict()
+
+        ## params come from the registry, so this doesn't query for them (see flow.registry)
+        params = dict()
+
+        for bp in blueprints:
+            if isinstance(bp, CommandBlueprint):
+                params[bp.id] = registry.get_blueprint(bp.id, revision=bp.revision).params
+            elif not isinstance(bp, FlowBlueprint):
                 raise Exception("ERROR: Encountered something other than a FlowBlueprint or CommandBlueprint when processing a FlowBlueprint's children")
 
-        return flow
+            if bp.parent_id is not None:
+                child_counts[bp.parent_id] = child_counts.get(bp.parent_id, 0) + 1
+
+        flows = list()
+        commands = list()
+        top_flows = list()
+
+        with transaction.atomic():
+            ids = iter(reserve_ids(Step, count * len(blueprints)))
+
+            for i in range(count):
+                ## blueprint id -> the step built from it for this copy
+                built = dict()
+
+                for bp in blueprints:
+                    if bp.id == self.id:
+                        step = Flow( id=next(ids), parent=parent, blueprint=bp, name=bp.name, type=bp.type, \
+                                     max_concurrency=bp.max_concurrency, children_unrun=child_counts.get(bp.id, 0) )
+                        step.set_root()
+                        top_flows.append(step)
+                    else:
+                        parent_step = built[bp.parent_id]
+
+                        if isinstance(bp, FlowBlueprint):
+                            step = Flow( id=next(ids), parent=parent_step, blueprint=bp, name=bp.name, type=bp.type, \
+                                         max_concurrency=bp.max_concurrency, children_unrun=child_counts.get(bp.id, 0) )
+                        else:
+                            step = Command( id=next(ids), parent=parent_step, blueprint=bp, name=bp.name, \
+                                            exec_string=bp.default_exec_string(params.get(bp.id, list())) )
+
+                        step.root_id = parent_step.root_id or parent_step.id
+
+                    if isinstance(step, Flow):
+                        flows.append(step)
+                    else:
+                        commands.append(step)
+
+                    built[bp.id] = step
+
+            bulk_create_inherited(flows)
+            bulk_create_inherited(commands)
+
+            ## these skipped save(), which would have tallied them on the parent
+            if parent is not None:
+                Flow.objects.filter(pk=parent.id).update(children_unrun=F('children_unrun') + count)
+
+        return top_flows
 
     def get_command(self, name):
         command = CommandBlueprint.objects.get(parent=self, name=name)
         return command
     
 
-    def get_children(self):
-        # Get a list of all the attrs relating to Child models.
-        child_attrs = dict(
-            (rel.var_name, rel.get_cache_name())
-            for rel in StepBlueprint._meta.get_all_related_objects()
-            if issubclass(rel.field.model, StepBlueprint) and isinstance(rel.field, models.OneToOneField)
-        )
-
-        objs = []
-        for obj in self.children.all().select_related(*child_attrs.keys()):
-            # Try to find any children...
-            for child in child_attrs.values():
-                sobj = obj.__dict__.get(child)
-                if sobj is not None:
-                    break
-            objs.append(sobj)
-        return objs      
-      
 
 class Flow(Step):
     blueprint = models.ForeignKey( FlowBlueprint )
@@ -192,112 +394,339 @@ class Flow(Step):
     TYPES = (
         ('s', 'serial'),
         ('p', 'parallel'),
+        ('d', 'dependency'),    # parallel, but each child waits on the siblings creating its inputs
     )
 
     type  = models.CharField( max_length=1, choices=TYPES, default='s' )
 
-    def check_child_states(self):
+    ## See FlowBlueprint.max_concurrency
+    max_concurrency = models.PositiveIntegerField( null=True, blank=True )
+
+    ## Running tallies of the states of this flow's children, kept up to date by
+    #  Step.save() and Step.set_state() so the flow's own state can be rolled up without
+    #  scanning them.  See Step.STATE_COUNTERS for which states count where.
+    children_unrun     = models.IntegerField( default=0 )
+    children_executing = models.IntegerField( default=0 )
+    children_complete  = models.IntegerField( default=0 )
+    children_failed    = models.IntegerField( default=0 )
+    children_killed    = models.IntegerField( default=0 )
+
+    ## Where this flow's commands are executed (see flow.environments.)  If empty, it's
+    #  inherited from the parent flow, or the FLOW_DEFAULT_ENVIRONMENT setting at the top.
+    ENVIRONMENTS = tuple( (name, name) for name in sorted(ENVIRONMENT_CLASSES.keys()) )
+    environment = models.CharField( max_length=20, choices=ENVIRONMENTS, null=True, blank=True )
+
+    CHILD_COUNTERS = ( 'children_unrun', 'children_executing', 'children_complete', \
+                       'children_failed', 'children_killed' )
+
+    def get_environment(self):
+        """
+        Returns the execution environment this flow's commands run in.
+        """
+        flow = self
+
+        while flow is not None:
+            if flow.environment:
+                return get_environment(flow.environment)
+
+            flow = flow.get_parent_flow()
+
+        return get_environment()
+
+    def load_child_counts(self):
+        """
+        Refreshes the child counters, and the flow's own state, from the database.
+        """
+        row = Flow.objects.filter(pk=self.id).values('state', *self.CHILD_COUNTERS)[0]
+
+        for attr, value in row.items():
+            setattr(self, attr, value)
+
+    def recount_children(self):
+        """
+        Rebuilds the child counters by scanning the children.  This is only needed after
+        their states have been changed in bulk, as run() does when resetting for a re-run.
+        """
+        counts = dict((counter, 0) for counter in self.CHILD_COUNTERS)
+
+        for child in self.get_children():
+            counts[self.STATE_COUNTERS[child.state]] += 1
+
+        Flow.objects.filter(pk=self.id).update(**counts)
+
+        for attr, value in counts.items():
+            setattr(self, attr, value)
+
+    def check_child_states(self, report=None):
         """
         This checks all the children of the flow and, depending on their state, sets the state
         of the flow itself.  If they're all complete, for example, the flow is marked as complete.
+        If the flow is running, any children which are now allowed to start are dispatched
+        first (see dispatch_children)
 
         Current rules:
         
         1.  If any child is 'running' or 'pending' the parent is running
         2.  If no children are being executed, and any children are in failed state, the parent has failed
         3.  If no children are being executed, and any children have been killed, the parent is killed
-        4.  If all children have completed, 
+        4.  If all children have completed, the parent is complete
+
+        Rules 2 and 3 only apply once nothing else can be started, which is when every child
+        has executed or the remaining ones are waiting on a child that didn't complete (the
+        next step of a serial flow, or a dependent in a dependency flow.)
+
+        The children themselves aren't read unless something may need dispatching; the
+        counters maintained by Step.set_state() are enough to decide the flow's state.  A
+        change of state is reported to the parent flow unless 'report' is False.
         """
-        child_count = 0
-        children_executing = 0
-        children_complete = 0
-        children_killed = 0
-        children_unrun = 0
-        children_failed = 0
+        self.load_child_counts()
+
+        if self.is_executing() and self.children_unrun > 0:
+            self.dispatch_children()
+
         new_state = None
-        
-        for child in self.get_children():
-            child_count += 1
-            
-            # any child in a running state means this remains in a running state
-            if child.is_executing():
-                children_executing += 1
-                break
-            elif child.state == 'c':
-                children_complete += 1
-            elif child.state == 'f':
-                children_failed += 1
-            elif child.state == 'k':
-                children_killed += 1
-            elif child.state == 'u':
-                children_unrun += 1
-    
-        if children_executing > 0:
+        child_count = 0
+        for counter in self.CHILD_COUNTERS:
+            child_count += getattr(self, counter)
+
+        if self.children_executing > 0:
             new_state = 'r'
-        elif child_count == children_complete:
+        elif child_count == self.children_complete:
             new_state = 'c'
-        else:
-            if children_unrun == 0:
-                if children_killed > 0:
-                    new_state = 'k'
-                if children_failed > 0:
-                    new_state = 'f'
+        elif self.children_unrun == 0 or self.is_executing():
+            if self.children_killed > 0:
+                new_state = 'k'
+            if self.children_failed > 0:
+                new_state = 'f'
             
-        ## only save a new state when we need to
+        ## Only save a new state when we need to.  Once finished, this reports to the parent,
+        #  which may be waiting on us to start its next child, so our usage is recorded first
+        #  for it to roll up in turn.
         if new_state is not None and new_state != self.state:
-            self.state = new_state
-            self.save()
-
-        ## if completed, report to parent
-        if new_state == 'c' and self.parent is not None:
-            self.parent.flow.child_child_states()
-
-    def get_children(self):
-        # Get a list of all the attrs relating to Child models.
-        # http://musings.tinbrain.net/blog/2013/jun/24/django-and-model-inheritance/
-        child_attrs = dict(
-            (rel.var_name, rel.get_cache_name())
-            for rel in Step._meta.get_all_related_objects()
-            if issubclass(rel.field.model, Step) and isinstance(rel.field, models.OneToOneField)
-        )
-
-        objs = []
-        for obj in self.children.all().select_related(*child_attrs.keys()):
-            # Try to find any children...
-            for child in child_attrs.values():
-                sobj = obj.__dict__.get(child)
-                if sobj is not None:
+            if new_state in ('c', 'e', 'f', 'k'):
+                self.record_usage()
+
+            self.set_state(new_state, report=report)
+
+    def record_usage(self):
+        """
+        Rolls the resource usage of this flow's children up onto the flow itself.  CPU time
+        and I/O are summed, max_rss is the peak of any one child, and the wall time spans
+        from the first child starting to the last one finishing.  Child flows have already
+        done the same by the time they finish, so this is one query per level.
+        """
+        usage = Step.objects.filter(parent=self).aggregate( Min('start_time'), Max('end_time'), Sum('user_time'), \
+                                                            Sum('sys_time'), Max('max_rss'), Sum('bytes_read'), \
+                                                            Sum('bytes_written') )
+        self.start_time = usage['start_time__min']
+        self.end_time = usage['end_time__max']
+        self.user_time = usage['user_time__sum']
+        self.sys_time = usage['sys_time__sum']
+        self.max_rss = usage['max_rss__max']
+        self.bytes_read = usage['bytes_read__sum']
+        self.bytes_written = usage['bytes_written__sum']
+
+        if self.start_time is not None and self.end_time is not None:
+            self.wall_time = (self.end_time - self.start_time).total_seconds()
+        else:
+            self.wall_time = None
+
+        Step.objects.filter(id=self.id).update( start_time=self.start_time, end_time=self.end_time, \
+                                                wall_time=self.wall_time, user_time=self.user_time, \
+                                                sys_time=self.sys_time, max_rss=self.max_rss, \
+                                                bytes_read=self.bytes_read, bytes_written=self.bytes_written )
+
+    def dispatch_children(self):
+        """
+        Starts any unrun children which are allowed to execute right now, without waiting on
+        them, and returns the number started.  The child counters should be current when
+        this is called (see load_child_counts.)
+
+        Serial flows allow a single child at a time and stop dispatching as soon as one child
+        finishes in anything other than a complete state.  Parallel flows allow up to
+        max_concurrency children at once, or all of them if that isn't set.  Dependency flows
+        are the same as parallel ones except that a child is only started once the siblings
+        creating its input files have completed (see flow.scheduler)
+
+        Children which finish as they're started (a Command restored from the result cache,
+        or a flow of them) don't report back to us, which would nest a call per child.  We
+        go round again instead, until nothing more can be started.
+        """
+        started = 0
+
+        while True:
+            if self.type == 's':
+                if self.children_failed > 0 or self.children_killed > 0:
                     break
-            objs.append(sobj)
-        return objs
+
+                limit = 1
+            else:
+                limit = self.max_concurrency
+
+            children = self.get_children()
+
+            ## the tree may have been loaded before siblings finished in other processes
+            states = dict( Step.objects.filter(parent=self).values_list('id', 'state') )
+            for child in children:
+                child.state = states.get(child.id, child.state)
+
+            if self.type == 'd':
+                graph = DependencyGraph(children)
+
+                ## caught by run() unless we were started some other way
+                if graph.error is not None:
+                    self.set_state('e')
+                    break
+
+                candidates = graph.ready()
+            else:
+                candidates = children
+
+            finished = 0
+            for child in candidates:
+                if limit is not None and self.children_executing >= limit:
+                    break
+
+                # sanity check, for now
+                if not isinstance(child, Flow) and not isinstance(child, Command):
+                    raise Exception("ERROR: Encountered something other than a Flow or Command when processing a Flow's children")
+
+                if child.state != 'u':
+                    continue
+
+                if child.claim():
+                    ## the flow being run reset and validated everything beneath it already
+                    if isinstance(child, Flow):
+                        child.start(report=False)
+                    else:
+                        child.run(wait=False, report=False)
+                    started += 1
+
+                    if child.has_executed():
+                        finished += 1
+
+                    ## a child can finish (and dispatch others through us) before run() returns
+                    self.load_child_counts()
+
+            if finished == 0 or self.children_unrun == 0:
+                break
+
+        return started
+
 
     def get_command(self, name):
         command = Command.objects.get(parent=self, name=name)
         return command
-    
-    def run(self, wait=None):
 
-        self.state = 'r'
-        self.save()
+    def set_params(self, params):
+        """
+        Sets params on the commands beneath this flow, from a dict of command name ->
+        {param name: value}.  See set_params_many()
+        """
+        Flow.set_params_many({self: params})
+
+    @classmethod
+    def set_params_many(cls, params_by_flow):
+        """
+        Sets params on the commands beneath any number of flows, such as the copies made by
+        FlowBlueprint.build_many(), from a dict of Flow -> {command name: {param name:
+        value}}.  Commands are found by name anywhere beneath each flow and the params set
+        with Command.set_params_many().  Finding the commands is one query for all the
+        flows, or two if some of them are nested in others.
+        """
+        root_ids = set( flow.root_id or flow.id for flow in params_by_flow )
+
+        ## flow id -> {command name: [Command, ...]} for every flow with commands beneath it
+        commands_below = dict()
+        parents = None
+
+        if any(flow.root_id is not None for flow in params_by_flow):
+            parents = dict( Flow.objects.filter(root__in=root_ids).values_list('id', 'parent') )
+
+        for command in Command.objects.filter(root__in=root_ids).order_by('id'):
+            flow_id = command.parent_id
+
+            while flow_id is not None:
+                commands_below.setdefault(flow_id, dict()).setdefault(command.name, list()).append(command)
+                flow_id = parents.get(flow_id) if parents is not None else None
 
+        params_by_command = dict()
+
+        for flow, params in params_by_flow.items():
+            commands = commands_below.get(flow.id, dict())
+
+            for command_name, command_params in params.items():
+                matches = commands.get(command_name, list())
+
+                if len(matches) != 1:
+                    raise Exception( "ERROR: flow {0} has {1} commands named '{2}'".format( \
+                                     flow.id, len(matches), command_name) )
+
+                params_by_command[matches[0]] = command_params
+
+        Command.set_params_many(params_by_command)
+    
+    def run(self, wait=None, validate=None):
+        """
+        Starts the flow.  Children are dispatched without blocking and each one phones home
+        through check_child_states() when it finishes, which releases the next ones.  If wait
+        is True (the default) this returns only once the flow has reached a terminal state.
+
+        Unless 'validate' is False (or the FLOW_VALIDATE setting is), every command beneath
+        the flow is checked first and those which can't run are put straight into the error
+        state (see flow.validation.)  Dependency flows whose children wait on each other's
+        files are always put in the error state, and if that's this flow it isn't started.
+        Returns a dict of Step id -> problems found.
+        """
         if wait is None:
             wait = True
 
-        for child in self.get_children():
-            # don't re-run anything that's already complete
-            if child.state == 'c':
-                continue
-            
-            # sanity check, for now
-            if not isinstance(child, Flow) and not isinstance(child, Command):
-                raise Exception("ERROR: Encountered something other than a Flow or Command when processing a Flow's children")
+        if validate is None:
+            validate = settings.FLOW_VALIDATE
 
-            if self.type == 's':
-                child.run(wait=True)
-            else:
-                # must be parallel
-                child.run(wait=False)
-                raise Exception("ERROR: parallel flows not currently handled")
+        ## don't re-run anything that's already complete, but give everything else another go,
+        #  all the way down so nested flows start from a clean slate too
+        flows = [self] + [s for s in self.refresh_tree().descendants_of(self.id) if isinstance(s, Flow)]
+        Step.objects.filter(parent__in=[f.id for f in flows], state__in=['e', 'f', 'k']).update(state='u')
+
+        tree = self.refresh_tree()
+        for flow in flows:
+            tree.get(flow.id).recount_children()
+
+        problems = check_dependencies(self)
+        if validate:
+            problems.update(validate_flow(self))
+
+        if self.state == 'e':
+            return problems
+
+        self.start()
+
+        if wait is True:
+            self.wait()
+
+        return problems
+
+    def start(self, report=None):
+        """
+        Marks the flow running and dispatches whichever children can start, without resetting
+        or checking anything first.  This is how run() starts a flow, and how a parent flow
+        starts a nested one.  If 'report' is False the parent isn't told if the flow finishes
+        straight away (see dispatch_children.)
+        """
+        self.set_state('r', report=report)
+        self.check_child_states(report=report)
+
+    def wait(self, interval=None):
+        """
+        Blocks until the flow reaches a terminal state, polling every 'interval' seconds.
+        """
+        if interval is None:
+            interval = 1
+
+        while not self.has_executed():
+            sleep(interval)
+            self.state = Step.objects.get(id=self.id).state
 
               
 
@@ -305,21 +734,35 @@ class CommandBlueprint(StepBlueprint):
     ## The binary or script to execute only (no options/parameters)
     exec_path = models.TextField()
 
-    def build(self, parent):
-        #print("DEBUG: Building a Command with name={0} and parent={1}".format(self.name, self.parent))
-        command = Command(parent=parent, blueprint=self, name=self.name)
-        exec_string = self.exec_path
+    ## What the command needs to run, in CPUs and MB of memory, for scheduling.  These are
+    #  only used when none of the params are marked as describing them (see
+    #  CommandBlueprintParam.resource and flow.resources)
+    cpus = models.PositiveIntegerField( default=1 )
+    memory = models.PositiveIntegerField( default=0 )
 
-        for param in CommandBlueprintParam.objects.filter(command=self).order_by('position'):
-            ## TODO: deal with param.has_quoted_value
-            param_string = " {0}{1}".format(param.prefix, param.default_value)
-            exec_string += param_string
+    ## Bumped whenever one of this blueprint's params is saved or deleted, so processes
+    #  holding a compiled copy of it know to recompile (see flow.exec_template)
+    revision = models.PositiveIntegerField( default=0 )
 
-        command.exec_string = exec_string
+    def build(self, parent, params=None):
+        #print("DEBUG: Building a Command with name={0} and parent={1}".format(self.name, self.parent))
+        command = Command(parent=parent, blueprint=self, name=self.name)
+        command.exec_string = self.default_exec_string(params)
         command.save()
 
         return command
 
+    def default_exec_string(self, params=None):
+        """
+        Returns the command string as it would be run if no params were set, which is the
+        required ones with their default values.  If they've already been fetched, the
+        CommandBlueprintParams can be passed ordered by position.
+        """
+        if params is None:
+            params = registry.get_blueprint(self.id, revision=self.revision).params
+
+        return get_exec_template(self, params).render()
+
 
         
 class Command(Step):
@@ -331,33 +774,38 @@ class Command(Step):
     #  http://docs.celeryproject.org/en/latest/reference/celery.result.html#celery.result.AsyncResult
     #  The ID values look like: d09f8528-f471-4125-8b58-82fce932d59e
     task_id = models.CharField(max_length=50, null=True)
+
+    ## Where the command's output is logged, and the last FLOW_LOG_TAIL_SIZE bytes of each.
+    #  The tails are kept current while running under Celery, and set on completion.
+    stdout_path = models.TextField( null=True )
+    stderr_path = models.TextField( null=True )
+    stdout_tail = models.TextField( blank=True )
+    stderr_tail = models.TextField( blank=True )
+
+    ## Identifies the work this command does for the result cache (see flow.cache.)  Null
+    #  if the command couldn't be cached.
+    cache_key = models.CharField( max_length=64, null=True )
     
     def build_exec_string(self):
-        cmd = self.blueprint.exec_path
-        
-        for param_bp in CommandBlueprintParam.objects.filter(command=self.blueprint).order_by('position'):
-            ## as we iterate through each param of the blueprint, we see if the corresponding setting
-            #   has been made manually for the command, else only add it if it's required.
-            try:
-                ## has a command parameter been set for this blueprint param?
-                param = CommandParam.objects.get(command=self, blueprint=param_bp)
-                param_value = param_bp.build_param_value(value=param.value)
-                param_string = " {0}{1}".format(param.prefix, param_value)
-                cmd += param_string
-                
-            except CommandParam.DoesNotExist:
-                ## only add this one from the blueprint if it's a required one
-                if not param_bp.is_optional:
-                    param_value = param_bp.build_param_value()
-                    param_string = " {0}{1}".format(param_bp.prefix, param_value)
-                    cmd += param_string
-                
-            except CommandParam.MultipleObjectsReturned:
-                pass
-              
-        return cmd
+        """
+        Renders the command from the blueprint's compiled template (see flow.exec_template)
+        and the parameters set on this command, fetched in one query.  Blueprint params
+        which haven't been set are only included, with their default, if required.  The
+        blueprint comes from the registry (see flow.registry) rather than the database.
+        """
+        ## set_params() keeps one value per param, but older rows may repeat one: the latest wins
+        values = dict( CommandParam.objects.filter(command=self).order_by('id').values_list('blueprint_id', 'value') )
+
+        blueprint = registry.get_blueprint(self.blueprint_id)
+        return get_exec_template(blueprint, blueprint.params).render(values)
     
     
+    def get_requirements(self):
+        """
+        Returns a (cpus, memory in MB) tuple of what this command needs to run.
+        """
+        return get_requirements(self)
+
     def has_already_been_run(self):
         """ Defines how we determine whether a command has been run before."""
         if self.start_time is None:
@@ -365,21 +813,79 @@ class Command(Step):
         else:
             return True
     
-    def run(self, wait=None):
+    def get_log_paths(self):
+        """
+        Returns (stdout, stderr) paths for this command's logs, under FLOW_LOG_ROOT in a
+        directory named for the id of the top-level flow.
+        """
+        log_dir = os.path.join(settings.FLOW_LOG_ROOT, str(self.root_id or self.id))
+        base = os.path.join(log_dir, "{0}".format(self.id))
+
+        return (base + '.stdout', base + '.stderr')
+
+    def get_output_tail(self, stream=None):
+        """
+        Returns the end of the command's stdout (the default) or stderr.  While running
+        this is read from the end of the log file, so it's always current.
+        """
+        if stream is None:
+            stream = 'stdout'
+
+        path = getattr(self, stream + '_path')
+
+        if self.is_executing() and path is not None and os.path.exists(path):
+            return read_file_tail(path, settings.FLOW_LOG_TAIL_SIZE)
+        else:
+            return getattr(self, stream + '_tail')
+
+    def run(self, wait=None, use_cache=None, report=None):
+        """
+        Renders the command and hands it to the execution environment, or restores its
+        outputs from the result cache (see flow.cache) and completes it right away.  In the
+        latter case the parent flow is told, unless 'report' is False.
+        """
         self.exec_string = self.build_exec_string()
-        self.state = 'r'
+        self.stdout_path, self.stderr_path = self.get_log_paths()
+        self.stdout_tail = ''
+        self.stderr_tail = ''
 
         if wait is None:
             # this is a safer default
             wait = True
 
-        ## TODO: this needs to be abstracted out to execution environments.  Testing like
-        #   this for now.
-        # http://docs.celeryproject.org/en/latest/userguide/calling.html#guide-calling
-        # generate task id myself? request_id=str(uuid.uuid4()).replace('-','')
-        task = run.delay( self )
+        if use_cache is None:
+            use_cache = settings.FLOW_RESULT_CACHE
+
+        if use_cache:
+            self.cache_key, self.cache_outputs = cache.get_cache_key(self)
+        else:
+            self.cache_key = None
+
+        ## Save before dispatching.  A fast command can finish (and have its state set by the
+        #  worker) before delay() even returns, so only the task_id is written afterwards.
+        self.save(update_fields=['exec_string', 'stdout_path', 'stderr_path', 'stdout_tail', 'stderr_tail', \
+                                 'cache_key'])
+
+        ## identical work has been done before, so its outputs are linked into place instead
+        cached = cache.restore(self)
+        if cached is not None:
+            self.stdout_tail = cached.command.stdout_tail
+            self.stderr_tail = cached.command.stderr_tail
+            Command.objects.filter(id=self.id).update(stdout_tail=self.stdout_tail, stderr_tail=self.stderr_tail)
+            self.set_state('c', report=report)
+            return
+
+        self.set_state('r')
+
+        ## the environment comes from the flow we're in, see flow.environments
+        if self.parent_id is not None:
+            environment = self.get_parent_flow().get_environment()
+        else:
+            environment = get_environment()
+
+        task = environment.submit( self )
         self.task_id = task.id
-        self.save()
+        Command.objects.filter(id=self.id).update(task_id=task.id)
 
         if wait is True:
             task.wait()
@@ -391,10 +897,58 @@ class Command(Step):
         
             
     def set_param(self, name, val):
-        ## get the blueprint for the passed param name
-        bp = CommandBlueprintParam.objects.get(command=self.blueprint, name=name)
-        param = CommandParam(command=self, blueprint=bp, name=name, prefix=bp.prefix, value=val)
-        param.save()
+        self.set_params({name: val})
+
+    def set_params(self, params):
+        """
+        Sets several params at once from a dict of param name -> value, replacing any value
+        one already had.  See set_params_many()
+        """
+        Command.set_params_many({self: params})
+
+    @classmethod
+    def set_params_many(cls, params_by_command):
+        """
+        Sets params on any number of commands at once, from a dict of Command -> {param
+        name: value}.  Every name is checked against its command's blueprint (from the
+        registry, see flow.registry) before anything is written.  Values already set for
+        the same params are replaced, so a param only ever has one value.
+
+        This is a DELETE for each distinct set of param names and one bulk INSERT, however
+        many commands there are.
+        """
+        rows = list()
+        unknown = list()
+
+        ## frozenset of blueprint param ids -> ids of the commands setting exactly those
+        replacing = dict()
+
+        for command, params in params_by_command.items():
+            blueprint = registry.get_blueprint(command.blueprint_id)
+            param_ids = set()
+
+            for name, value in params.items():
+                bp = blueprint.params_by_name.get(name)
+
+                if bp is None:
+                    unknown.append("'{0}' ({1})".format(name, blueprint.name))
+                    continue
+
+                param_ids.add(bp.id)
+                rows.append( CommandParam(command_id=command.id, blueprint_id=bp.id, name=name, prefix=bp.prefix or '', \
+                                          value=value) )
+
+            if len(param_ids) > 0:
+                replacing.setdefault(frozenset(param_ids), list()).append(command.id)
+
+        if len(unknown) > 0:
+            raise Exception("ERROR: no such params: {0}".format(", ".join(sorted(set(unknown)))))
+
+        with transaction.atomic():
+            for param_ids, command_ids in replacing.items():
+                CommandParam.objects.filter(command__in=command_ids, blueprint__in=list(param_ids)).delete()
+
+            CommandParam.objects.bulk_create(rows)
     
        
 class CommandBlueprintParam(models.Model):
@@ -446,29 +1000,85 @@ class CommandBlueprintParam(models.Model):
     ## Specify any default value for an option here
     default_value = models.CharField( max_length=200, blank=True )
 
+    ## Set this if the value of the parameter says how many CPUs or how much memory the
+    #  command will use (like Trinity's --CPU or --JM) so the scheduler can account for it.
+    #  Memory values can be given with K, M, G or T suffixes and are otherwise taken as MB.
+    RESOURCES = (
+        ('cpu', 'CPUs'),
+        ('memory', 'memory'),
+    )
+    resource = models.CharField( max_length=10, choices=RESOURCES, null=True, blank=True )
+
     class Meta:
         unique_together = (('command', 'name'),)
 
 
     def build_param_value(self, value=None):
-        param_value = None
-        
         ## if a value wasn't passed, use the default one
         if value is None:
             value = self.default_value
         
-        if not self.has_no_value:
-            if self.has_quoted_value:
-                if '"' in value:
-                    param_value = "'{0}'".format(value)
-                else:
-                    param_value = "\"{0}\"".format(value)
-            else:
-                param_value = "{0}".format(value)
-        
-        return param_value
+        return format_param_value(value, has_no_value=self.has_no_value, has_quoted_value=self.has_quoted_value)
         
 
+@receiver(post_save, sender=CommandBlueprintParam)
+@receiver(post_delete, sender=CommandBlueprintParam)
+def _blueprint_params_changed(sender, instance, **kwargs):
+    CommandBlueprint.objects.filter(pk=instance.command_id).update(revision=F('revision') + 1)
+    invalidate_exec_template(instance.command_id)
+    registry.bump_version()
+
+
+@receiver(post_save, sender=CommandBlueprint)
+@receiver(post_delete, sender=CommandBlueprint)
+def _blueprint_changed(sender, instance, **kwargs):
+    invalidate_exec_template(instance.id)
+    registry.bump_version()
+
+
+class RegistryVersion(models.Model):
+    """
+    A single row counting changes to CommandBlueprints, their params and the
+    ToolFiletypeParams describing them, so processes know when their copy of them is out
+    of date.  See flow.registry
+    """
+    version = models.PositiveIntegerField( default=0 )
+
+
+class CachedResult(models.Model):
+    """
+    The outputs of a successfully completed Command, under the key identifying the work it
+    did.  Commands with the same key link these outputs rather than running.  See
+    flow.cache for how keys are built.
+    """
+    key = models.CharField( max_length=64, unique=True )
+    command = models.ForeignKey(Command)
+
+    ## JSON object of CommandBlueprintParam id -> [output path, stamp], where the stamp
+    #  identifies the output as it was written (see flow.cache.output_stamp)
+    outputs = models.TextField()
+
+    created = models.DateTimeField( auto_now_add=True )
+
+    def get_outputs(self):
+        """
+        Returns a dict of param id -> (path, stamp).  Results recorded before outputs were
+        stamped have a stamp of None.
+        """
+        outputs = dict()
+
+        for param_id, value in json.loads(self.outputs).items():
+            if isinstance(value, list):
+                outputs[param_id] = (value[0], value[1])
+            else:
+                outputs[param_id] = (value, None)
+
+        return outputs
+
+    def set_outputs(self, outputs, stamps):
+        self.outputs = json.dumps( dict((str(k), [v, stamps.get(k)]) for k, v in outputs.items()) )
+
+
 class CommandParam(models.Model):
     """
     These should be generated only by CommandBlueprint.build(), which reads a store
@@ -480,6 +1090,10 @@ class CommandParam(models.Model):
     name = models.CharField( max_length=200 )   ## this is redundant, but might be kept for ease of use
     prefix =  models.CharField( max_length=200 )
     value = models.CharField( max_length=200 )
+
+    ## a param has one value per command, see Command.set_params_many()
+    class Meta:
+        unique_together = (('command', 'blueprint'),)
     
 
 
@@ -0,0 +1,190 @@
+"""
+A process-wide registry of every CommandBlueprint, its params in position order and the
+ToolFiletypeParams describing them.
+
+Blueprints hardly change once tools are loaded, but building, setting params on and
+rendering Commands all need them.  Rather than query for them every time, the whole set is
+read once (a query per table) into plain immutable tuples:
+
+    BlueprintDef        id, name, exec_path, cpus, memory, revision, params, filetype_params
+    ParamDef            a CommandBlueprintParam: id, name, prefix, position, ...
+    FiletypeParamDef    a ToolFiletypeParam, with its ToolFiletype and tool flattened in
+
+ParamDef has the attribute names of CommandBlueprintParam, so either can be passed to
+flow.exec_template.
+
+The registry is tagged with a version counter kept in the database (RegistryVersion),
+which is bumped whenever a blueprint, param or ToolFiletypeParam is saved or deleted and
+by the tool loaders, which skip those signals.  Changes made in this process drop the
+registry straight away.  Those made elsewhere (like a tool being loaded while Celery
+workers are running) are noticed the next time the version is checked, at most
+FLOW_REGISTRY_TTL seconds later, or sooner if a blueprint is asked for with a newer
+revision than the registry has.  Between checks, lookups make no queries at all.
+"""
+
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from django.conf import settings
+from django.db.models import F, get_model
+
+
+class ParamDef(namedtuple('ParamDef', ['id', 'command_id', 'name', 'prefix', 'position', 'is_optional', \
+                                       'has_no_value', 'has_quoted_value', 'default_value', 'resource'])):
+    __slots__ = ()
+
+
+class FiletypeParamDef(namedtuple('FiletypeParamDef', ['id', 'toolfiletype_id', 'tool_id', 'tool_name', 'tool_version', \
+                                                       'filetype_id', 'io_type', 'required', 'param_id', 'value'])):
+    __slots__ = ()
+
+
+class BlueprintDef(namedtuple('BlueprintDef', ['id', 'name', 'exec_path', 'cpus', 'memory', 'revision', \
+                                               'params', 'params_by_name', 'filetype_params'])):
+    """
+    'params' is a tuple of ParamDefs in position order, 'params_by_name' a read-only
+    mapping of the same, and 'filetype_params' a tuple of FiletypeParamDefs.
+    """
+    __slots__ = ()
+
+    def get_param(self, name):
+        try:
+            return self.params_by_name[name]
+        except KeyError:
+            raise Exception("ERROR: command blueprint '{0}' has no param named '{1}'".format(self.name, name))
+
+
+class Registry(object):
+    __slots__ = ('blueprints', 'version', 'checked')
+
+    def __init__(self, blueprints, version):
+        self.blueprints = MappingProxyType(blueprints)
+        self.version = version
+        self.checked = time.time()
+
+
+_registry = None
+_lock = threading.Lock()
+
+
+def get_version():
+    """
+    Returns the current registry version from the database.
+    """
+    RegistryVersion = get_model('flow', 'RegistryVersion')
+    versions = list( RegistryVersion.objects.values_list('version', flat=True)[:1] )
+
+    return versions[0] if len(versions) > 0 else 0
+
+
+def bump_version():
+    """
+    Marks every process's registry as out of date.  This one's is dropped immediately.
+    """
+    global _registry
+
+    RegistryVersion = get_model('flow', 'RegistryVersion')
+
+    if RegistryVersion.objects.filter(id=1).update(version=F('version') + 1) == 0:
+        RegistryVersion(id=1, version=1).save()
+
+    with _lock:
+        _registry = None
+
+
+def load():
+    """
+    Reads every blueprint and returns a new Registry.
+    """
+    CommandBlueprint = get_model('flow', 'CommandBlueprint')
+    CommandBlueprintParam = get_model('flow', 'CommandBlueprintParam')
+    ToolFiletypeParam = get_model('biotools', 'ToolFiletypeParam')
+
+    ## read first, so a change made while loading leaves us behind rather than wrongly current
+    version = get_version()
+
+    params = dict()
+    for row in CommandBlueprintParam.objects.order_by('command', 'position', 'id') \
+                                            .values_list( 'id', 'command', 'name', 'prefix', 'position', 'is_optional', \
+                                                          'has_no_value', 'has_quoted_value', 'default_value', 'resource' ):
+        params.setdefault(row[1], list()).append(ParamDef(*row))
+
+    filetype_params = dict()
+    if ToolFiletypeParam is not None:
+        for row in ToolFiletypeParam.objects.order_by('id') \
+                                    .values_list( 'id', 'toolfiletype', 'toolfiletype__tool', 'toolfiletype__tool__name', \
+                                                  'toolfiletype__tool__version', 'toolfiletype__filetype', \
+                                                  'toolfiletype__io_type', 'toolfiletype__required', \
+                                                  'commandblueprintparam', 'value', 'command_bp' ):
+            filetype_params.setdefault(row[-1], list()).append(FiletypeParamDef(*row[:-1]))
+
+    blueprints = dict()
+    for id, name, exec_path, cpus, memory, revision in \
+            CommandBlueprint.objects.values_list('id', 'name', 'exec_path', 'cpus', 'memory', 'revision'):
+        bp_params = tuple(params.get(id, list()))
+        blueprints[id] = BlueprintDef( id, name, exec_path, cpus, memory, revision, bp_params, \
+                                       MappingProxyType(dict((p.name, p) for p in bp_params)), \
+                                       tuple(filetype_params.get(id, list())) )
+
+    return Registry(blueprints, version)
+
+
+def get_registry():
+    """
+    Returns this process's Registry, loading it if there isn't one or it's out of date.
+    The version is checked at most every FLOW_REGISTRY_TTL seconds.
+    """
+    global _registry
+
+    with _lock:
+        registry = _registry
+
+    if registry is not None and time.time() - registry.checked < settings.FLOW_REGISTRY_TTL:
+        return registry
+
+    if registry is not None and get_version() == registry.version:
+        registry.checked = time.time()
+        return registry
+
+    registry = load()
+
+    with _lock:
+        _registry = registry
+
+    return registry
+
+
+def get_blueprint(blueprint_id, revision=None):
+    """
+    Returns the BlueprintDef for a CommandBlueprint id.  If the caller has the blueprint's
+    'revision' from the database and the registry's copy is older, or the blueprint is
+    newer than the registry, it's reloaded first.
+    """
+    global _registry
+
+    blueprint = get_registry().blueprints.get(blueprint_id)
+
+    if blueprint is None or (revision is not None and blueprint.revision < revision):
+        registry = load()
+
+        with _lock:
+            _registry = registry
+
+        blueprint = registry.blueprints.get(blueprint_id)
+
+        if blueprint is None:
+            raise Exception("ERROR: no command blueprint with id {0}".format(blueprint_id))
+
+    return blueprint
+
+
+def invalidate():
+    """
+    Drops this process's registry without telling any others, so the next lookup reloads.
+    """
+    global _registry
+
+    with _lock:
+        _registry = None
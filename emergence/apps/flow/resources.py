@@ -0,0 +1,210 @@
+"""
+CPU and memory requirements of Commands, and a scheduler which packs them into slots.
+
+Tools declare how many CPUs and how much memory they'll use through their parameters
+(Trinity's --CPU, --JM and --bflyHeapSpaceMax, for example.)  Loaders mark those
+CommandBlueprintParams with a 'resource' of 'cpu' or 'memory', and a Command's needs are
+read from the values set for them, falling back to the param's default, which is what
+the tool itself would use.  Blueprints with no such params use their own cpus and memory
+fields.
+
+The local environment packs commands into its own slots with SlotScheduler.  Celery
+workers can't see each other, so there commands are routed instead to a queue per class
+of slot (see choose_queue and the FLOW_CELERY_QUEUES setting), each served by workers
+started with a concurrency that leaves every task enough of the machine.
+
+Memory is always handled in MB.
+"""
+
+import re
+from collections import deque
+
+from django.db.models import get_model
+
+from flow import registry
+
+
+MEMORY_UNITS = { 'K': 1.0 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024 }
+
+
+def parse_memory(value):
+    """
+    Converts values like '10G', '512M' or '1.5g' to MB.  A bare number is taken to be MB
+    already.  Returns None for anything unparseable.
+    """
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGTkmgt])?[Bb]?\s*$', str(value))
+
+    if m is None:
+        return None
+
+    unit = (m.group(2) or 'M').upper()
+    return int(float(m.group(1)) * MEMORY_UNITS[unit])
+
+
+def parse_cpus(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_requirements(command):
+    """
+    Returns a (cpus, memory) tuple of what a Command needs to run.  If several params
+    describe memory (such as separate stages of a pipeline tool) the largest is used.
+    The blueprint comes from the registry (see flow.registry), so this is a query only
+    when it has params describing resources.
+    """
+    CommandParam = get_model('flow', 'CommandParam')
+
+    blueprint = registry.get_blueprint(command.blueprint_id)
+    cpus = None
+    memory = None
+
+    resource_params = [p for p in blueprint.params if p.resource is not None]
+
+    if len(resource_params) > 0:
+        values = dict( CommandParam.objects.filter(command=command, blueprint__in=[p.id for p in resource_params]) \
+                                           .order_by('id').values_list('blueprint_id', 'value') )
+
+        for param in resource_params:
+            value = values.get(param.id, param.default_value)
+
+            if param.resource == 'cpu':
+                parsed = parse_cpus(value)
+                if parsed is not None:
+                    cpus = max(cpus or 0, parsed)
+
+            elif param.resource == 'memory':
+                parsed = parse_memory(value)
+                if parsed is not None:
+                    memory = max(memory or 0, parsed)
+
+    if cpus is None:
+        cpus = blueprint.cpus
+
+    if memory is None:
+        memory = blueprint.memory
+
+    return (cpus, memory)
+
+
+def choose_queue(queues, cpus, memory):
+    """
+    Picks which of a list of (name, cpus, memory) slot classes a job should go to: the
+    first one big enough for it, so they should be listed smallest first.  A job bigger
+    than all of them goes to the last.  A memory of None means no limit.
+    """
+    for name, queue_cpus, queue_memory in queues:
+        if cpus <= queue_cpus and (queue_memory is None or memory <= queue_memory):
+            return name
+
+    return queues[-1][0]
+
+
+class SlotScheduler(object):
+    """
+    Decides which queued jobs can start on a machine with a fixed number of CPU and memory
+    slots (and optionally a cap on how many jobs run at once.)
+
+    Jobs are started in the order they were queued while they fit.  When the job at the
+    front doesn't fit, smaller jobs behind it which do are started around it (backfilled),
+    but only 'max_backfill' times.  After that nothing more is started until the front job
+    gets its slots, so big jobs can't be starved by a steady stream of small ones.
+
+    A job asking for more than the machine has in total is trimmed to the machine's size,
+    so it runs once it has the machine to itself rather than never.
+
+    Jobs can be any object; their needs are passed when they're added.  This class does no
+    locking of its own.
+    """
+
+    def __init__(self, cpus, memory=None, max_running=None, max_backfill=None):
+        if max_backfill is None:
+            max_backfill = 10
+
+        self.cpus = cpus
+        self.memory = memory
+        self.max_running = max_running
+        self.max_backfill = max_backfill
+
+        self.free_cpus = cpus
+        self.free_memory = memory
+        self.running = dict()
+
+        self._queue = deque()
+        self._front_skipped = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, job, cpus=None, memory=None):
+        if cpus is None:
+            cpus = 1
+
+        if memory is None or self.memory is None:
+            memory = 0
+
+        cpus = min(cpus, self.cpus)
+        if self.memory is not None:
+            memory = min(memory, self.memory)
+
+        self._queue.append( (job, cpus, memory) )
+
+    def _fits(self, cpus, memory):
+        if self.max_running is not None and len(self.running) >= self.max_running:
+            return False
+
+        if cpus > self.free_cpus:
+            return False
+
+        if self.memory is not None and memory > self.free_memory:
+            return False
+
+        return True
+
+    def _take(self, entry):
+        job, cpus, memory = entry
+        self.running[id(job)] = entry
+        self.free_cpus -= cpus
+
+        if self.memory is not None:
+            self.free_memory -= memory
+
+        return job
+
+    def schedule(self):
+        """
+        Claims slots for every job which can start now and returns them in a list.
+        """
+        started = list()
+
+        ## in order, while things fit
+        while len(self._queue) > 0 and self._fits(*self._queue[0][1:]):
+            started.append(self._take(self._queue.popleft()))
+            self._front_skipped = 0
+
+        if len(self._queue) == 0 or self._front_skipped >= self.max_backfill:
+            return started
+
+        ## then backfill around the front job
+        for entry in list(self._queue)[1:]:
+            if self._front_skipped >= self.max_backfill:
+                break
+
+            if self._fits(*entry[1:]):
+                self._queue.remove(entry)
+                started.append(self._take(entry))
+                self._front_skipped += 1
+
+        return started
+
+    def release(self, job):
+        """
+        Returns a finished job's slots.  Call schedule() afterwards to start what now fits.
+        """
+        job, cpus, memory = self.running.pop(id(job))
+        self.free_cpus += cpus
+
+        if self.memory is not None:
+            self.free_memory += memory
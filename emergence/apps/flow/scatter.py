@@ -0,0 +1,237 @@
+"""
+Scatter/gather flows: run one CommandBlueprint over chunks of a large sequence file in
+parallel, then merge the results.
+
+Tools like Prodigal, Bowtie and nucmer treat each query sequence independently, so
+splitting the query file N ways and running N copies of the command gives the same
+answer in a fraction of the time.  build_scatter_flow() creates this structure:
+
+    serial flow
+        split        chunks.py split - the input into N record-balanced chunks
+        parallel flow
+            command  one per chunk, with the input and output params pointed at chunk files
+            ...
+        gather       chunks.py gather - one per output param, merged into the path the
+        ...                             caller asked for
+
+How each output is merged depends on its Filetype, as declared through the tool's
+ToolFiletypeParams: GFF3 has its IDs renumbered per chunk, delta files keep one header,
+and everything else (FASTA included) is concatenated.  See flow.chunks for the details.
+
+The split and gather steps are ordinary Commands, built from helper CommandBlueprints
+created the first time they're needed.  They have no tool definition, so the chunk files
+the split step writes are described to flow.validation by get_helper_outputs().
+"""
+
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import get_model
+
+from flow import registry
+from flow.chunks import guess_format
+from flow.models import Command, CommandBlueprint, CommandBlueprintParam, Flow, FlowBlueprint
+
+
+CHUNKS_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chunks.py')
+
+## Filetype format -> chunks.py gather mode.  Anything else is concatenated.
+GATHER_MODES = {
+    'GFF3': 'gff3',
+    'Mummer delta': 'delta',
+}
+
+
+def _helper_exec_path(action):
+    return "python3 {0} {1}".format(CHUNKS_SCRIPT, action)
+
+
+def _get_command_helper(name, action, params):
+    """
+    Returns the CommandBlueprint for a chunks.py action, creating it (and its params,
+    given as (name, prefix) pairs in order) the first time.
+    """
+    exec_path = _helper_exec_path(action)
+    helper = CommandBlueprint.objects.filter(parent__isnull=True, name=name, exec_path=exec_path).first()
+
+    if helper is None:
+        with transaction.atomic():
+            helper = CommandBlueprint(name=name, exec_path=exec_path)
+            helper.save()
+
+            for position, (param_name, prefix) in enumerate(params):
+                CommandBlueprintParam( command=helper, name=param_name, prefix=prefix, position=position + 1, \
+                                       is_optional=False, short_desc=param_name ).save()
+
+    return helper
+
+
+def _get_flow_helper(name, type):
+    helper = FlowBlueprint.objects.filter(parent__isnull=True, name=name, type=type).first()
+
+    if helper is None:
+        helper = FlowBlueprint(name=name, type=type, description="Built by flow.scatter")
+        helper.save()
+
+    return helper
+
+
+def _chunk_template(work_dir, prefix, path):
+    """
+    Returns a template for chunk file paths, with '{0}' where the chunk number goes (as
+    chunks.py expects) and the name of 'path' after it.  Braces anywhere else are escaped,
+    so directory and file names containing them come through as they are.
+    """
+    def escape(text):
+        return text.replace('{', '{{').replace('}', '}}')
+
+    return escape(os.path.join(work_dir, prefix)) + "{0}." + escape(os.path.basename(path))
+
+
+def get_helper_outputs(exec_path, values):
+    """
+    Returns the paths a split helper command writes, given its blueprint's exec path and
+    a dict of its param values by name, or an empty list for any other command.  The
+    helpers have no tool definition, so flow.validation asks here instead.
+    """
+    if exec_path != _helper_exec_path('split'):
+        return list()
+
+    try:
+        chunks = int(values.get('--chunks'))
+    except (TypeError, ValueError):
+        return list()
+
+    template = values.get('<output_template>')
+    if not template:
+        return list()
+
+    return [template.format(i) for i in range(chunks)]
+
+
+def get_output_modes(command_bp, params):
+    """
+    Returns a dict of output param name -> gather mode for the output params set in
+    'params', using the Filetype each one produces given the other values set.
+    """
+    ToolFiletypeParam = get_model('biotools', 'ToolFiletypeParam')
+
+    by_toolfiletype = dict()
+    for tftp in ToolFiletypeParam.objects.filter(command_bp=command_bp, toolfiletype__io_type='o') \
+                                         .select_related('toolfiletype__filetype', 'commandblueprintparam'):
+        by_toolfiletype.setdefault(tftp.toolfiletype_id, list()).append(tftp)
+
+    modes = dict()
+
+    for tftps in by_toolfiletype.values():
+        path_params = [t.commandblueprintparam for t in tftps if t.value is None]
+        conditions = [t for t in tftps if t.value is not None]
+
+        ## prodigal's -o is GFF3 only when -f=gff, for example
+        if not all(params.get(t.commandblueprintparam.name, t.commandblueprintparam.default_value) == t.value \
+                   for t in conditions):
+            continue
+
+        mode = GATHER_MODES.get(tftps[0].toolfiletype.filetype.format, 'concat')
+        for param in path_params:
+            if param.name in params:
+                modes.setdefault(param.name, mode)
+
+    return modes
+
+
+def build_scatter_flow(command_bp, input_param, source, chunks, params=None, parent=None, gather=None, \
+                       work_dir=None, name=None):
+    """
+    Builds (but doesn't run) a scatter/gather flow running 'command_bp' over 'chunks'
+    pieces of 'source', a LocalFile or a path to an uncompressed FASTA or FASTQ file,
+    which each chunk's command gets through the param named 'input_param'.
+
+    'params' are set on every chunk's command.  Those naming output files (according to
+    the tool's ToolFiletypeParams) are pointed at per-chunk files instead, which are
+    merged into the requested paths at the end.  'gather' can map param names to a
+    chunks.py gather mode to override the one chosen from the filetype, and also to
+    gather outputs the tool definition doesn't describe.
+
+    Chunk files go in 'work_dir', by default a directory for the flow under
+    FLOW_SCRATCH_ROOT.  Returns the top-level Flow.
+    """
+    if params is None:
+        params = dict()
+
+    if hasattr(source, 'get_filesystem_path'):
+        input_path = source.get_filesystem_path()
+    else:
+        input_path = source
+
+    format = guess_format(input_path)
+
+    output_modes = get_output_modes(command_bp, params)
+    if gather is not None:
+        output_modes.update(gather)
+
+    split_bp = _get_command_helper( 'Split input into chunks', 'split', \
+                                    [('--format', '--format '), ('--chunks', '--chunks '), ('<input>', None), \
+                                     ('<output_template>', None)] )
+    gather_bp = _get_command_helper( 'Gather chunk outputs', 'gather', \
+                                     [('--mode', '--mode '), ('--chunks', '--chunks '), ('<output>', None), \
+                                      ('<chunk_template>', None)] )
+
+    with transaction.atomic():
+        flow = Flow( parent=parent, blueprint=_get_flow_helper('Scatter/gather', 's'), type='s', \
+                     name=name or "{0} (scatter/gather x{1})".format(command_bp.name, chunks) )
+        flow.save()
+
+        if work_dir is None:
+            work_dir = os.path.join(settings.FLOW_SCRATCH_ROOT, str(flow.id))
+
+        input_template = _chunk_template(work_dir, "chunk_", input_path)
+
+        ## params for every command are set together at the end
+        params_by_command = dict()
+
+        split = split_bp.build(parent=flow)
+        params_by_command[split] = { '--format': format, '--chunks': str(chunks), '<input>': input_path, \
+                                     '<output_template>': input_template }
+
+        chunk_flow = Flow( parent=flow, blueprint=_get_flow_helper('Scatter chunks', 'p'), type='p', \
+                           name="{0} chunks".format(command_bp.name) )
+        chunk_flow.save()
+
+        ## where each gathered output ends up, which is its blueprint default if not passed
+        output_paths = dict()
+        output_templates = dict()
+        bp_params = registry.get_blueprint(command_bp.id).params_by_name
+
+        for n, param_name in enumerate(sorted(output_modes)):
+            output_paths[param_name] = params.get(param_name)
+            if not output_paths[param_name] and param_name in bp_params:
+                output_paths[param_name] = bp_params[param_name].default_value
+
+            if not output_paths[param_name]:
+                raise Exception("ERROR: no path was given for output param '{0}'".format(param_name))
+
+            output_templates[param_name] = _chunk_template( work_dir, "out{0}_chunk_".format(n + 1), \
+                                                            output_paths[param_name] )
+
+        for i in range(chunks):
+            command = command_bp.build(parent=chunk_flow)
+            command.name = "{0} (chunk {1})".format(command_bp.name, i + 1)
+            Command.objects.filter(id=command.id).update(name=command.name)
+
+            chunk_params = dict(params)
+            for param_name, template in output_templates.items():
+                chunk_params[param_name] = template.format(i)
+
+            chunk_params[input_param] = input_template.format(i)
+            params_by_command[command] = chunk_params
+
+        for param_name, mode in sorted(output_modes.items()):
+            merge = gather_bp.build(parent=flow)
+            params_by_command[merge] = { '--mode': mode, '--chunks': str(chunks), '<output>': output_paths[param_name], \
+                                         '<chunk_template>': output_templates[param_name] }
+
+        Command.set_params_many(params_by_command)
+
+    return flow
@@ -0,0 +1,200 @@
+"""
+Dependency-aware scheduling for the children of a Flow.
+
+Tools describe which of their parameters read and write files through the biotools
+ToolFiletypeParam objects (created by Tool.needs(), creates(), etc.)  Given the values
+actually set on each Command, that tells us which paths each one reads and writes, and
+so which Commands have to wait on which others.  A child whose inputs aren't written by
+any of its siblings is ready right away; everything else is released as soon as all
+the siblings producing its inputs have completed.
+
+What each tool reads and writes comes from the blueprint registry (see flow.registry)
+rather than the database.
+"""
+
+from django.db.models import get_model
+
+from flow import registry
+
+
+def get_io_paths(commands, values=None):
+    """
+    Returns a dict keyed by Command id whose values are (inputs, outputs) tuples, each a
+    set of the file paths that command reads or writes according to its tool definition.
+
+    A ToolFiletypeParam with a value is a condition rather than a path (prodigal's -f=gff,
+    for example) and the filetype is only considered in play when the command's value for
+    that param matches.  Those without a value name the param holding the path itself.
+
+    This costs one query no matter how many commands are passed, or none if the values
+    set on them are passed as well, as a dict of Command id -> {blueprint param id: value}
+    """
+    CommandParam = get_model('flow', 'CommandParam')
+
+    io_paths = dict()
+    if len(commands) == 0:
+        return io_paths
+
+    ## values explicitly set on each command, keyed by blueprint param id
+    if values is None:
+        values = dict()
+        for command_id, param_id, value in CommandParam.objects.filter(command__in=[c.id for c in commands]) \
+                                                               .order_by('id') \
+                                                               .values_list('command', 'blueprint', 'value'):
+            values.setdefault(command_id, dict())[param_id] = value
+
+    ## blueprint id -> ({toolfiletype id: [FiletypeParamDef, ...]}, {param id: default value})
+    blueprints = dict()
+
+    for command in commands:
+        if command.blueprint_id not in blueprints:
+            blueprint = registry.get_blueprint(command.blueprint_id)
+            tft_params = dict()
+
+            for tftp in blueprint.filetype_params:
+                tft_params.setdefault(tftp.toolfiletype_id, list()).append(tftp)
+
+            blueprints[command.blueprint_id] = ( tft_params, dict((p.id, p.default_value) for p in blueprint.params) )
+
+        tft_params, defaults = blueprints[command.blueprint_id]
+        inputs = set()
+        outputs = set()
+        command_values = values.get(command.id, dict())
+
+        for tftps in tft_params.values():
+            paths = list()
+            conditions_met = True
+
+            for tftp in tftps:
+                value = command_values.get(tftp.param_id, defaults.get(tftp.param_id))
+
+                if tftp.value is None:
+                    if value:
+                        paths.append(value)
+                elif value != tftp.value:
+                    conditions_met = False
+
+            if conditions_met:
+                if tftps[0].io_type == 'i':
+                    inputs.update(paths)
+                else:
+                    outputs.update(paths)
+
+        io_paths[command.id] = (inputs, outputs)
+
+    return io_paths
+
+
+def _path_produced_by(path, outputs):
+    """
+    True if the path is one of the outputs or lives underneath one of them.  Some tools
+    (Trinity, for example) are only told an output directory.
+    """
+    for output in outputs:
+        if path == output or path.startswith(output.rstrip('/') + '/'):
+            return True
+
+    return False
+
+
+class DependencyGraph(object):
+    """
+    Dependencies between the children of a single flow.  Subflows are treated as one unit
+    whose inputs and outputs are those of all the commands beneath them, less anything
+    they produce for themselves.
+
+    Usage:
+
+        graph = DependencyGraph(flow.get_children())
+        for child in graph.ready():
+            ...
+    """
+
+    def __init__(self, children):
+        self.children = list(children)
+
+        ## child id -> list of commands it contains (itself, for a command)
+        members = dict()
+        for child in self.children:
+            members[child.id] = list(_commands_beneath(child))
+
+        io_paths = get_io_paths([c for commands in members.values() for c in commands])
+
+        self.inputs = dict()
+        self.outputs = dict()
+        for child in self.children:
+            inputs = set()
+            outputs = set()
+            for command in members[child.id]:
+                inputs.update(io_paths[command.id][0])
+                outputs.update(io_paths[command.id][1])
+
+            self.outputs[child.id] = outputs
+            self.inputs[child.id] = set([p for p in inputs if not _path_produced_by(p, outputs)])
+
+        ## child id -> set of sibling ids it waits on
+        self.depends_on = dict()
+        for child in self.children:
+            self.depends_on[child.id] = set()
+            for producer in self.children:
+                if producer.id == child.id:
+                    continue
+
+                for path in self.inputs[child.id]:
+                    if _path_produced_by(path, self.outputs[producer.id]):
+                        self.depends_on[child.id].add(producer.id)
+                        break
+
+        ## None, or why the children can never all be started
+        self.error = self._check_for_cycles()
+
+    def _check_for_cycles(self):
+        ## Kahn's algorithm - anything left over once nothing else can be removed is in a cycle
+        remaining = dict((k, set(v)) for k, v in self.depends_on.items())
+
+        while True:
+            free = [k for k, v in remaining.items() if len(v) == 0]
+            if len(free) == 0:
+                break
+
+            for k in free:
+                del remaining[k]
+            for v in remaining.values():
+                v.difference_update(free)
+
+        if len(remaining) > 0:
+            names = sorted([str(c) for c in self.children if c.id in remaining])
+            return "circular file dependencies between flow steps: {0}".format(", ".join(names))
+
+        return None
+
+    def ready(self):
+        """
+        Returns the unrun children, in order, whose producers have all completed.  Nothing
+        is ready if the dependencies are circular (see 'error'.)
+        """
+        if self.error is not None:
+            return list()
+
+        states = dict((c.id, c.state) for c in self.children)
+        ready = list()
+
+        for child in self.children:
+            if child.state != 'u':
+                continue
+
+            if all(states[p] == 'c' for p in self.depends_on[child.id]):
+                ready.append(child)
+
+        return ready
+
+
+def _commands_beneath(step):
+    Command = get_model('flow', 'Command')
+
+    if isinstance(step, Command):
+        yield step
+    else:
+        for child in step.get_children():
+            for command in _commands_beneath(child):
+                yield command
@@ -1,3 +1,561 @@
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import types
+from unittest import mock
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from biotools.models import Filetype, Tool
+from flow.cache import file_digest, link_output, restore, store
+from flow.capture import TailBuffer, run_and_capture
+from flow.chunks import gather, split
+from flow.exec_template import ExecTemplate
+from flow import registry
+from flow.models import Command, CommandBlueprint, CommandBlueprintParam, CommandParam, Flow, FlowBlueprint
+from flow.resources import SlotScheduler, choose_queue, parse_memory
+from flow.scatter import build_scatter_flow
+from flow.scheduler import DependencyGraph
+from flow.validation import validate_flow
+
+
+class CaptureTest(TestCase):
+    def test_tail_buffer_keeps_the_end(self):
+        tail = TailBuffer(8)
+        tail.write(b'abcd')
+        tail.write(b'efghij')
+        self.assertEqual(tail.getvalue(), 'cdefghij')
+
+        tail.write(b'0123456789')
+        self.assertEqual(tail.getvalue(), '23456789')
+
+    def test_progress_is_reported_at_the_interval(self):
+        calls = list()
+
+        def progress(stdout_tail, stderr_tail):
+            calls.append((time.time(), stdout_tail))
+
+        proc, stdout_tail, stderr_tail, io_counters = run_and_capture( \
+            "for i in 1 2 3 4 5; do echo line$i; echo err$i >&2; sleep 0.2; done", \
+            tail_size=10, progress=progress, progress_interval=0.3 )
+        proc.wait()
+
+        self.assertEqual(stdout_tail, "ne4\nline5\n")
+        self.assertEqual(stderr_tail, "err4\nerr5\n")
+
+        self.assertGreater(len(calls), 0)
+        for (earlier, _), (later, _) in zip(calls, calls[1:]):
+            self.assertGreaterEqual(later - earlier, 0.3)
+
+
+class ExecTemplateTest(TestCase):
+    def setUp(self):
+        self.params = [
+            CommandBlueprintParam( id=1, name='--mum', prefix='--mum ', position=1, has_no_value=True ),
+            CommandBlueprintParam( id=2, name='-c', prefix='-c ', position=2, default_value='65' ),
+            CommandBlueprintParam( id=3, name='-o', prefix='-o ', position=3, is_optional=False, default_value='out' ),
+            CommandBlueprintParam( id=4, name='<query_in>', prefix=None, position=4, is_optional=False ),
+            CommandBlueprintParam( id=5, name='--title', prefix='--title=', position=5, has_quoted_value=True ),
+        ]
+        self.template = ExecTemplate('/usr/bin/nucmer', self.params)
+
+    def test_only_required_params_without_values(self):
+        self.assertEqual(self.template.render({4: 'q.fna'}), '/usr/bin/nucmer -o out q.fna')
+
+    def test_set_values_in_position_order(self):
+        self.assertEqual(self.template.render({5: 'a run', 1: '', 4: 'q.fna', 2: '100'}),
+                         '/usr/bin/nucmer --mum -c 100 -o out q.fna --title="a run"')
+
+    def test_quoting_switches_to_single_quotes(self):
+        self.assertEqual(self.template.render({4: 'q.fna', 5: 'say "hi"'}),
+                         '/usr/bin/nucmer -o out q.fna --title=\'say "hi"\'')
+
+
+
+class RegistryTest(TestCase):
+    def setUp(self):
+        self.flow_bp = FlowBlueprint(name='grep', type='s')
+        self.flow_bp.save()
+
+        self.command_bp = CommandBlueprint(parent=self.flow_bp, name='Run grep', exec_path='/bin/grep')
+        self.command_bp.save()
+
+        CommandBlueprintParam( command=self.command_bp, name='-c', prefix='-c ', position=1, has_no_value=True ).save()
+        CommandBlueprintParam( command=self.command_bp, name='<input>', position=2, is_optional=False ).save()
+
+    def test_commands_render_without_blueprint_queries(self):
+        command = Command.objects.get(parent=self.flow_bp.build())
+        registry.get_registry()
+
+        with CaptureQueriesContext(connection) as queries:
+            command.set_param('<input>', 'reads.fq')
+            self.assertEqual(command.build_exec_string(), '/bin/grep reads.fq')
+
+        ## the params came from the registry
+        self.assertFalse(any('flow_commandblueprintparam' in q['sql'] for q in queries))
+
+    def test_param_changes_reach_the_registry(self):
+        self.assertEqual([p.name for p in registry.get_blueprint(self.command_bp.id).params], ['-c', '<input>'])
+
+        CommandBlueprintParam( command=self.command_bp, name='-i', prefix='-i ', position=3, has_no_value=True ).save()
+        self.assertEqual([p.name for p in registry.get_blueprint(self.command_bp.id).params], ['-c', '<input>', '-i'])
+
+
+class StepPickleTest(TestCase):
+    def setUp(self):
+        self.flow_bp = FlowBlueprint(name='grep', type='s')
+        self.flow_bp.save()
+        CommandBlueprint(parent=self.flow_bp, name='Run grep', exec_path='/bin/grep').save()
+
+    def test_commands_pickle_without_their_tree(self):
+        flow = self.flow_bp.build()
+        command = flow.get_children()[0]
+        self.assertIsNotNone(getattr(command, '_tree', None))
+
+        copy = pickle.loads(pickle.dumps(command))
+
+        self.assertIsNone(getattr(copy, '_tree', None))
+        self.assertEqual((copy.id, copy.parent_id, copy.state), (command.id, command.parent_id, command.state))
+        self.assertEqual(copy.get_parent_flow().id, flow.id)
+
+
+class SetParamsTest(TestCase):
+    def setUp(self):
+        self.flow_bp = FlowBlueprint(name='grep', type='s')
+        self.flow_bp.save()
+
+        command_bp = CommandBlueprint(parent=self.flow_bp, name='Run grep', exec_path='/bin/grep')
+        command_bp.save()
+
+        CommandBlueprintParam( command=command_bp, name='-m', prefix='-m ', position=1 ).save()
+        CommandBlueprintParam( command=command_bp, name='<input>', position=2, is_optional=False ).save()
+
+    def test_values_are_replaced(self):
+        command = Command.objects.get(parent=self.flow_bp.build())
+        command.set_params({'-m': '1', '<input>': 'a.fq'})
+        command.set_params({'-m': '5'})
+
+        self.assertEqual(CommandParam.objects.filter(command=command).count(), 2)
+        self.assertEqual(command.build_exec_string(), '/bin/grep -m 5 a.fq')
+        self.assertRaises(Exception, command.set_params, {'-x': '1'})
+
+    def test_fan_out_takes_a_fixed_number_of_queries(self):
+        flows = self.flow_bp.build_many(50)
+        registry.get_registry()
+
+        with CaptureQueriesContext(connection) as queries:
+            Flow.set_params_many( dict((flow, {'Run grep': {'<input>': 'sample{0}.fq'.format(i)}}) \
+                                       for i, flow in enumerate(flows)) )
+
+        ## commands, delete, insert and the transaction's savepoint
+        self.assertLessEqual(len(queries), 5)
+
+        self.assertEqual(CommandParam.objects.filter(value='sample7.fq').count(), 1)
+
+
+class ValidationTest(TestCase):
+    def setUp(self):
+        self.flow_bp = FlowBlueprint(name='grep twice', type='p')
+        self.flow_bp.save()
+
+        for name, exec_path in (('Run grep', '/bin/grep'), ('Run typo', '/bin/no_such_grep')):
+            command_bp = CommandBlueprint(parent=self.flow_bp, name=name, exec_path=exec_path)
+            command_bp.save()
+            CommandBlueprintParam( command=command_bp, name='<input>', position=1, is_optional=False ).save()
+
+    def test_unrunnable_commands_are_failed_up_front(self):
+        flow = self.flow_bp.build()
+        flow.set_params({'Run grep': {'<input>': 'reads.fq'}})
+
+        problems = validate_flow(flow)
+
+        grep = Command.objects.get(parent=flow, name='Run grep')
+        typo = Command.objects.get(parent=flow, name='Run typo')
+
+        self.assertEqual(list(problems.keys()), [typo.id])
+        self.assertEqual(len(problems[typo.id]), 2)
+        self.assertEqual((grep.state, typo.state), ('u', 'e'))
+        self.assertTrue(typo.stderr_tail.startswith('ERROR: '))
+        self.assertEqual(Flow.objects.get(id=flow.id).children_failed, 1)
+
+    def test_scatter_chunks_are_produced_by_the_split(self):
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+
+        path = os.path.join(work_dir, 'contigs.fna')
+        with open(path, 'w') as fh:
+            fh.write(">c1\nACGT\n>c2\nACGT\n>c3\nACGT\n")
+
+        command_bp = CommandBlueprint.objects.get(name='Run grep')
+        Filetype(name='FASTA (nucleotide)', format='FASTA').save()
+        tool = Tool(name='grep', version='2.14')
+        tool.save()
+        tool.needs('FASTA (nucleotide)', via_command=command_bp, via_param='<input>')
+
+        flow = build_scatter_flow(command_bp, '<input>', path, 3, work_dir=os.path.join(work_dir, 'chunks'))
+
+        self.assertEqual(validate_flow(flow), dict())
+
+
+class FlowDispatchTest(TestCase):
+    def setUp(self):
+        self.flow_bp = FlowBlueprint(name='true', type='s')
+        self.flow_bp.save()
+
+        self.command_bp = CommandBlueprint(parent=self.flow_bp, name='Run true', exec_path='/bin/true')
+        self.command_bp.save()
+
+    def build_flow(self, type, count):
+        flow = Flow(blueprint=self.flow_bp, type=type, name='{0} x{1}'.format(type, count))
+        flow.save()
+
+        for i in range(count):
+            self.command_bp.build(parent=flow)
+
+        return Flow.objects.get(id=flow.id)
+
+    def test_cached_children_are_dispatched_without_recursing(self):
+        flow = self.build_flow('s', 300)
+        hit = types.SimpleNamespace(command=types.SimpleNamespace(stdout_tail='', stderr_tail=''))
+
+        with mock.patch('flow.cache.get_cache_key', return_value=('a' * 64, dict())), \
+             mock.patch('flow.cache.restore', return_value=hit):
+            flow.run(wait=False, validate=False)
+
+        self.assertEqual(Flow.objects.get(id=flow.id).state, 'c')
+        self.assertEqual(Command.objects.filter(parent=flow, state='c').count(), 300)
+
+    def get_counts(self, flow):
+        return Flow.objects.filter(id=flow.id).values_list(*Flow.CHILD_COUNTERS)[0]
+
+    def test_state_changes_move_counters(self):
+        flow = self.build_flow('p', 3)
+        first, second, third = flow.get_children()
+        self.assertEqual(self.get_counts(flow), (3, 0, 0, 0, 0))
+
+        self.assertTrue(first.claim())
+        self.assertEqual(self.get_counts(flow), (2, 1, 0, 0, 0))
+
+        ## pending and running are both executing
+        first.set_state('r', report=False)
+        self.assertEqual(self.get_counts(flow), (2, 1, 0, 0, 0))
+
+        first.set_state('c', report=False)
+        self.assertEqual(self.get_counts(flow), (2, 0, 1, 0, 0))
+
+        second.claim()
+        second.set_state('f', report=False)
+        self.assertEqual(self.get_counts(flow), (1, 0, 1, 1, 0))
+
+        ## only unrun steps can be claimed
+        self.assertFalse(first.claim())
+        self.assertEqual(self.get_counts(flow), (1, 0, 1, 1, 0))
+
+        ## a step whose row has moved on underneath it still leaves the counters right
+        Command.objects.get(id=third.id).claim()
+        third.set_state('c', report=False)
+        self.assertEqual(self.get_counts(flow), (0, 0, 2, 1, 0))
+
+    def test_parallel_flows_respect_their_limit(self):
+        flow = self.build_flow('p', 5)
+        Flow.objects.filter(id=flow.id).update(max_concurrency=2)
+        flow = Flow.objects.get(id=flow.id)
+
+        def start(command, **kwargs):
+            command.set_state('r', report=False)
+
+        with mock.patch.object(Command, 'run', autospec=True, side_effect=start):
+            flow.start()
+            self.assertEqual(self.get_counts(flow), (3, 2, 0, 0, 0))
+            self.assertEqual(Flow.objects.get(id=flow.id).state, 'r')
+
+            ## a finished child makes room for exactly one more
+            Command.objects.filter(parent=flow, state='r').first().set_state('c')
+            self.assertEqual(self.get_counts(flow), (2, 2, 1, 0, 0))
+
+    def test_serial_flows_stop_at_a_failure(self):
+        flow = self.build_flow('s', 3)
+
+        def fail(command, **kwargs):
+            command.set_state('f', report=False)
+
+        with mock.patch.object(Command, 'run', autospec=True, side_effect=fail):
+            flow.start()
+
+        self.assertEqual(self.get_counts(flow), (2, 0, 0, 1, 0))
+        self.assertEqual(Flow.objects.get(id=flow.id).state, 'f')
+
+
+class DependencyGraphTest(TestCase):
+    def setUp(self):
+        self.flow_bp = FlowBlueprint(name='pipeline', type='d')
+        self.flow_bp.save()
+
+        self.make_bp = CommandBlueprint(parent=self.flow_bp, name='Make', exec_path='/bin/touch')
+        self.make_bp.save()
+        CommandBlueprintParam( command=self.make_bp, name='<output>', position=1, is_optional=False ).save()
+
+        self.join_bp = CommandBlueprint(parent=self.flow_bp, name='Join', exec_path='/bin/cat')
+        self.join_bp.save()
+        for position, name in enumerate(('<left>', '<right>')):
+            CommandBlueprintParam( command=self.join_bp, name=name, position=position + 1, is_optional=False ).save()
+
+        Filetype(name='Plain text', format='text').save()
+        tool = Tool(name='text tools', version='1')
+        tool.save()
+        tool.creates('Plain text', via_command=self.make_bp, via_param='<output>')
+        tool.needs('Plain text', via_command=self.join_bp, via_param='<left>')
+        tool.needs('Plain text', via_command=self.join_bp, via_param='<right>')
+
+        self.flow = Flow(blueprint=self.flow_bp, type='d', name='pipeline')
+        self.flow.save()
+
+    def add(self, command_bp, params):
+        command = command_bp.build(parent=self.flow)
+        command.set_params(params)
+        return command
+
+    def get_graph(self):
+        return DependencyGraph(Flow.objects.get(id=self.flow.id).get_children())
+
+    def test_consumer_waits_for_every_producer(self):
+        join = self.add(self.join_bp, {'<left>': '/data/a.txt', '<right>': '/data/b.txt'})
+        make_a = self.add(self.make_bp, {'<output>': '/data/a.txt'})
+        make_b = self.add(self.make_bp, {'<output>': '/data/b.txt'})
+
+        graph = self.get_graph()
+        children = dict((c.id, c) for c in graph.children)
+
+        self.assertEqual(graph.depends_on[join.id], set([make_a.id, make_b.id]))
+        self.assertEqual([c.id for c in graph.ready()], [make_a.id, make_b.id])
+
+        children[make_a.id].state = 'c'
+        self.assertEqual([c.id for c in graph.ready()], [make_b.id])
+
+        children[make_b.id].state = 'c'
+        self.assertEqual([c.id for c in graph.ready()], [join.id])
+
+    def test_consumer_without_producer_is_ready(self):
+        make = self.add(self.make_bp, {'<output>': '/data/a.txt'})
+        join = self.add(self.join_bp, {'<left>': '/elsewhere/a.txt', '<right>': '/elsewhere/b.txt'})
+
+        graph = self.get_graph()
+
+        self.assertEqual(graph.depends_on[join.id], set())
+        self.assertEqual([c.id for c in graph.ready()], [make.id, join.id])
+
+    def test_circular_dependencies_fail_the_flow_up_front(self):
+        copy_bp = CommandBlueprint(parent=self.flow_bp, name='Copy', exec_path='/bin/cp')
+        copy_bp.save()
+        CommandBlueprintParam( command=copy_bp, name='<in>', position=1, is_optional=False ).save()
+        CommandBlueprintParam( command=copy_bp, name='<out>', position=2, is_optional=False ).save()
+
+        tool = Tool.objects.get(name='text tools')
+        tool.needs('Plain text', via_command=copy_bp, via_param='<in>')
+        tool.creates('Plain text', via_command=copy_bp, via_param='<out>')
+
+        self.add(copy_bp, {'<in>': '/data/a.txt', '<out>': '/data/b.txt'})
+        self.add(copy_bp, {'<in>': '/data/b.txt', '<out>': '/data/a.txt'})
+
+        graph = self.get_graph()
+        self.assertIn('circular', graph.error)
+        self.assertEqual(graph.ready(), [])
+
+        flow = Flow.objects.get(id=self.flow.id)
+        problems = flow.run(wait=False, validate=False)
+
+        self.assertIn('circular', problems[flow.id][0])
+        self.assertEqual(Flow.objects.get(id=flow.id).state, 'e')
+        self.assertEqual(flow.get_children()[0].state, 'u')
+
+
+class SlotSchedulerTest(TestCase):
+    def test_parse_memory(self):
+        self.assertEqual(parse_memory('10G'), 10240)
+        self.assertEqual(parse_memory('512m'), 512)
+        self.assertEqual(parse_memory('300'), 300)
+        self.assertIsNone(parse_memory('lots'))
+
+    def test_choose_queue(self):
+        queues = [('small', 1, 4000), ('medium', 4, 16000), ('big', 16, None)]
+
+        self.assertEqual(choose_queue(queues, 1, 0), 'small')
+        self.assertEqual(choose_queue(queues, 1, 8000), 'medium')
+        self.assertEqual(choose_queue(queues, 8, 100000), 'big')
+        self.assertEqual(choose_queue(queues, 32, 0), 'big')
+
+    def test_backfills_around_a_big_job_a_limited_number_of_times(self):
+        slots = SlotScheduler(cpus=8, memory=32000, max_backfill=2)
+        slots.add('assembly', cpus=4, memory=8000)
+        slots.add('huge assembly', cpus=8, memory=30000)
+        for name in ('s1', 's2', 's3'):
+            slots.add(name, cpus=1, memory=100)
+
+        self.assertEqual(slots.schedule(), ['assembly', 's1', 's2'])
+
+        ## s3 would fit, but has to wait for the big job now
+        slots.release('assembly')
+        self.assertEqual(slots.schedule(), [])
+
+        slots.release('s1')
+        slots.release('s2')
+        self.assertEqual(slots.schedule(), ['huge assembly'])
+        self.assertEqual(slots.free_cpus, 0)
+
+    def test_oversized_jobs_run_alone(self):
+        slots = SlotScheduler(cpus=2, memory=1000)
+        slots.add('too big', cpus=16, memory=64000)
+        self.assertEqual(slots.schedule(), ['too big'])
+
+
+class ResultCacheFilesTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'reads.fastq')
+        with open(self.path, 'w') as fh:
+            fh.write("@r1\nACGT\n+\nIIII\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_digest_follows_content(self):
+        digest = file_digest(self.path)
+        self.assertEqual(file_digest(self.path), digest)
+
+        with open(self.path, 'a') as fh:
+            fh.write("@r2\nACGT\n+\nIIII\n")
+        self.assertNotEqual(file_digest(self.path), digest)
+        self.assertIsNone(file_digest(os.path.join(self.dir, 'missing')))
+
+    def test_link_output(self):
+        dest = os.path.join(self.dir, 'run2', 'reads.fastq')
+        self.assertTrue(link_output(self.path, dest))
+        self.assertTrue(os.path.samefile(self.path, dest))
+
+        ## something else already there isn't replaced
+        other = os.path.join(self.dir, 'other')
+        open(other, 'w').close()
+        self.assertFalse(link_output(self.path, other))
+
+    def test_partial_restores_are_undone(self):
+        flow_bp = FlowBlueprint(name='copy', type='s')
+        flow_bp.save()
+        CommandBlueprint(parent=flow_bp, name='Run cp', exec_path='/bin/cp').save()
+
+        other = os.path.join(self.dir, 'other.fastq')
+        with open(other, 'w') as fh:
+            fh.write("@r2\nACGT\n+\nIIII\n")
+
+        first, second = [Command.objects.get(parent=flow_bp.build()) for i in range(2)]
+        first.cache_key = second.cache_key = 'b' * 64
+        first.cache_outputs = {1: self.path, 2: other}
+        store(first)
+
+        ## the second output's path is already taken by something else
+        run_dir = os.path.join(self.dir, 'run2')
+        os.makedirs(run_dir)
+        second.cache_outputs = dict((i, os.path.join(run_dir, '{0}.fastq'.format(i))) for i in (1, 2))
+        for path in second.cache_outputs.values():
+            open(path, 'w').close()
+        os.remove(second.cache_outputs[1])
+
+        self.assertIsNone(restore(second))
+        self.assertFalse(os.path.exists(second.cache_outputs[1]))
+        self.assertTrue(os.path.exists(second.cache_outputs[2]))
+
+    def test_overwritten_outputs_are_a_miss(self):
+        flow_bp = FlowBlueprint(name='copy', type='s')
+        flow_bp.save()
+        CommandBlueprint(parent=flow_bp, name='Run cp', exec_path='/bin/cp').save()
+
+        commands = [Command.objects.get(parent=flow_bp.build()) for i in range(3)]
+        for i, command in enumerate(commands):
+            command.cache_key = 'a' * 64
+            command.cache_outputs = {1: os.path.join(self.dir, 'run{0}'.format(i), 'reads.fastq')}
+
+        commands[0].cache_outputs = {1: self.path}
+        store(commands[0])
+
+        self.assertIsNotNone(restore(commands[1]))
+        self.assertTrue(os.path.samefile(self.path, commands[1].cache_outputs[1]))
+
+        ## rewritten in place, which the link made by the hit above shares
+        with open(self.path, 'a') as fh:
+            fh.write("@r2\nACGT\n+\nIIII\n")
+
+        self.assertIsNone(restore(commands[2]))
+        self.assertFalse(os.path.exists(commands[2].cache_outputs[1]))
+
+
+class ScatterGatherTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_paths_are_not_taken_for_templates(self):
+        path = os.path.join(self.dir, 'reads{1}.fna')
+        with open(path, 'w') as fh:
+            fh.write(">c1\nACGT\n>c2\nACGT\n")
+
+        flow_bp = FlowBlueprint(name='grep', type='s')
+        flow_bp.save()
+        command_bp = CommandBlueprint(parent=flow_bp, name='Run grep', exec_path='/bin/grep')
+        command_bp.save()
+        CommandBlueprintParam( command=command_bp, name='<input>', position=1, is_optional=False ).save()
+        CommandBlueprintParam( command=command_bp, name='-o', prefix='-o ', position=2, \
+                               default_value=os.path.join(self.dir, 'hits{}.txt') ).save()
+
+        work_dir = os.path.join(self.dir, 'work{x}')
+        flow = build_scatter_flow(command_bp, '<input>', path, 2, gather={'-o': 'concat'}, work_dir=work_dir)
+
+        def value(command_name, param_name):
+            return CommandParam.objects.get(command__root=flow, command__name=command_name, name=param_name).value
+
+        self.assertEqual( value('Split input into chunks', '<output_template>').format(1), \
+                          os.path.join(work_dir, 'chunk_1.reads{1}.fna') )
+        self.assertEqual(value('Run grep (chunk 2)', '<input>'), os.path.join(work_dir, 'chunk_1.reads{1}.fna'))
+        self.assertEqual(value('Run grep (chunk 2)', '-o'), os.path.join(work_dir, 'out1_chunk_1.hits{}.txt'))
+        self.assertEqual(value('Gather chunk outputs', '<output>'), os.path.join(self.dir, 'hits{}.txt'))
+
+    def test_split_keeps_records_whole(self):
+        path = os.path.join(self.dir, 'reads.fq')
+        with open(path, 'w') as fh:
+            for i in range(100):
+                ## qualities starting with '@' mustn't be taken for a record start
+                fh.write("@read{0}\nACGTACGT\n+\n@IIIIIII\n".format(i))
+
+        chunk_paths = [os.path.join(self.dir, 'chunk_{0}.fq'.format(i)) for i in range(3)]
+        split(path, chunk_paths, 'fastq')
+
+        for chunk_path in chunk_paths:
+            with open(chunk_path) as fh:
+                lines = fh.readlines()
+            self.assertEqual(len(lines) % 4, 0)
+            self.assertTrue(lines[0].startswith('@read'))
+            self.assertTrue(len(lines) > 80)
+
+        merged = os.path.join(self.dir, 'merged.fq')
+        gather(merged, chunk_paths, 'concat')
+        with open(merged) as a, open(path) as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_gff3_ids_are_made_unique(self):
+        chunk_paths = list()
+        for i in range(2):
+            chunk_paths.append(os.path.join(self.dir, 'chunk_{0}.gff3'.format(i)))
+            with open(chunk_paths[-1], 'w') as fh:
+                fh.write("##gff-version 3\nc{0}\tProdigal\tCDS\t1\t90\t.\t+\t0\tID=1_1;partial=00\n".format(i))
+
+        merged = os.path.join(self.dir, 'merged.gff3')
+        gather(merged, chunk_paths, 'gff3')
 
-# Create your tests here.
+        with open(merged) as fh:
+            lines = fh.readlines()
+        self.assertEqual(lines[0], "##gff-version 3\n")
+        self.assertEqual([l.split('\t')[8].split(';')[0] for l in lines[1:]], ['ID=chunk1_1_1', 'ID=chunk2_1_1'])
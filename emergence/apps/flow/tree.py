@@ -0,0 +1,113 @@
+"""
+In-memory representation of a whole Step or StepBlueprint tree.
+
+Every Step (and StepBlueprint) records the top of the tree it belongs to in its 'root'
+column, so the entire tree along with each node's concrete subclass (Flow, Command, etc.)
+comes back in a single query no matter how deep or wide it is.  Flows and blueprints
+share the loaded tree with every node in it, so walking children, building and rolling up
+states after the first load costs nothing more.
+
+Keep in mind this is a snapshot.  Changes made through the nodes of the tree are seen by
+everything sharing it, but changes made by other processes aren't until it's reloaded.
+"""
+
+from django.db import models
+
+
+def _subclass_cache_names(base_model):
+    """
+    Get a list of all the attrs relating to Child models.
+    http://musings.tinbrain.net/blog/2013/jun/24/django-and-model-inheritance/
+    """
+    return dict(
+        (rel.var_name, rel.get_cache_name())
+        for rel in base_model._meta.get_all_related_objects()
+        if issubclass(rel.field.model, base_model) and isinstance(rel.field, models.OneToOneField)
+    )
+
+
+class StepTree(object):
+
+    def __init__(self, step, base_model):
+        self.base_model = base_model
+        self.root_id = step.root_id or step.id
+
+        ## node id -> concrete object, and parent id -> list of child ids in creation order
+        self.nodes = dict()
+        self.child_ids = dict()
+
+        child_attrs = _subclass_cache_names(base_model)
+        qset = base_model.objects.filter(models.Q(root=self.root_id) | models.Q(id=self.root_id))
+
+        for obj in qset.select_related(*child_attrs.keys()).order_by('id'):
+            # Try to find any children...
+            sobj = obj
+            for child in child_attrs.values():
+                if obj.__dict__.get(child) is not None:
+                    sobj = obj.__dict__.get(child)
+                    break
+
+            ## the caller's own object stands in for its row, so state changes it makes are
+            #  visible to anything walking up the tree from below
+            if sobj.id == step.id:
+                sobj = step
+
+            sobj._tree = self
+            self.nodes[sobj.id] = sobj
+            self.child_ids.setdefault(sobj.parent_id, list()).append(sobj.id)
+
+    def get(self, step_id):
+        return self.nodes[step_id]
+
+    def children_of(self, step_id):
+        return [self.nodes[i] for i in self.child_ids.get(step_id, list())]
+
+    def parent_of(self, step_id):
+        parent_id = self.nodes[step_id].parent_id
+
+        if parent_id is None:
+            return None
+        else:
+            return self.nodes[parent_id]
+
+    def descendants_of(self, step_id):
+        """
+        Every node beneath the given one, depth first, in creation order.
+        """
+        for child in self.children_of(step_id):
+            yield child
+            for grandchild in self.descendants_of(child.id):
+                yield grandchild
+
+
+class TreeNodeMixin(object):
+    """
+    Methods shared by Step and StepBlueprint for loading and using the tree they belong to.
+    Classes using this must define tree_base_model.
+    """
+
+    def get_tree(self):
+        tree = getattr(self, '_tree', None)
+
+        if tree is None:
+            tree = StepTree(self, self.tree_base_model)
+
+        return tree
+
+    def refresh_tree(self):
+        """
+        Discards any loaded tree so the next call to get_tree() reads it fresh.
+        """
+        self._tree = None
+        return self.get_tree()
+
+    def get_children(self):
+        return self.get_tree().children_of(self.id)
+
+    def set_root(self):
+        """
+        Fills in the root column from the parent, if needed.  Called on save.
+        """
+        if self.parent_id is not None and self.root_id is None:
+            parent = self.parent
+            self.root_id = parent.root_id or parent.id
@@ -0,0 +1,246 @@
+"""
+Checks run over a whole Flow before it's started, so commands which can't possibly work
+are failed up front rather than after a trip through the broker and a wait for a worker.
+
+For every unrun Command beneath the flow this checks that:
+
+  - each required CommandBlueprintParam has a value, set or default
+  - the blueprint's executable exists and can be executed
+  - each input file named through the tool's ToolFiletypeParams exists and can be read,
+    unless another command in the flow is going to write it (including the split step
+    of a scatter flow, see flow.scatter.get_helper_outputs)
+  - each output file's directory can be written to (or, if it doesn't exist yet, the
+    nearest directory above it which does)
+
+Blueprints come from the registry (see flow.registry) and the values set on all the
+commands are read in one query, so the only cost that grows with the flow is the
+filesystem checks.  A fan-out of thousands of commands usually names the same few
+executables and directories over and over, so each path is only checked once per call.
+
+The checks are made from the process starting the flow, which for Celery assumes the
+workers see the same filesystem (as they must for the flow to work at all.)  They can be
+turned off with the FLOW_VALIDATE setting or by passing validate=False to Flow.run()
+
+Dependency flows are also checked for children which can never start because they wait
+on each other's files (see check_dependencies.)  Flow.run() always does that, as such a
+flow would otherwise just sit in the running state.
+"""
+
+import glob
+import os
+import shlex
+import shutil
+
+from django.db.models import get_model
+
+from flow import registry
+from flow.scheduler import DependencyGraph, get_io_paths
+
+
+class _PathChecks(object):
+    """
+    Memoized filesystem checks, for the length of one validation.
+    """
+
+    def __init__(self):
+        self._results = dict()
+
+    def _cached(self, kind, path, check):
+        key = (kind, path)
+
+        if key not in self._results:
+            self._results[key] = check(path)
+
+        return self._results[key]
+
+    def executable(self, exec_path):
+        try:
+            words = shlex.split(exec_path)
+        except ValueError:
+            return False
+
+        ## exec paths can carry arguments, like "python3 /path/to/script.py split"
+        return len(words) > 0 and self._cached('x', words[0], shutil.which) is not None
+
+    def readable(self, path):
+        return self._cached('r', path, _is_readable)
+
+    def writable_dir(self, path):
+        return self._cached('w', path, _is_writable_dir)
+
+
+def _is_readable(path):
+    if os.path.exists(path):
+        return os.access(path, os.R_OK)
+
+    ## some inputs name a prefix rather than a file, like a Bowtie index
+    return any(os.access(p, os.R_OK) for p in glob.glob(glob.escape(path) + '.*'))
+
+
+def _is_writable_dir(path):
+    ## walks up to the nearest directory which exists, as tools often create their own
+    directory = os.path.dirname(os.path.abspath(path))
+
+    while not os.path.exists(directory):
+        directory = os.path.dirname(directory)
+
+    return os.path.isdir(directory) and os.access(directory, os.W_OK | os.X_OK)
+
+
+def _produced_by(path, outputs):
+    """
+    True if the path is one of the outputs or lives underneath one of them.  Like
+    flow.scheduler's check, but a lookup per directory level rather than a scan.
+    """
+    path = path.rstrip('/')
+
+    while path not in ('', '/'):
+        if path in outputs:
+            return True
+
+        path = os.path.dirname(path)
+
+    return False
+
+
+def validate_commands(commands):
+    """
+    Checks a list of Commands and returns a dict of Command id -> list of problems found,
+    for those with any.  The commands are checked as a group, so an input one of them
+    writes isn't required to exist.
+    """
+    CommandParam = get_model('flow', 'CommandParam')
+
+    problems = dict()
+    if len(commands) == 0:
+        return problems
+
+    values = dict()
+    for command_id, param_id, value in CommandParam.objects.filter(command__in=[c.id for c in commands]) \
+                                                           .order_by('id') \
+                                                           .values_list('command', 'blueprint', 'value'):
+        values.setdefault(command_id, dict())[param_id] = value
+
+    ## imported here as flow.scatter imports flow.models, which imports this
+    from flow.scatter import get_helper_outputs
+
+    io_paths = get_io_paths(commands, values=values)
+
+    produced = set()
+    for inputs, outputs in io_paths.values():
+        produced.update(o.rstrip('/') for o in outputs)
+
+    ## helpers without a tool definition, like the split step of a scatter flow
+    for command in commands:
+        blueprint = registry.get_blueprint(command.blueprint_id)
+        command_values = values.get(command.id, dict())
+        values_by_name = dict( (p.name, command_values.get(p.id, p.default_value)) for p in blueprint.params )
+
+        produced.update( o.rstrip('/') for o in get_helper_outputs(blueprint.exec_path, values_by_name) )
+
+    checks = _PathChecks()
+
+    for command in commands:
+        blueprint = registry.get_blueprint(command.blueprint_id)
+        command_values = values.get(command.id, dict())
+        found = list()
+
+        for param in blueprint.params:
+            if param.is_optional or param.has_no_value:
+                continue
+
+            if not command_values.get(param.id, param.default_value):
+                found.append("required param '{0}' has no value".format(param.name))
+
+        if not checks.executable(blueprint.exec_path):
+            found.append("'{0}' can't be found or executed".format(blueprint.exec_path))
+
+        inputs, outputs = io_paths[command.id]
+
+        for path in sorted(inputs):
+            if not _produced_by(path, produced) and not checks.readable(path):
+                found.append("input '{0}' doesn't exist or can't be read".format(path))
+
+        for path in sorted(outputs):
+            if not checks.writable_dir(path):
+                found.append("can't write output '{0}' to its directory".format(path))
+
+        if len(found) > 0:
+            problems[command.id] = found
+
+    return problems
+
+
+def validate_flow(flow, mark=None):
+    """
+    Checks every unrun Command beneath a Flow (see validate_commands) and returns a dict
+    of Command id -> list of problems.
+
+    Unless 'mark' is False, commands with problems are then put in the error state with
+    the problems as their stderr_tail, and the child counters of the flows holding them
+    rebuilt.  That's a pair of UPDATEs per distinct set of problems rather than per command.
+    """
+    Command = get_model('flow', 'Command')
+    Step = get_model('flow', 'Step')
+
+    if mark is None:
+        mark = True
+
+    tree = flow.get_tree()
+    commands = [s for s in tree.descendants_of(flow.id) if isinstance(s, Command) and s.state == 'u']
+    problems = validate_commands(commands)
+
+    if not mark or len(problems) == 0:
+        return problems
+
+    ## error text -> ids of the commands failing with it
+    by_message = dict()
+    for command_id, found in problems.items():
+        message = "\n".join("ERROR: {0}".format(p) for p in found)
+        by_message.setdefault(message, list()).append(command_id)
+
+    for message, command_ids in by_message.items():
+        Step.objects.filter(id__in=command_ids, state='u').update(state='e')
+        Command.objects.filter(id__in=command_ids).update(stderr_tail=message)
+
+        for command_id in command_ids:
+            command = tree.get(command_id)
+            command.state = 'e'
+            command.stderr_tail = message
+
+    for parent_id in set(tree.get(command_id).parent_id for command_id in problems):
+        if parent_id is not None:
+            tree.get(parent_id).recount_children()
+
+    return problems
+
+
+def check_dependencies(flow, mark=None):
+    """
+    Looks for circular file dependencies between the children of every dependency flow
+    at or beneath 'flow' which hasn't already completed, and returns a dict of Flow id -> list of problems, for those
+    with any.  Unless 'mark' is False those flows are put in the error state, so they are
+    never started.  This costs a query per dependency flow.
+    """
+    Flow = get_model('flow', 'Flow')
+
+    if mark is None:
+        mark = True
+
+    tree = flow.get_tree()
+    flows = [tree.get(flow.id)] + [s for s in tree.descendants_of(flow.id) if isinstance(s, Flow)]
+
+    problems = dict()
+    for dep_flow in flows:
+        if dep_flow.type != 'd' or dep_flow.state == 'c':
+            continue
+
+        graph = DependencyGraph(tree.children_of(dep_flow.id))
+
+        if graph.error is not None:
+            problems[dep_flow.id] = [graph.error]
+
+            if mark:
+                dep_flow.set_state('e', report=False)
+
+    return problems
@@ -1,5 +1,6 @@
 from django.db import models
 from biotools.models import Tool
+from biotools.discovery import get_runnable_tool_ids
 from flow.models import Flow
 from fileserver.models import DataSource
 
@@ -33,10 +34,11 @@ class Workspace(models.Model):
         self.data.add(data_source)
 
     def get_available_tools(self):
-        # Iterate through all tools here.  In the future we'll want to do some
-        #  intelligent sorting here, such as by tool popularity
-        tools = Tool.objects.all()
-        return tools
-
-        #for tool in tools:
-            
+        """
+        Returns the tools whose required inputs are all satisfied by the types of data in
+        this workspace, looked up in the tool discovery index (see biotools.discovery.)
+        """
+        filetype_ids = self.data.filter(filetype__isnull=False).values_list('filetype_id', flat=True).distinct()
+
+        # In the future we'll want to do some intelligent sorting here, such as by tool popularity
+        return Tool.objects.filter(id__in=get_runnable_tool_ids(filetype_ids)).order_by('name', 'version')
@@ -0,0 +1,121 @@
+"""
+Helpers for inserting many rows at once.
+
+Django's bulk_create() refuses models using multi-table inheritance (Flow, Command,
+LocalFile and friends) since most database backends can't hand back the ids of the rows
+just inserted into the parent table.  We get around that by assigning the primary keys
+ourselves, after which each table in the inheritance chain is a single INSERT (or a few,
+on backends limiting the number of parameters per statement.)
+"""
+
+from django.core.management.color import no_style
+from django.db import connection
+
+
+def _inheritance_chain(model):
+    """
+    Returns the concrete models from the top-most parent down to the passed one.
+    """
+    chain = [model]
+
+    while len(chain[0]._meta.parents) > 0:
+        chain.insert(0, list(chain[0]._meta.parents.keys())[0])
+
+    return chain
+
+
+def reserve_ids(model, count):
+    """
+    Returns a list of 'count' primary key values which are unused in the top-most table of
+    the model's inheritance chain, and which nothing else will be handed.  This must be
+    called inside a transaction (see django.db.transaction.atomic), and the rows inserted
+    before it's committed.
+
+    How they're reserved depends on the backend:
+
+      postgresql  drawn from the table's own sequence, like any other insert
+      sqlite      the highest id plus one onwards, after taking the database's write lock
+      mysql       the same, after locking the highest row and the gap above it (InnoDB)
+      others      the same, after locking the whole table
+    """
+    base = _inheritance_chain(model)[0]
+    table = base._meta.db_table
+    column = base._meta.pk.column
+
+    if count == 0:
+        return list()
+
+    cursor = connection.cursor()
+
+    if connection.vendor == 'postgresql':
+        cursor.execute( "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)", \
+                        [connection.ops.quote_name(table), column, count] )
+        return sorted(row[0] for row in cursor.fetchall())
+
+    if connection.vendor == 'sqlite':
+        ## a write, even one changing nothing, holds off every other writer until we commit
+        cursor.execute( "UPDATE {0} SET {1} = {1} WHERE 0 = 1".format(connection.ops.quote_name(table), \
+                                                                    connection.ops.quote_name(column)) )
+        last = list(base.objects.order_by('-pk').values_list('pk', flat=True)[:1])
+    elif connection.vendor == 'mysql':
+        ## concurrent reservations (and inserts past the end) queue up behind this lock
+        last = list(base.objects.select_for_update().order_by('-pk').values_list('pk', flat=True)[:1])
+    else:
+        cursor.execute("LOCK TABLE {0} IN EXCLUSIVE MODE".format(connection.ops.quote_name(table)))
+        last = list(base.objects.order_by('-pk').values_list('pk', flat=True)[:1])
+
+    if len(last) == 0:
+        start = 1
+    else:
+        start = last[0] + 1
+
+    return list(range(start, start + count))
+
+
+def bulk_create_inherited(objs):
+    """
+    Inserts model instances which all have their primary keys already assigned (see
+    reserve_ids), issuing one INSERT per table in the inheritance chain rather than one
+    per object per table.  Like bulk_create(), save() isn't called and no signals are sent.
+    """
+    if len(objs) == 0:
+        return objs
+
+    model = type(objs[0])
+    chain = _inheritance_chain(model)
+    pk_attnames = [m._meta.pk.attname for m in chain]
+
+    for obj in objs:
+        pk = getattr(obj, pk_attnames[0])
+        if pk is None:
+            pk = obj.pk
+        if pk is None:
+            raise Exception("ERROR: bulk_create_inherited() needs primary keys assigned up front")
+
+        ## the id and every parent link share the same value
+        for attname in pk_attnames:
+            setattr(obj, attname, pk)
+
+    ## bulk_create() itself won't take child models, so this goes through the same
+    #  lower-level insert it uses, batched to stay within the backend's parameter limits
+    for table_model in chain:
+        fields = table_model._meta.local_concrete_fields
+        batch_size = max(connection.ops.bulk_batch_size(fields, objs), 1)
+
+        for i in range(0, len(objs), batch_size):
+            table_model._base_manager._insert(objs[i:i + batch_size], fields=fields, using=connection.alias)
+
+    ## Backends with sequences don't notice explicitly inserted keys.  On PostgreSQL they
+    #  came from the sequence in the first place, and winding it back to the highest id
+    #  would hand out ids another process has reserved but not yet inserted.
+    if connection.vendor == 'postgresql':
+        statements = list()
+    else:
+        statements = connection.ops.sequence_reset_sql(no_style(), [chain[0]])
+
+    if len(statements) > 0:
+        cursor = connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+
+    return objs
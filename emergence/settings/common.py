@@ -12,6 +12,44 @@ MANAGERS = ADMINS
 
 # For Celery / RabbitMQ
 BROKER_URL = 'amqp://guest@jorvisvm-lx:5672/'
+CELERY_RESULT_BACKEND = 'amqp'
+
+# Where flow commands run unless a Flow says otherwise: 'celery' or 'local' (a process
+# pool on this machine, which needs no broker.)  The FLOW_LOCAL_* settings size the
+# local pool: worker processes, CPU slots and memory slots in MB.  None means the number
+# of CPUs for the first two and no memory accounting for the last.
+FLOW_DEFAULT_ENVIRONMENT = 'celery'
+FLOW_LOCAL_WORKERS = None
+FLOW_LOCAL_CPUS = None
+FLOW_LOCAL_MEMORY = None
+
+# Celery commands can be routed by what they need, as a list of (queue, cpus, memory in MB)
+# smallest first: each goes to the first queue big enough for it.  Workers for a queue
+# should be started with a concurrency leaving each task that much of the machine, e.g.
+# for ('big', 16, 64000) on a 16 CPU node: celery worker -Q big -c 1.  None sends
+# everything to the default queue.
+FLOW_CELERY_QUEUES = None
+
+# Each command's stdout and stderr are written under here, in a directory per top-level
+# flow.  The last FLOW_LOG_TAIL_SIZE bytes of each are also kept on the Command itself.
+FLOW_LOG_ROOT = '/var/www/emergence/logs/'
+FLOW_LOG_TAIL_SIZE = 16384
+
+# Scratch space for intermediate files, such as the chunks of scatter/gather flows
+FLOW_SCRATCH_ROOT = '/var/www/emergence/scratch/'
+
+# Commands identical to one which has already completed (same tool version, parameters
+# and input file contents) link the earlier outputs instead of running again.
+FLOW_RESULT_CACHE = True
+
+# How often (in seconds) each process checks whether its copy of the command blueprints is
+# out of date, for changes made by other processes.  See flow.registry
+FLOW_REGISTRY_TTL = 30
+
+# Check every command in a flow before it's started (required params set, executables and
+# input files present, output directories writable) and fail those which can't run.  See
+# flow.validation
+FLOW_VALIDATE = True
 
 DATABASES = {
     'default': {
@@ -56,6 +94,16 @@ USE_TZ = True
 # Example: "/var/www/example.com/media/"
 MEDIA_ROOT = '/var/www/emergence/data/'
 
+# Uploads are hashed as they're received, so identical content is only stored once
+# (see fileserver.storage)
+FILE_UPLOAD_HANDLERS = (
+    'emergence.apps.fileserver.storage.HashingMemoryFileUploadHandler',
+    'emergence.apps.fileserver.storage.HashingTemporaryFileUploadHandler',
+)
+
+# Where sequence indexes (.fai, .gzi) go for files in directories we can't write to
+FILESERVER_INDEX_ROOT = '/var/www/emergence/data/indexes/'
+
 # URL that handles the media served from MEDIA_ROOT. Make sure to use a
 # trailing slash.
 # Examples: "http://example.com/media/", "http://media.example.com/"
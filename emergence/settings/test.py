@@ -1,2 +1,5 @@
 # settings/test.py
 from .common import *
+
+# Run flows in a local process pool so tests don't need a broker
+FLOW_DEFAULT_ENVIRONMENT = 'local'